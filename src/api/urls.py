@@ -20,6 +20,7 @@ from accounts.views import (
 from api.views import health_check
 from learning_materials.views import (
     ChatResponseView,
+    ChatResponseStreamView,
     ChatListView,
     ChatView,
     ClusterListView,
@@ -33,6 +34,8 @@ from learning_materials.views import (
     CompendiumCreationView,
     CreateCardsetView,
     FlashcardViewSet,
+    GenerationJobCreateView,
+    GenerationJobDetailView,
     QuizGenerationView,
     QuizGradingView,
     QuizViewSet,
@@ -88,6 +91,11 @@ urlpatterns = [
     path("clustering/", ClusterListView.as_view(), name="clustering"),
     # Chat
     path("chat/response/", ChatResponseView.as_view(), name="chat-response"),
+    path(
+        "chat/response/stream/",
+        ChatResponseStreamView.as_view(),
+        name="chat-response-stream",
+    ),
     path("chat/history/", ChatListView.as_view(), name="chat-history-list"),
     path("chat/history/<uuid:chatId>/", ChatView.as_view(), name="chat-history"),
     # Flashcards
@@ -109,6 +117,9 @@ urlpatterns = [
     path(
         "compendium/create/", CompendiumCreationView.as_view(), name="create-compendium"
     ),
+    # Generation jobs
+    path("jobs/", GenerationJobCreateView.as_view(), name="create-job"),
+    path("jobs/<uuid:job_id>/", GenerationJobDetailView.as_view(), name="job-detail"),
     # Feedback
     path("feedback/", UserFeedback.as_view(), name="feedback"),
     # Router URLs
@@ -0,0 +1,46 @@
+import logging
+
+from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
+from django.conf import settings
+
+from broker.topics import Topic
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_partitions(topic: Topic, partitions: int, timeout: float = 10.0) -> None:
+    """
+    Create the topic with at least the given number of partitions, or add
+    partitions to it if it has fewer. A consumer group runs at most one
+    consumer per partition, so the partitions bound how many consumers of
+    the topic work at once.
+
+    Args:
+        topic (Topic): The topic
+        partitions (int): The number of partitions the topic should at least have
+        timeout (float): The seconds to wait for the broker
+    """
+    admin = AdminClient(
+        {"bootstrap.servers": settings.KAFKA_CONFIGURATION["bootstrap.servers"]}
+    )
+    try:
+        metadata = admin.list_topics(topic.value, timeout=timeout).topics.get(topic.value)
+        if metadata is None or metadata.error is not None:
+            logger.info(f"Creating topic {topic} with {partitions} partitions")
+            futures = admin.create_topics(
+                [NewTopic(topic.value, num_partitions=partitions)], request_timeout=timeout
+            )
+        elif len(metadata.partitions) < partitions:
+            logger.info(
+                f"Increasing the partitions of topic {topic} from {len(metadata.partitions)} to {partitions}"
+            )
+            futures = admin.create_partitions(
+                [NewPartitions(topic.value, partitions)], request_timeout=timeout
+            )
+        else:
+            return
+        for future in futures.values():
+            future.result(timeout=timeout)
+    except Exception as e:
+        # The consumers still work with the partitions the topic has
+        logger.warning(f"Could not ensure the partitions of topic {topic}: {e}")
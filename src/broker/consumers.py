@@ -1,13 +1,20 @@
 import json
 import logging
+import os
+import socket
 import threading
 from typing import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from confluent_kafka import Consumer as KafkaConsumer, KafkaException, KafkaError
 from django.conf import settings
 
+from broker.admin import ensure_partitions
 from broker.topics import Topic
+from config import Config
 from broker.handlers.clustering_handler import handle_document_upload_rag
+from broker.handlers.cache_handler import handle_document_cache_invalidation
+from broker.handlers.job_handler import handle_generation_job
+from broker.handlers.title_handler import handle_title_generation
 from broker.handlers.activity_handler import (
     handle_activity_streak,
     handle_activity_save,
@@ -21,14 +28,20 @@ class ConsumerConfig:
     topics: list[Topic]
     logic: Callable[[dict], None]
     consumer_group: str = "default"
+    # Kafka settings of this consumer which replace those of KAFKA_CONFIGURATION
+    overrides: dict = field(default_factory=dict)
 
 
 class Consumer(threading.Thread):
     def __init__(self, config: ConsumerConfig):
         threading.Thread.__init__(self)
         self.settings = settings
-        settings.KAFKA_CONFIGURATION["group.id"] = config.consumer_group
-        self._consumer = KafkaConsumer(settings.KAFKA_CONFIGURATION)
+        self.configuration = {
+            **settings.KAFKA_CONFIGURATION,
+            "group.id": config.consumer_group,
+            **config.overrides,
+        }
+        self._consumer = KafkaConsumer(self.configuration)
         self.topics = config.topics
         self.logic = config.logic
 
@@ -55,13 +68,24 @@ class Consumer(threading.Thread):
                     logger.error(f"KafkaException Error occurred: {msg.error()}")
                     raise KafkaException(msg.error())
                 else:
-                    # Handle Message
-                    message = json.loads(msg.value().decode("utf-8"))
-                    self.logic(message)
+                    self.handle(msg)
         finally:
             # Close down consumer to commit final offsets.
             self._consumer.close()
 
+    def handle(self, msg) -> None:
+        """
+        Handle one message. A message which fails is logged and skipped, so
+        that it cannot stop the consumer for the messages after it.
+        """
+        try:
+            message = json.loads(msg.value().decode("utf-8"))
+            self.logic(message)
+        except Exception:
+            logger.exception(
+                f"Failed to handle message of {msg.topic()} at offset {msg.offset()}"
+            )
+
 
 CONSUMERS = [
     Consumer(
@@ -72,13 +96,60 @@ CONSUMERS = [
     Consumer(
         ConsumerConfig([Topic.USER_ACTIVITY], handle_activity_save, "activity_save")
     ),
+    # Generation capacity scales with the number of processes in this group, up to the
+    # number of partitions of the topic, which start_consumers sets. A job runs on the
+    # poll thread, so the consumer must be allowed to go without polling for as long as
+    # a job may run, or the group would evict it and the job be delivered again.
+    Consumer(
+        ConsumerConfig(
+            [Topic.GENERATION_JOB],
+            handle_generation_job,
+            "generation_jobs",
+            {
+                "max.poll.interval.ms": int(
+                    (Config().JOB_TIMEOUT_SECONDS + Config().JOB_REQUEUE_DELAY_SECONDS + 60)
+                    * 1000
+                )
+            },
+        )
+    ),
+    Consumer(
+        ConsumerConfig(
+            [Topic.TITLE_GENERATION], handle_title_generation, "title_generation"
+        )
+    ),
     Consumer(
         ConsumerConfig([Topic.USER_ACTIVITY], handle_activity_streak, "activity_streak")
     ),
 ]
 
 
+def document_cache_consumer() -> Consumer:
+    """
+    The consumer keeping the document caches and indexes of this process up
+    to date. Every process holds its own caches, so each one needs its own
+    consumer group, named after the process when the consumers are started
+    so that forked workers do not share one group. A new cache is empty, so
+    the group starts at the latest message instead of replaying the history,
+    and it commits no offsets, so Kafka keeps nothing of it once it is gone.
+    """
+    return Consumer(
+        ConsumerConfig(
+            [Topic.DOCUMENT_UPLOAD_RAG],
+            handle_document_cache_invalidation,
+            f"document_cache_{socket.gethostname()}_{os.getpid()}",
+            {"auto.offset.reset": "latest", "enable.auto.commit": False},
+        )
+    )
+
+
 def start_consumers():
+    # In the background, so that an unreachable broker does not delay the start
+    threading.Thread(
+        target=ensure_partitions,
+        args=(Topic.GENERATION_JOB, Config().GENERATION_JOB_PARTITIONS),
+        daemon=True,
+    ).start()
 
-    for consumer in CONSUMERS:
+    for consumer in [*CONSUMERS, document_cache_consumer()]:
         consumer.start()
@@ -0,0 +1,34 @@
+from uuid import UUID
+from pydantic import BaseModel
+import logging
+
+
+from learning_materials.knowledge_base.answer_cache import answer_cache
+from learning_materials.knowledge_base.document_cache import document_cache
+from learning_materials.knowledge_base import rag_service
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentCacheMessage(BaseModel):
+    """
+    Document upload message used to invalidate cached document data
+    """
+
+    document_id: UUID
+
+
+def handle_document_cache_invalidation(raw_message: dict):
+    """
+    Drop the cached embeddings and answers of a document that has been
+    (re)ingested and bring its ANN and BM25 indexes up to date
+    """
+    message = DocumentCacheMessage.model_validate(raw_message)
+    logger.info(f"Invalidating cached embeddings for document_id: {message.document_id}")
+    document_cache.invalidate(message.document_id)
+    answer_cache.invalidate(message.document_id)
+
+    if rag_service.search_mode != "exact":
+        rag_service.ann_indexes.update(message.document_id)
+    if rag_service.hybrid_search:
+        rag_service.bm25_indexes.update(message.document_id)
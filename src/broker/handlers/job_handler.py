@@ -0,0 +1,14 @@
+import logging
+
+from learning_materials.jobs.job_service import GenerationJobMessage, run_job
+
+logger = logging.getLogger(__name__)
+
+
+def handle_generation_job(raw_message: dict):
+    """
+    Run a submitted flashcard, quiz or compendium generation job
+    """
+    message = GenerationJobMessage.model_validate(raw_message)
+    logger.info(f"Running generation job {message.job_id}")
+    run_job(message.job_id)
@@ -0,0 +1,14 @@
+import logging
+
+from learning_materials.titles.title_service import TitleMessage, generate_title
+
+logger = logging.getLogger(__name__)
+
+
+def handle_title_generation(raw_message: dict):
+    """
+    Replace the placeholder title of a new chat, cardset or quiz
+    """
+    message = TitleMessage.model_validate(raw_message)
+    logger.info(f"Generating title of {message.kind} {message.object_id}")
+    generate_title(message)
@@ -1,5 +1,14 @@
+import json
+from unittest.mock import MagicMock, patch
+from uuid import uuid4
+
+from django.conf import settings
 from django.test import TestCase
+from broker.admin import ensure_partitions
+from broker.consumers import Consumer, ConsumerConfig, document_cache_consumer
+from broker.handlers.title_handler import handle_title_generation
 from broker.producer import producer, KafkaProducerSingleton
+from broker.topics import Topic
 
 
 # Create your tests here.
@@ -10,3 +19,112 @@ class TestProducer(TestCase):
 
         self.assertEqual(kafka_producer_1, kafka_producer_2)
         self.assertEqual(producer, kafka_producer_1)
+
+
+@patch("broker.consumers.KafkaConsumer")
+class TestConsumer(TestCase):
+    def test_overrides_replace_the_shared_settings(self, MockKafkaConsumer):
+        consumer = Consumer(
+            ConsumerConfig(
+                [Topic.DOCUMENT_UPLOAD_RAG],
+                print,
+                "document_cache_host_1",
+                {"auto.offset.reset": "latest", "enable.auto.commit": False},
+            )
+        )
+
+        MockKafkaConsumer.assert_called_once_with(consumer.configuration)
+        self.assertEqual(consumer.configuration["group.id"], "document_cache_host_1")
+        self.assertEqual(consumer.configuration["auto.offset.reset"], "latest")
+        self.assertNotIn("group.id", settings.KAFKA_CONFIGURATION)
+
+    def test_consumers_use_the_shared_settings_by_default(self, MockKafkaConsumer):
+        consumer = Consumer(ConsumerConfig([Topic.USER_ACTIVITY], print, "activity_save"))
+
+        self.assertEqual(
+            consumer.configuration["auto.offset.reset"],
+            settings.KAFKA_CONFIGURATION["auto.offset.reset"],
+        )
+
+
+    def test_document_cache_group_is_named_after_the_running_process(
+        self, MockKafkaConsumer
+    ):
+        with patch("broker.consumers.os.getpid", return_value=1234):
+            first = document_cache_consumer()
+        with patch("broker.consumers.os.getpid", return_value=5678):
+            second = document_cache_consumer()
+
+        self.assertTrue(first.configuration["group.id"].endswith("_1234"))
+        self.assertTrue(second.configuration["group.id"].endswith("_5678"))
+        self.assertEqual(first.configuration["auto.offset.reset"], "latest")
+
+
+class StopConsuming(BaseException):
+    pass
+
+
+def kafka_message(value: dict) -> MagicMock:
+    msg = MagicMock()
+    msg.error.return_value = None
+    msg.value.return_value = json.dumps(value).encode("utf-8")
+    return msg
+
+
+@patch("broker.consumers.KafkaConsumer")
+class TestConsumerRun(TestCase):
+    @patch("broker.handlers.title_handler.generate_title")
+    def test_failing_message_does_not_stop_the_consumer(
+        self, mock_generate_title, MockKafkaConsumer
+    ):
+        mock_generate_title.side_effect = [TimeoutError("LLM timed out"), None]
+        messages = [
+            kafka_message(
+                {"kind": "chat", "object_id": str(uuid4()), "placeholder": "Chat", "language": "en"}
+            )
+            for _ in range(2)
+        ]
+        MockKafkaConsumer.return_value.poll.side_effect = [*messages, StopConsuming()]
+        consumer = Consumer(
+            ConsumerConfig([Topic.TITLE_GENERATION], handle_title_generation, "title_generation")
+        )
+
+        with self.assertLogs("broker.consumers", level="ERROR"):
+            with self.assertRaises(StopConsuming):
+                consumer.run()
+
+        self.assertEqual(mock_generate_title.call_count, 2)
+        MockKafkaConsumer.return_value.close.assert_called_once()
+
+
+@patch("broker.admin.AdminClient")
+class TestEnsurePartitions(TestCase):
+    def topic_metadata(self, MockAdminClient, partitions):
+        metadata = MagicMock(error=None, partitions={i: None for i in range(partitions)})
+        MockAdminClient.return_value.list_topics.return_value.topics = {
+            Topic.GENERATION_JOB.value: metadata
+        }
+
+    def test_missing_topic_is_created(self, MockAdminClient):
+        MockAdminClient.return_value.list_topics.return_value.topics = {}
+
+        ensure_partitions(Topic.GENERATION_JOB, 8)
+
+        (new_topic,), _ = MockAdminClient.return_value.create_topics.call_args
+        self.assertEqual(new_topic[0].num_partitions, 8)
+
+    def test_partitions_are_added_to_a_smaller_topic(self, MockAdminClient):
+        self.topic_metadata(MockAdminClient, 1)
+
+        ensure_partitions(Topic.GENERATION_JOB, 8)
+
+        (new_partitions,), _ = MockAdminClient.return_value.create_partitions.call_args
+        self.assertEqual(new_partitions[0].new_total_count, 8)
+
+    def test_large_enough_topic_is_left_alone(self, MockAdminClient):
+        self.topic_metadata(MockAdminClient, 12)
+
+        ensure_partitions(Topic.GENERATION_JOB, 8)
+
+        MockAdminClient.return_value.create_topics.assert_not_called()
+        MockAdminClient.return_value.create_partitions.assert_not_called()
@@ -10,3 +10,5 @@ class Topic(StrEnum):
     USER_ACTIVITY = "user.activity"
     DOCUMENT_UPLOAD_CDN = "document.upload.cdn"
     DOCUMENT_UPLOAD_RAG = "document.upload.rag"
+    GENERATION_JOB = "generation.job"
+    TITLE_GENERATION = "generation.title"
@@ -19,7 +19,82 @@ class Config:
         self.MONGODB_URI = os.getenv("MONGODB_URI")
         self.MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION")
         self.MONGODB_DATABASE = os.getenv("MONGODB_DATABASE")
+        self.MONGODB_VECTOR_INDEX = os.getenv("MONGODB_VECTOR_INDEX", "vector_index")
         self.RAG_DATABASE_SYSTEM = os.getenv("RAG_DATABASE_SYSTEM", "mongodb")
+        self.RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "exact")
+        self.RAG_HYBRID_SEARCH = (
+            os.getenv("RAG_HYBRID_SEARCH", "false").lower() == "true"
+        )
+        self.RAG_TOP_K = int(os.getenv("RAG_TOP_K", 5))
+        self.RAG_SIMILARITY_THRESHOLD = float(
+            os.getenv("RAG_SIMILARITY_THRESHOLD", 0.2)
+        )
+        self.ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "/tmp/tutorai/ann_indexes")
+        self.ANN_TARGET_RECALL = float(os.getenv("ANN_TARGET_RECALL", 0.95))
+        self.EMBEDDING_COALESCE_WINDOW_MS = float(
+            os.getenv("EMBEDDING_COALESCE_WINDOW_MS", 10)
+        )
+        # Coalesced embedding batches sent at once
+        self.EMBEDDING_COALESCE_MAX_IN_FLIGHT = int(
+            os.getenv("EMBEDDING_COALESCE_MAX_IN_FLIGHT", 4)
+        )
+        self.EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+        self.DOCUMENT_CACHE_MAX_BYTES = int(
+            os.getenv("DOCUMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+        )
+        # An answer cache size of 0 disables the semantic answer cache
+        self.ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+        self.ANSWER_CACHE_TTL_SECONDS = float(
+            os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600)
+        )
+        self.ANSWER_CACHE_SIMILARITY_THRESHOLD = float(
+            os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95)
+        )
+        # Cosine similarity above which generated flashcards and quiz questions
+        # are duplicates of each other, 0 disables the deduplication
+        self.DEDUP_SIMILARITY_THRESHOLD = float(
+            os.getenv("DEDUP_SIMILARITY_THRESHOLD", 0.92)
+        )
+        self.LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 20))
+        self.LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+        # Limits of the outbound LLM and embedding calls, 0 disables a rate limit
+        self.LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+        self.LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+        # Shares the rate limits between processes
+        self.LLM_RATE_LIMIT_REDIS_URL = os.getenv("LLM_RATE_LIMIT_REDIS_URL")
+        self.LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+        self.LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+        self.LLM_LATENCY_SPIKE_FACTOR = float(
+            os.getenv("LLM_LATENCY_SPIKE_FACTOR", 3)
+        )
+        # Connections of the shared LLM HTTP client pool
+        self.LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+        self.LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", 60))
+        self.QUIZ_MAX_CONCURRENCY = int(os.getenv("QUIZ_MAX_CONCURRENCY", 8))
+        self.COMPENDIUM_MAX_CONCURRENCY = int(
+            os.getenv("COMPENDIUM_MAX_CONCURRENCY", 8)
+        )
+        # A running generation job not finished within the timeout is retried,
+        # until it has been claimed JOB_MAX_ATTEMPTS times
+        self.JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", 900))
+        self.JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 2))
+        # A job which cannot get generation capacity is queued again after the delay
+        self.JOB_REQUEUE_DELAY_SECONDS = float(os.getenv("JOB_REQUEUE_DELAY_SECONDS", 5))
+        # Partitions of the generation job topic, the most job workers which can run at once
+        self.GENERATION_JOB_PARTITIONS = int(os.getenv("GENERATION_JOB_PARTITIONS", 8))
+        # Workers and queued tasks of the generation executor shared by all requests
+        self.GENERATION_MAX_WORKERS = int(os.getenv("GENERATION_MAX_WORKERS", 16))
+        self.GENERATION_MAX_QUEUED = int(os.getenv("GENERATION_MAX_QUEUED", 1000))
+        # "parallel", "sequential" or "batch"
+        self.QUIZ_GRADING_MODE = os.getenv("QUIZ_GRADING_MODE", "parallel")
+        self.QUIZ_GRADING_BATCH_SIZE = int(os.getenv("QUIZ_GRADING_BATCH_SIZE", 20))
+        self.QUIZ_GRADING_MAX_CONCURRENCY = int(
+            os.getenv("QUIZ_GRADING_MAX_CONCURRENCY", 16)
+        )
+        self.EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "array")
+        self.MONGODB_ENSURE_INDEXES = (
+            os.getenv("MONGODB_ENSURE_INDEXES", "false").lower() == "true"
+        )
         self.AZURE_STORAGE_CONNECTION_STRING = os.getenv(
             "AZURE_STORAGE_CONNECTION_STRING"
         )
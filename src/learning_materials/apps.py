@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LearningMaterialsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "learning_materials"
+
+    def ready(self):
+        # Register the signal handlers
+        import learning_materials.signals  # noqa: F401
@@ -1,57 +1,204 @@
+import hashlib
+import json
 import logging
 import uuid
 
-from learning_materials.knowledge_base.response_formulation import create_llm_model
+from django.core.cache import caches
+from langchain.output_parsers import PydanticOutputParser
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+
+from config import Config
+from learning_materials.knowledge_base.embedding_cache import normalize_text
+from learning_materials.knowledge_base.llm import create_llm_model
 from learning_materials.knowledge_base.rag_service import get_page_range
 from learning_materials.learning_resources import Compendium, Citation
+from learning_materials.utils.fan_out import fan_out
 
 
 logger = logging.getLogger(__name__)
 
+# Bump when a prompt changes, so that memoized results of the old prompt are not used
+PROMPT_VERSION = 1
+
+# The number of summaries merged by one call of the reduce step
+REDUCE_FAN_IN = 8
+
+
+class PageSummary(BaseModel):
+    """The key concepts and summary of one page, or of a group of pages"""
+
+    key_concepts: list[str] = Field(
+        description="The key concepts, each formatted as 'Concept: Explanation'"
+    )
+    summary: str = Field(description="A summary of the text")
+
+
+page_parser = PydanticOutputParser(pydantic_object=PageSummary)
+
+page_prompt = PromptTemplate(
+    template="""Extract the key concepts and write a summary of the given text: '''{text}'''.
+    Use only the most important concepts and information. Do not include any unnecessary information. Use only the information that is in the text.
+    Format every key concept as "Concept: Explanation", for example "France: A large country in western Europe" or "Java Virtual Machine: A microarchitecture that the Java programming language uses".
+    {format_instructions}
+    """,
+    input_variables=["text"],
+    partial_variables={"format_instructions": page_parser.get_format_instructions()},
+)
+
+reduce_prompt = PromptTemplate(
+    template="""Merge the following summaries of consecutive parts of a document into one coherent summary.
+    Keep the most important information and remove repetitions. Use only the information that is in the summaries.
+
+    {summaries}
+
+    Respond with ONLY the merged summary.
+    """,
+    input_variables=["summaries"],
+)
+
 
 def generate_compendium(document_id: uuid.UUID, start: int, end: int) -> Compendium:
     """
-    Generates a compendium for the document
+    Generates a compendium for the document. The pages are summarized in
+    parallel (map) and the summaries are merged hierarchically (reduce).
+    Page summaries and merges are memoized by content, so overlapping or
+    extended page ranges only summarize the pages which are new.
     """
 
     # Retrieve the pages from the database
     context_pages: list[Citation] = get_page_range(document_id, start, end)
     logger.info(f"Generating compendium for document {document_id}")
-    # Generate the compendium
-    summaries = ""
-    key_concepts = []
+    if not context_pages:
+        raise ValueError("No pages found for the specified document.")
+
+    # The calls are retried by fan_out, not by the client
+    llm = create_llm_model(max_retries=0)
+    page_chain = page_prompt | llm | page_parser
+
+    def summarize_page(page: Citation) -> PageSummary:
+        key = _memo_key("page", llm.model_name, page.text)
+        memoized = _get_memoized(key)
+        if memoized is not None:
+            return PageSummary.model_validate(memoized)
+        page_summary = page_chain.invoke({"text": page.text})
+        _memoize(key, page_summary.model_dump())
+        return page_summary
 
-    llm = create_llm_model()
-    document_name = ""
-    for page in context_pages:
-        document_name = page.document_name
-        # Extract the key concepts and summaries from the page
-        # Append the key concepts and summaries to the lists
+    # Summarize all pages concurrently, keeping the page order
+    results = fan_out(
+        summarize_page,
+        context_pages,
+        max_workers=Config().COMPENDIUM_MAX_CONCURRENCY,
+        retries=Config().LLM_MAX_RETRIES,
+    )
+    page_summaries: list[tuple[Citation, PageSummary]] = []
+    for page, result in zip(context_pages, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to summarize page {page.page_num}: {result}")
+            continue
+        page_summaries.append((page, result))
+
+    if not page_summaries:
+        raise ValueError("Failed to summarize the pages of the document.")
 
-        concept_template, summary_template = _generate_compendium_template(page.text)
-        concept = llm.invoke([{"role": "system", "content": concept_template}])
-        summary = llm.invoke([{"role": "system", "content": summary_template}])
-        key_concepts.extend(concept.content.split("|"))
-        summaries += summary.content
+    key_concepts = _merge_key_concepts(
+        [page_summary.key_concepts for _, page_summary in page_summaries]
+    )
+    summary = _reduce_summaries(llm, page_summaries)
 
     compendium = Compendium(
-        document_name=document_name,
+        document_name=context_pages[-1].document_name,
         start_page=start,
         end_page=end,
         key_concepts=key_concepts,
-        summary=summaries,
+        summary=summary,
     )
     return compendium
 
 
-def _generate_compendium_template(text: str) -> tuple[str, str]:
+def _reduce_summaries(llm, page_summaries: list[tuple[Citation, PageSummary]]) -> str:
+    """
+    Merge the page summaries level by level, REDUCE_FAN_IN summaries per call.
+    The first level groups pages by their page number, so that an extended
+    page range reuses the merges of the pages it shares with earlier ranges.
+    """
+    reduce_chain = reduce_prompt | llm
+
+    def merge(summaries: list[str]) -> str:
+        if len(summaries) == 1:
+            return summaries[0]
+        key = _memo_key("reduce", llm.model_name, *summaries)
+        merged = _get_memoized(key)
+        if merged is None:
+            merged = reduce_chain.invoke(
+                {"summaries": "\n\n".join(f"'''{summary}'''" for summary in summaries)}
+            ).content
+            _memoize(key, merged)
+        return merged
+
+    groups: dict[int, list[str]] = {}
+    for page, page_summary in page_summaries:
+        groups.setdefault(page.page_num // REDUCE_FAN_IN, []).append(page_summary.summary)
+    level = list(groups.values())
+
+    while True:
+        results = fan_out(
+            merge,
+            level,
+            max_workers=Config().COMPENDIUM_MAX_CONCURRENCY,
+            retries=Config().LLM_MAX_RETRIES,
+        )
+        summaries = []
+        for group, result in zip(level, results):
+            if isinstance(result, Exception):
+                # Keep the summaries of a failed merge rather than losing them
+                logger.error(f"Failed to merge summaries: {result}")
+                summaries.append("\n".join(group))
+            else:
+                summaries.append(result)
+
+        if len(summaries) == 1:
+            return summaries[0]
+        level = [
+            summaries[i : i + REDUCE_FAN_IN]
+            for i in range(0, len(summaries), REDUCE_FAN_IN)
+        ]
+
+
+def _merge_key_concepts(concept_lists: list[list[str]]) -> list[str]:
     """
-    Generate a compendium template for the text
+    Concatenate the key concepts of the pages, dropping repeated concepts
     """
+    key_concepts = []
+    seen = set()
+    for concepts in concept_lists:
+        for concept in concepts:
+            name = concept.split(":", 1)[0].strip().casefold()
+            if name and name not in seen:
+                seen.add(name)
+                key_concepts.append(concept.strip())
+    return key_concepts
+
+
+def _memo_key(kind: str, model_name: str, *texts: str) -> str:
+    payload = json.dumps(
+        [PROMPT_VERSION, kind, model_name, [normalize_text(text) for text in texts]]
+    )
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return f"compendium:{kind}:{digest}"
+
 
-    key_concepts_format = "France: A large country in westeren Europe | Java Virtual Machine: A microarchitecture that the Java programming language uses | Deforestation: The process in which a forest is destroyed by humans"
-    key_concepts_template = f"Generate a list of key concepts from the given text: '''{text}'''. Use only the most important concepts. Do not include any unnecessary information. Use only the information that is in the text. Use the following format: {key_concepts_format}"
+def _get_memoized(key: str):
+    try:
+        return caches["compendiums"].get(key)
+    except Exception as e:
+        logger.warning(f"Could not read the compendium cache: {e}")
+        return None
 
-    summary_template = f"Generate a summary of the given text: '''{text}'''. Use only the most important information. Do not include any unnecessary information. Use only the information that is in the text."
 
-    return key_concepts_template, summary_template
+def _memoize(key: str, value) -> None:
+    try:
+        caches["compendiums"].set(key, value, timeout=None)
+    except Exception as e:
+        logger.warning(f"Could not write the compendium cache: {e}")
@@ -1,23 +1,97 @@
+import hashlib
+import json
+import logging
+from typing import Optional
+
+from django.core.cache import caches
+from prometheus_client import Counter
 from pydantic import BaseModel
 
 from langchain.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 
+from learning_materials.knowledge_base.embedding_cache import normalize_text
+from learning_materials.knowledge_base.llm import get_chat_model
 from learning_materials.learning_resources import Flashcard, Citation
-from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt changes, so that flashcards of the old prompt are regenerated
+PROMPT_VERSION = 1
+
+FLASHCARD_CACHE_REQUESTS = Counter(
+    "tutorai_flashcard_cache_requests_total",
+    "Flashcard generation cache lookups by result",
+    ["result"],
+)
 
 
 class FlashcardWrapper(BaseModel):
     flashcards: list[Flashcard]
 
 
-model = ChatOpenAI(temperature=0, api_key=Config().API_KEY)
+model = get_chat_model(temperature=0.0)
 flashcard_parser = PydanticOutputParser(pydantic_object=FlashcardWrapper)
 
 
+def flashcard_cache_key(text: str, language: str) -> str:
+    """
+    The generation cache key of the flashcards of a page. The flashcards are
+    generated at temperature 0, so they only depend on the text, the language,
+    the prompt and the model.
+    """
+    payload = json.dumps([PROMPT_VERSION, model.model_name, language, normalize_text(text)])
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return f"flashcards:{digest}"
+
+
+def get_cached_flashcards(text: str, language: str) -> Optional[list[Flashcard]]:
+    """
+    Look up the flashcards generated earlier for the same page text and language
+
+    Returns:
+        Optional[list[Flashcard]]: The flashcards, or None on a cache miss
+    """
+    try:
+        cached = caches["flashcards"].get(flashcard_cache_key(text, language))
+    except Exception as e:
+        logger.warning(f"Could not read the flashcard cache: {e}")
+        cached = None
+
+    if cached is None:
+        FLASHCARD_CACHE_REQUESTS.labels(result="miss").inc()
+        return None
+    FLASHCARD_CACHE_REQUESTS.labels(result="hit").inc()
+    return [Flashcard.model_validate(flashcard) for flashcard in cached]
+
+
+def _cache_flashcards(text: str, language: str, flashcards: list[Flashcard]) -> None:
+    try:
+        caches["flashcards"].set(
+            flashcard_cache_key(text, language),
+            [flashcard.model_dump() for flashcard in flashcards],
+            timeout=None,
+        )
+    except Exception as e:
+        logger.warning(f"Could not write the flashcard cache: {e}")
+
+
 def generate_flashcards(page: Citation, language: str = "en") -> list[Flashcard]:
-    template = _generate_template(page.text, language)
+    flashcards = get_cached_flashcards(page.text, language)
+    if flashcards is None:
+        flashcards = _generate_flashcards(page.text, language)
+        _cache_flashcards(page.text, language, flashcards)
+
+    # Ensuring page_num and document_name are set correctly
+    for flashcard in flashcards:
+        flashcard.page_num = page.page_num
+        flashcard.document_name = page.document_name
+
+    return flashcards
+
+
+def _generate_flashcards(text: str, language: str) -> list[Flashcard]:
+    template = _generate_template(text, language)
     prompt = PromptTemplate(
         template="Answer the user query.\n{format_instructions}\n{query}\n",
         input_variables=["query"],
@@ -31,14 +105,7 @@ def generate_flashcards(page: Citation, language: str = "en") -> list[Flashcard]
 
     # Generating the flashcards
     wrapper = chain.invoke({"query": template})
-    flashcards = wrapper.flashcards
-
-    # Ensuring page_num and document_name are set correctly
-    for flashcard in flashcards:
-        flashcard.page_num = page.page_num
-        flashcard.document_name = page.document_name
-
-    return flashcards
+    return wrapper.flashcards
 
 
 def _generate_template(context: str, language: str = "en") -> str:
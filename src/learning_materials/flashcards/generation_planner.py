@@ -0,0 +1,180 @@
+""" Planning of flashcard generation within a budget of cards """
+
+import logging
+import math
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Hashable, Optional
+
+from learning_materials.learning_resources import Citation, Flashcard
+from learning_materials.models import ClusterElement
+from learning_materials.utils.generation_executor import (
+    ExecutorSaturated,
+    FairExecutor,
+    generation_executor,
+)
+from learning_materials.utils.progress import report_progress
+
+logger = logging.getLogger(__name__)
+
+# The number of flashcards a page is assumed to give before any page has been generated
+CARDS_PER_PAGE_ESTIMATE = 3
+
+
+def get_page_clusters(document_id: uuid.UUID) -> dict[int, str]:
+    """
+    The cluster name of each clustered page of the document
+
+    Args:
+        document_id (uuid.UUID): The id of the document
+
+    Returns:
+        dict[int, str]: The cluster name by page number, empty if the document is not clustered
+    """
+    page_clusters: dict[int, str] = {}
+    for page_number, cluster_name in ClusterElement.objects.filter(
+        user_file_id=document_id
+    ).values_list("page_number", "cluster_name"):
+        page_clusters.setdefault(page_number, cluster_name)
+    return page_clusters
+
+
+def order_pages(
+    pages: list[Citation], page_clusters: dict[int, str], spread: int
+) -> list[Citation]:
+    """
+    Order the pages so that every prefix of the order covers the pages
+    evenly. The pages are taken from the clusters in turn. Pages without a
+    cluster are split into spread consecutive sections, which are taken in
+    turn as well.
+
+    Args:
+        pages (list[Citation]): The pages in page order
+        page_clusters (dict[int, str]): The cluster name by page number
+        spread (int): The number of sections of the pages without a cluster
+
+    Returns:
+        list[Citation]: The pages in the order they should be generated
+    """
+    groups: dict[tuple, list[Citation]] = {}
+    unclustered = [page for page in pages if page.page_num not in page_clusters]
+    spread = max(1, min(spread, len(unclustered)))
+    for page in pages:
+        if page.page_num in page_clusters:
+            groups.setdefault(("cluster", page_clusters[page.page_num]), []).append(page)
+    for i, page in enumerate(unclustered):
+        groups.setdefault(("section", i * spread // len(unclustered)), []).append(page)
+
+    queues = deque(
+        deque(group)
+        for group in sorted(groups.values(), key=lambda group: group[0].page_num)
+    )
+    ordered = []
+    while queues:
+        queue = queues.popleft()
+        ordered.append(queue.popleft())
+        if queue:
+            queues.append(queue)
+    return ordered
+
+
+def generate_within_budget(
+    pages: list[Citation],
+    generate: Callable[[Citation], list[Flashcard]],
+    budget: int,
+    owner: Optional[Hashable] = None,
+    page_clusters: Optional[dict[int, str]] = None,
+    deduplicate: Optional[Callable[[list[Flashcard]], list[Flashcard]]] = None,
+    executor: FairExecutor = generation_executor,
+) -> list[Flashcard]:
+    """
+    Generate about budget flashcards from as few pages as possible. Only the
+    pages expected to give the missing cards are submitted, based on the
+    distinct cards per page seen so far. The results are taken as they
+    complete, and the outstanding pages are cancelled once the budget is met.
+
+    Args:
+        pages (list[Citation]): The pages in page order
+        generate (Callable[[Citation], list[Flashcard]]): Generates the flashcards of a page
+        budget (int): The number of flashcards wanted
+        owner (Optional[Hashable]): The user the flashcards are generated for
+        page_clusters (Optional[dict[int, str]]): The cluster name by page number
+        deduplicate (Optional[Callable[[list[Flashcard]], list[Flashcard]]]): Keeps the distinct cards, only distinct cards count toward the budget
+
+    Returns:
+        list[Flashcard]: At most budget flashcards, in page order
+
+    Raises:
+        ExecutorSaturated: If the generation executor cannot take the first pages
+    """
+    if budget <= 0 or not pages:
+        return []
+
+    spread = math.ceil(budget / CARDS_PER_PAGE_ESTIMATE)
+    remaining = deque(order_pages(pages, page_clusters or {}, spread))
+    positions: dict[Future, tuple[int, Citation]] = {}
+    results: list[tuple[int, Citation, list[Flashcard]]] = []
+    in_flight: set[Future] = set()
+    generated = 0
+    # The distinct cards of the finished pages in the order of the pages
+    kept: list[tuple[int, Flashcard]] = []
+
+    def keep() -> list[tuple[int, Flashcard]]:
+        cards = [
+            (page.page_num, flashcard)
+            for _, page, page_cards in sorted(results, key=lambda result: result[0])
+            for flashcard in page_cards
+        ]
+        if deduplicate is None:
+            return cards
+        distinct = {id(flashcard) for flashcard in deduplicate([card for _, card in cards])}
+        return [card for card in cards if id(card[1]) in distinct]
+
+    def submit(count: int) -> None:
+        batch = [remaining.popleft() for _ in range(min(count, len(remaining)))]
+        if not batch:
+            return
+        offset = len(positions)
+        for i, (page, future) in enumerate(zip(batch, executor.map(owner, generate, batch))):
+            positions[future] = (offset + i, page)
+            in_flight.add(future)
+
+    submit(spread)
+    try:
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                flashcards = future.result()
+                results.append((*positions[future], flashcards))
+                generated += len(flashcards)
+            # Duplicates can only be told apart once there are enough cards
+            distinct = generated
+            if generated >= budget:
+                kept = keep()
+                distinct = len(kept)
+            report_progress(min(distinct, budget), budget)
+            if distinct >= budget:
+                break
+
+            # Top up with the pages expected to give the missing cards
+            cards_per_page = distinct / len(results) if distinct else CARDS_PER_PAGE_ESTIMATE
+            expected = distinct + len(in_flight) * cards_per_page
+            if expected < budget:
+                try:
+                    submit(math.ceil((budget - expected) / cards_per_page))
+                except ExecutorSaturated:
+                    # Make do with the pages already submitted
+                    logger.warning("Generation executor is saturated, not adding pages")
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+    logger.info(
+        f"Generated {generated} flashcards from {len(results)} of {len(pages)} pages"
+    )
+    if len(kept) < budget:
+        kept = keep()
+    # Keep the cards of the best covering pages, then restore the page order
+    return [flashcard for _, flashcard in sorted(kept[:budget], key=lambda card: card[0])]
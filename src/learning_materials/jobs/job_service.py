@@ -0,0 +1,324 @@
+""" Asynchronous generation jobs for flashcards, quizzes and compendiums """
+
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from django.db.models import F, Q
+from django.utils import timezone
+from pydantic import BaseModel
+
+from broker.producer import producer
+from broker.topics import Topic
+from config import Config
+from learning_materials.compendiums.compendium_service import generate_compendium
+from learning_materials.learning_material_service import (
+    process_flashcards_by_page_range,
+    process_flashcards_by_subject,
+)
+from learning_materials.models import Cardset, Course, GenerationJob, QuizModel
+from learning_materials.quizzes.quiz_service import generate_quiz
+from learning_materials.serializer import CardsetSerializer, QuizModelSerializer
+from learning_materials.titles import title_service
+from learning_materials.translator import (
+    translate_flashcard_to_orm_model,
+    translate_quiz_to_orm_model,
+)
+from learning_materials.utils.generation_executor import ExecutorSaturated
+from learning_materials.utils.progress import reporting_progress
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationJobMessage(BaseModel):
+    """
+    Message asking a worker to run a generation job
+    """
+
+    job_id: uuid.UUID
+
+
+def _get_course(course_id: Optional[uuid.UUID]) -> Optional[Course]:
+    return Course.objects.get(id=course_id) if course_id else None
+
+
+def create_cardset(
+    user,
+    document_id: Optional[uuid.UUID] = None,
+    course_id: Optional[uuid.UUID] = None,
+    subject: Optional[str] = None,
+    start_page: Optional[int] = None,
+    end_page: Optional[int] = None,
+    num_flashcards: Optional[int] = None,
+    **kwargs,
+) -> Cardset:
+    """
+    Generate flashcards from a document and save them in a new cardset
+    """
+    logger.info(f"Generating flashcards for document {document_id}")
+    course = _get_course(course_id)
+    language = course.language if course else None
+
+    if start_page is not None and end_page is not None:
+        flashcards = process_flashcards_by_page_range(
+            document_id, start_page, end_page, language, num_flashcards, owner=user.id
+        )
+    elif subject:
+        flashcards = process_flashcards_by_subject(
+            document_id, subject, language, num_flashcards, owner=user.id
+        )
+    else:
+        raise ValueError("Either start and end page or subject is required")
+
+    # The generated title replaces the placeholder once it is ready
+    title = title_service.placeholder_title(
+        subject or " ".join(fc.front for fc in flashcards), title_service.CARDSET
+    )
+    # Create a cardset for the flashcards and save them to the database
+    cardset = Cardset.objects.create(
+        name=title,
+        subject=subject,
+        course=course,
+        user=user,
+        start_page=start_page,
+        end_page=end_page,
+    )
+
+    for fc in flashcards:
+        translate_flashcard_to_orm_model(fc, cardset)
+
+    title_service.request_title(title_service.CARDSET, cardset.id, title, language)
+    return cardset
+
+
+def create_quiz(
+    user,
+    document_id: Optional[uuid.UUID] = None,
+    course_id: Optional[uuid.UUID] = None,
+    subject: Optional[str] = None,
+    start_page: Optional[int] = None,
+    end_page: Optional[int] = None,
+    learning_goals: list[str] = [],
+    num_questions: Optional[int] = None,
+    **kwargs,
+) -> QuizModel:
+    """
+    Generate a quiz from a document and save it
+    """
+    course = _get_course(course_id)
+    language = course.language if course else None
+
+    quiz_data = generate_quiz(
+        document_id,
+        start_page,
+        end_page,
+        subject,
+        learning_goals,
+        language,
+        num_questions,
+    )
+    # The generated title replaces the placeholder once it is ready
+    title = title_service.placeholder_title(
+        subject or " ".join(q.question for q in quiz_data.questions),
+        title_service.QUIZ,
+    )
+
+    # Translate the quiz data into ORM models
+    quiz = translate_quiz_to_orm_model(quiz_data, title, user, course)
+    title_service.request_title(title_service.QUIZ, quiz.id, title, language)
+    return quiz
+
+
+def _run_flashcards(job: GenerationJob) -> dict:
+    cardset = create_cardset(job.user, **job.parameters)
+    return CardsetSerializer(cardset).data
+
+
+def _run_quiz(job: GenerationJob) -> dict:
+    quiz = create_quiz(job.user, **job.parameters)
+    return QuizModelSerializer(quiz).data
+
+
+def _run_compendium(job: GenerationJob) -> dict:
+    parameters = job.parameters
+    compendium = generate_compendium(
+        parameters["id"], parameters.get("start_page"), parameters.get("end_page")
+    )
+    return compendium.model_dump()
+
+
+JOB_RUNNERS: dict[str, Callable[[GenerationJob], dict]] = {
+    GenerationJob.Kind.FLASHCARDS: _run_flashcards,
+    GenerationJob.Kind.QUIZ: _run_quiz,
+    GenerationJob.Kind.COMPENDIUM: _run_compendium,
+}
+
+
+def submit_job(user, kind: str, parameters: dict) -> GenerationJob:
+    """
+    Save a pending job and queue it for the generation workers
+
+    Args:
+        user: The user submitting the job
+        kind (str): One of GenerationJob.Kind
+        parameters (dict): The validated request of the matching creation endpoint
+
+    Returns:
+        GenerationJob: The pending job
+    """
+    if kind not in JOB_RUNNERS:
+        raise ValueError(f"Unknown job kind {kind}")
+
+    job = GenerationJob.objects.create(user=user, kind=kind, parameters=parameters)
+    _queue_job(job)
+    logger.info(f"Submitted {kind} job {job.id}")
+    return job
+
+
+def _queue_job(job: GenerationJob) -> None:
+    message = GenerationJobMessage(job_id=job.id)
+    producer.produce(Topic.GENERATION_JOB, message.model_dump_json())
+
+
+def _stale_before() -> datetime:
+    return timezone.now() - timedelta(seconds=Config().JOB_TIMEOUT_SECONDS)
+
+
+# Progress is written once it has grown by a step, 1.0 is only written when the job is done
+PROGRESS_STEP = 0.05
+
+
+def _progress_reporter(job_id: uuid.UUID, claimed_at: datetime) -> Callable[[float], None]:
+    reported = 0.0
+
+    def report(progress: float) -> None:
+        nonlocal reported
+        progress = min(progress, 1.0 - PROGRESS_STEP)
+        if progress - reported < PROGRESS_STEP:
+            return
+        reported = progress
+        GenerationJob.objects.filter(
+            id=job_id, status=GenerationJob.Status.RUNNING, started_at=claimed_at
+        ).update(progress=progress, updated_at=timezone.now())
+
+    return report
+
+
+def run_job(job_id: uuid.UUID) -> Optional[GenerationJob]:
+    """
+    Run a pending job and store its result. A running job which has not
+    finished within JOB_TIMEOUT_SECONDS can be claimed again, e.g. when its
+    worker died. Other jobs, such as redelivered messages of finished jobs,
+    are skipped. A job which cannot get generation capacity is queued again
+    instead of failing.
+
+    Returns:
+        Optional[GenerationJob]: The finished job, or None if it was skipped
+    """
+    # Claim the job so that only one worker runs it
+    claimed_at = timezone.now()
+    claimed = (
+        GenerationJob.objects.filter(id=job_id, attempts__lt=Config().JOB_MAX_ATTEMPTS)
+        .filter(
+            Q(status=GenerationJob.Status.PENDING)
+            | Q(status=GenerationJob.Status.RUNNING, started_at__lt=_stale_before())
+        )
+        .update(
+            status=GenerationJob.Status.RUNNING,
+            progress=0.0,
+            started_at=claimed_at,
+            attempts=F("attempts") + 1,
+            updated_at=claimed_at,
+        )
+    )
+    if not claimed:
+        logger.info(f"Skipping job {job_id}, it is not pending")
+        return None
+
+    job = GenerationJob.objects.select_related("user").get(id=job_id)
+    try:
+        with reporting_progress(_progress_reporter(job_id, claimed_at)):
+            job.result = JOB_RUNNERS[job.kind](job)
+        job.status = GenerationJob.Status.SUCCEEDED
+        job.progress = 1.0
+    except ExecutorSaturated as e:
+        _release_job(job, claimed_at, str(e))
+        return None
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        job.status = GenerationJob.Status.FAILED
+        job.error = str(e)
+
+    # Only the worker holding the claim may finish the job
+    finished = GenerationJob.objects.filter(
+        id=job_id, status=GenerationJob.Status.RUNNING, started_at=claimed_at
+    ).update(
+        result=job.result,
+        status=job.status,
+        progress=job.progress,
+        error=job.error,
+        updated_at=timezone.now(),
+    )
+    if not finished:
+        logger.warning(f"Job {job_id} was taken over or expired before it finished")
+        return None
+    return job
+
+
+def _release_job(job: GenerationJob, claimed_at: datetime, reason: str) -> None:
+    """
+    Give up the claim of a job which could not get generation capacity and
+    queue it again after JOB_REQUEUE_DELAY_SECONDS. The claim does not count
+    as an attempt, since the job did not run.
+    """
+    released = GenerationJob.objects.filter(
+        id=job.id, status=GenerationJob.Status.RUNNING, started_at=claimed_at
+    ).update(
+        status=GenerationJob.Status.PENDING,
+        progress=0.0,
+        started_at=None,
+        attempts=F("attempts") - 1,
+        updated_at=timezone.now(),
+    )
+    if not released:
+        return
+    delay = Config().JOB_REQUEUE_DELAY_SECONDS
+    logger.warning(f"Job {job.id} is delayed by {delay}s: {reason}")
+    # Waiting here also holds back the next messages of the partition
+    time.sleep(delay)
+    _queue_job(job)
+
+
+def expire_stale_job(job: GenerationJob) -> GenerationJob:
+    """
+    Retry a running job whose worker has not finished it within
+    JOB_TIMEOUT_SECONDS, or fail it once it has used all its attempts, so
+    that clients polling the job are not left waiting forever.
+
+    Returns:
+        GenerationJob: The job as it is now
+    """
+    if job.status != GenerationJob.Status.RUNNING or job.started_at is None:
+        return job
+    if job.started_at >= _stale_before():
+        return job
+
+    if job.attempts < Config().JOB_MAX_ATTEMPTS:
+        updates = {"status": GenerationJob.Status.PENDING, "progress": 0.0}
+    else:
+        updates = {
+            "status": GenerationJob.Status.FAILED,
+            "error": "The job did not finish in time, please try again.",
+        }
+    expired = GenerationJob.objects.filter(
+        id=job.id, status=GenerationJob.Status.RUNNING, started_at=job.started_at
+    ).update(updated_at=timezone.now(), **updates)
+    if expired:
+        logger.warning(f"Job {job.id} timed out, it is now {updates['status']}")
+        if updates["status"] == GenerationJob.Status.PENDING:
+            _queue_job(job)
+    job.refresh_from_db()
+    return job
+
@@ -0,0 +1,395 @@
+""" Approximate nearest neighbour (IVF) indexes for course-scale retrieval """
+
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from learning_materials.learning_resources import Citation, FullCitation
+from learning_materials.knowledge_base.db_interface import Database
+from learning_materials.knowledge_base.vector_math import (
+    dot_many_to_many,
+    dot_one_to_many,
+    normalize,
+    to_matrix,
+    top_k_indices,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Inverted file index over the normalized page embeddings of one document.
+
+    The pages are partitioned into lists around k-means centroids. A search
+    only scores the pages in the n_probe lists whose centroids are closest
+    to the query. The lists are array-backed: list i holds the page indices
+    members[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        pages: list[Citation],
+        centroids: np.ndarray,
+        assignments: np.ndarray,
+        n_probe: int = 1,
+    ):
+        self.vectors = vectors
+        self.pages = pages
+        self.centroids = centroids
+        self.assignments = assignments
+        self.n_probe = n_probe
+        self._build_lists()
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: list[list[float]],
+        pages: list[Citation],
+        n_lists: Optional[int] = None,
+    ) -> "IVFIndex":
+        """
+        Train the centroids and build the index
+
+        Args:
+            embeddings (list[list[float]]): The embeddings of the pages
+            pages (list[Citation]): The pages, in the same order as the embeddings
+            n_lists (Optional[int]): The number of lists, defaults to sqrt of the number of pages
+
+        Returns:
+            IVFIndex: The index, searching a single list until it is calibrated
+        """
+        vectors = normalize(to_matrix(embeddings))
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        kmeans = KMeans(n_clusters=n_lists, n_init=1, random_state=42)
+        assignments = kmeans.fit_predict(vectors)
+        centroids = normalize(kmeans.cluster_centers_)
+
+        return cls(vectors, pages, centroids, assignments.astype(np.int32))
+
+    def _build_lists(self) -> None:
+        self.members = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def add(self, embeddings: list[list[float]], pages: list[Citation]) -> None:
+        """
+        Add pages to the index by assigning them to their closest centroid,
+        without retraining the centroids.
+        """
+        if not pages:
+            return
+        vectors = normalize(to_matrix(embeddings))
+        assignments = np.argmax(dot_many_to_many(vectors, self.centroids), axis=1).astype(np.int32)
+
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.pages = self.pages + pages
+        self.assignments = np.concatenate([self.assignments, assignments])
+        self._build_lists()
+
+    def replace_pages(
+        self, page_nums: set[int], embeddings: list[list[float]], pages: list[Citation]
+    ) -> "IVFIndex":
+        """
+        A copy of the index without the entries of the given page numbers and
+        with the given pages added, keeping the trained centroids. The index
+        itself is left as it is for the searches already using it.
+        """
+        keep = np.array([page.page_num not in page_nums for page in self.pages], dtype=bool)
+        index = IVFIndex(
+            vectors=self.vectors[keep],
+            pages=[page for page, kept in zip(self.pages, keep) if kept],
+            centroids=self.centroids,
+            assignments=self.assignments[keep],
+            n_probe=self.n_probe,
+        )
+        index.add(embeddings, pages)
+        return index
+
+    def search(
+        self, query: np.ndarray, k: int, n_probe: Optional[int] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the approximate top k pages for a normalized query
+
+        Args:
+            query (np.ndarray): The normalized (d,) query embedding
+            k (int): The number of pages to return
+            n_probe (Optional[int]): The number of lists to search, defaults to the calibrated value
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The page indices and their cosine similarities, best match first
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        lists = top_k_indices(dot_one_to_many(self.centroids, query), n_probe)
+        candidates = np.concatenate(
+            [self.members[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        )
+        scores = dot_one_to_many(self.vectors[candidates], query)
+        best = top_k_indices(scores, k)
+        return candidates[best], scores[best]
+
+    def exact_search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the exact top k pages for a normalized query by scanning every page
+        """
+        scores = dot_one_to_many(self.vectors, query)
+        best = top_k_indices(scores, k)
+        return best, scores[best]
+
+    def recall(self, queries: np.ndarray, k: int, n_probe: int) -> float:
+        """
+        Measure the recall@k of the approximate search against the exact search
+
+        Args:
+            queries (np.ndarray): A (q, d) matrix of normalized queries
+            k (int): The number of pages returned per query
+            n_probe (int): The number of lists to search
+
+        Returns:
+            float: The fraction of the exact top k pages found by the approximate search
+        """
+        found = 0
+        expected = 0
+        for query in queries:
+            exact, _ = self.exact_search(query, k)
+            approximate, _ = self.search(query, k, n_probe)
+            found += len(np.intersect1d(exact, approximate))
+            expected += len(exact)
+        return found / expected if expected else 1.0
+
+    def calibrate(self, target_recall: float, k: int = 5, n_queries: int = 32) -> int:
+        """
+        Pick the smallest n_probe which reaches the target recall@k on
+        pseudo-queries made by averaging random pairs of pages.
+
+        Returns:
+            int: The calibrated n_probe
+        """
+        rng = np.random.default_rng(42)
+        pairs = rng.integers(0, len(self.vectors), size=(n_queries, 2))
+        queries = normalize(self.vectors[pairs[:, 0]] + self.vectors[pairs[:, 1]])
+
+        for n_probe in range(1, self.n_lists + 1):
+            if self.recall(queries, k, n_probe) >= target_recall:
+                break
+        self.n_probe = n_probe
+        return n_probe
+
+    def save(self, path: Path) -> None:
+        """
+        Persist the index, replacing any existing file atomically
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        pages = json.dumps([page.model_dump() for page in self.pages])
+        np.savez(
+            tmp_path,
+            vectors=self.vectors,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            n_probe=np.array(self.n_probe),
+            pages=np.array(pages),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        with np.load(path) as data:
+            pages = [Citation(**page) for page in json.loads(str(data["pages"]))]
+            return cls(
+                vectors=data["vectors"],
+                pages=pages,
+                centroids=data["centroids"],
+                assignments=data["assignments"],
+                n_probe=int(data["n_probe"]),
+            )
+
+
+class AnnIndexStore:
+    """
+    Lazily built IVF indexes keyed by document id. Indexes are built from
+    the pages in the database on first use, persisted to a local directory
+    and kept in memory for the most recently used documents.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        directory: str,
+        target_recall: float = 0.95,
+        max_in_memory: int = 64,
+    ):
+        self.database = database
+        self.directory = Path(directory)
+        self.target_recall = target_recall
+        self.max_in_memory = max_in_memory
+        self._indexes: OrderedDict[str, IVFIndex] = OrderedDict()
+        # Guards the in-memory indexes only, building and loading take the lock of the document
+        self._lock = threading.Lock()
+        self._document_locks: dict[str, threading.Lock] = {}
+
+    def _path(self, document_id: str) -> Path:
+        return self.directory / f"{document_id}.npz"
+
+    def _document_lock(self, document_id: str) -> threading.Lock:
+        with self._lock:
+            return self._document_locks.setdefault(document_id, threading.Lock())
+
+    def _cached(self, document_id: str) -> Optional[IVFIndex]:
+        with self._lock:
+            index = self._indexes.get(document_id)
+            if index is not None:
+                self._indexes.move_to_end(document_id)
+            return index
+
+    def get_index(self, document_id: uuid.UUID) -> Optional[IVFIndex]:
+        """
+        Get the index of a document, loading it from disk or building it
+        from the database if needed. Only the searches of the same document
+        wait for a build.
+
+        Returns:
+            Optional[IVFIndex]: The index, or None if the document has no pages
+        """
+        key = str(document_id)
+        index = self._cached(key)
+        if index is not None:
+            return index
+
+        with self._document_lock(key):
+            index = self._cached(key)
+            if index is not None:
+                return index
+            path = self._path(key)
+            index = IVFIndex.load(path) if path.exists() else self._build(key)
+            if index is not None:
+                self._remember(key, index)
+            return index
+
+    def _build(self, document_id: str) -> Optional[IVFIndex]:
+        pages: list[FullCitation] = self.database.get_all_pages(document_id)
+        if not pages:
+            return None
+
+        logger.info(f"Building ANN index for document {document_id}")
+        index = IVFIndex.build(
+            [page.embedding for page in pages],
+            [Citation(**page.model_dump(exclude={"embedding"})) for page in pages],
+        )
+        index.calibrate(self.target_recall)
+        index.save(self._path(document_id))
+        return index
+
+    def _remember(self, document_id: str, index: IVFIndex) -> None:
+        with self._lock:
+            self._indexes[document_id] = index
+            self._indexes.move_to_end(document_id)
+            while len(self._indexes) > self.max_in_memory:
+                self._indexes.popitem(last=False)
+
+    def update(self, document_id: uuid.UUID) -> Optional[IVFIndex]:
+        """
+        Bring an existing index of a document up to date with the database
+        after ingestion, without retraining it. The entries of pages whose
+        text changed are replaced and new pages are added. Documents without
+        an index are left to be built on first use.
+        """
+        key = str(document_id)
+        with self._document_lock(key):
+            path = self._path(key)
+            index = self._cached(key)
+            if index is None:
+                if not path.exists():
+                    return None
+                index = IVFIndex.load(path)
+
+            indexed = {(page.page_num, page.text) for page in index.pages}
+            pages = self.database.get_all_pages(key)
+            changed_page_nums = {
+                page.page_num for page in pages if (page.page_num, page.text) not in indexed
+            }
+            # Every entry of a changed page number is replaced by its current entries
+            changed_pages = [page for page in pages if page.page_num in changed_page_nums]
+            if changed_pages:
+                logger.info(
+                    f"Updating {len(changed_page_nums)} pages of the ANN index of document {key}"
+                )
+                index = index.replace_pages(
+                    changed_page_nums,
+                    [page.embedding for page in changed_pages],
+                    [
+                        Citation(**page.model_dump(exclude={"embedding"}))
+                        for page in changed_pages
+                    ],
+                )
+                index.save(path)
+
+            self._remember(key, index)
+            return index
+
+    def invalidate(self, document_id: uuid.UUID) -> None:
+        """
+        Drop the index of a deleted document from memory and from disk
+        """
+        key = str(document_id)
+        with self._document_lock(key):
+            with self._lock:
+                self._indexes.pop(key, None)
+            self._path(key).unlink(missing_ok=True)
+
+    def search(
+        self,
+        document_ids: list[uuid.UUID],
+        embedding: list[float],
+        top_k: int = 5,
+        exact: bool = False,
+    ) -> list[tuple[Citation, float]]:
+        """
+        Find the pages of the documents most similar to the embedding
+
+        Args:
+            document_ids (list[uuid.UUID]): The documents to search
+            embedding (list[float]): The embedding of the query
+            top_k (int): The number of pages to return
+            exact (bool): Scan every page instead of using the index, used to verify the approximate results
+
+        Returns:
+            list[tuple[Citation, float]]: The pages and their cosine similarities, best match first
+        """
+        query = normalize(embedding)
+        matches: list[tuple[Citation, float]] = []
+
+        for document_id in dict.fromkeys(str(doc_id) for doc_id in document_ids):
+            index = self.get_index(document_id)
+            if index is None:
+                continue
+            if exact:
+                indices, scores = index.exact_search(query, top_k)
+            else:
+                indices, scores = index.search(query, top_k)
+            matches.extend(
+                (index.pages[i], float(score)) for i, score in zip(indices, scores)
+            )
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:top_k]
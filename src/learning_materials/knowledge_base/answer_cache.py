@@ -0,0 +1,190 @@
+""" Semantic cache of RAG answers to first questions about the same documents """
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+from prometheus_client import Counter
+
+from config import Config
+from learning_materials.knowledge_base.vector_math import (
+    dot_one_to_many,
+    normalize,
+    to_matrix,
+)
+from learning_materials.learning_resources import RagAnswer
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_REQUESTS = Counter(
+    "tutorai_answer_cache_requests_total",
+    "Semantic answer cache lookups by result",
+    ["result"],
+)
+ANSWER_CACHE_SAVED_SECONDS = Counter(
+    "tutorai_answer_cache_saved_seconds_total",
+    "Time it took to originally answer the questions served from the answer cache",
+)
+
+AnswerKey = tuple[frozenset[str], str]
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    """
+    An answer together with the normalized embedding of its question
+    """
+
+    key: AnswerKey
+    embedding: np.ndarray
+    answer: RagAnswer
+    latency: float
+    expires_at: float
+
+
+def answer_key(document_ids: list, language: Optional[str]) -> AnswerKey:
+    """
+    Answers are only shared between questions about the same set of documents
+    in the same language
+    """
+    return frozenset(str(document_id) for document_id in document_ids), str(language)
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU cache of answers with a time to live. A cached answer is
+    served for every question about the same documents and in the same
+    language whose embedding is at least similarity_threshold similar.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._clock = clock
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(
+        self, document_ids: list, language: Optional[str], embedding: list[float]
+    ) -> Optional[RagAnswer]:
+        """
+        Look up the answer to the most similar cached question
+
+        Args:
+            document_ids (list): The documents the question is about
+            language (Optional[str]): The language of the answer
+            embedding (list[float]): The embedding of the question
+
+        Returns:
+            Optional[RagAnswer]: A copy of the cached answer, or None on a cache miss
+        """
+        key = answer_key(document_ids, language)
+        query = normalize(embedding)
+        now = self._clock()
+
+        with self._lock:
+            self._evict_expired(now)
+            candidates = [
+                (entry_id, entry)
+                for entry_id, entry in self._entries.items()
+                if entry.key == key
+            ]
+            best = None
+            if candidates:
+                matrix = np.stack([entry.embedding for _, entry in candidates])
+                scores = dot_one_to_many(matrix, query)
+                index = int(np.argmax(scores))
+                if scores[index] >= self.similarity_threshold:
+                    best = candidates[index]
+                    self._entries.move_to_end(best[0])
+
+        if best is None:
+            ANSWER_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+
+        entry = best[1]
+        ANSWER_CACHE_REQUESTS.labels(result="hit").inc()
+        ANSWER_CACHE_SAVED_SECONDS.inc(entry.latency)
+        return entry.answer.model_copy(deep=True)
+
+    def put(
+        self,
+        document_ids: list,
+        language: Optional[str],
+        embedding: list[float],
+        answer: RagAnswer,
+        latency: float,
+    ) -> None:
+        """
+        Cache the answer to a question
+
+        Args:
+            latency (float): The seconds it took to answer, which a hit saves
+        """
+        entry = CachedAnswer(
+            key=answer_key(document_ids, language),
+            embedding=normalize(to_matrix(embedding)),
+            answer=answer.model_copy(deep=True),
+            latency=latency,
+            expires_at=self._clock() + self.ttl_seconds,
+        )
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, document_id) -> None:
+        """
+        Drop every answer which is based on a document
+        """
+        document_id = str(document_id)
+        with self._lock:
+            stale = [
+                entry_id
+                for entry_id, entry in self._entries.items()
+                if document_id in entry.key[0]
+            ]
+            for entry_id in stale:
+                del self._entries[entry_id]
+        if stale:
+            logger.info(f"Dropped {len(stale)} cached answers of document {document_id}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [
+            entry_id
+            for entry_id, entry in self._entries.items()
+            if entry.expires_at <= now
+        ]
+        for entry_id in expired:
+            del self._entries[entry_id]
+
+
+answer_cache = AnswerCache(
+    Config().ANSWER_CACHE_SIZE,
+    Config().ANSWER_CACHE_TTL_SECONDS,
+    Config().ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
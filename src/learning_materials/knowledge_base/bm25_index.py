@@ -0,0 +1,234 @@
+""" Lexical (BM25) retrieval over the chunk text of documents """
+
+import logging
+import re
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from learning_materials.learning_resources import Citation
+from learning_materials.knowledge_base.db_interface import Database
+from learning_materials.knowledge_base.vector_math import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and codes such as "CS101" or "H2O"
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    BM25 index over the pages of one document. The index is not changed
+    after it is built, an updated document gets a new index.
+
+    The postings are array-backed: the pages containing term t are
+    page_ids[offsets[t]:offsets[t + 1]] with the term frequencies at the
+    same positions of term_freqs.
+    """
+
+    def __init__(self, pages: list[Citation], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.pages = list(pages)
+        self.vocabulary: dict[str, int] = {}
+
+        term_ids: list[int] = []
+        page_ids: list[int] = []
+        term_freqs: list[int] = []
+        lengths: list[int] = []
+        for page_id, page in enumerate(self.pages):
+            tokens = tokenize(page.text)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                page_ids.append(page_id)
+                term_freqs.append(freq)
+
+        self.page_lengths = np.asarray(lengths, dtype=np.int32)
+
+        # Group the postings by term
+        all_term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(all_term_ids, kind="stable")
+        self.page_ids = np.asarray(page_ids, dtype=np.int32)[order]
+        self.term_freqs = np.asarray(term_freqs, dtype=np.int32)[order]
+
+        counts = np.bincount(all_term_ids, minlength=len(self.vocabulary))
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Score every page of the document against the query
+
+        Returns:
+            np.ndarray: The BM25 score of each page, 0 for pages without any query term
+        """
+        scores = np.zeros(len(self.pages), dtype=np.float32)
+        if not self.pages:
+            return scores
+
+        average_length = max(float(self.page_lengths.mean()), 1.0)
+        n_pages = len(self.pages)
+
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            page_ids = self.page_ids[start:end]
+            freqs = self.term_freqs[start:end].astype(np.float32)
+
+            doc_freq = len(page_ids)
+            idf = np.log(1.0 + (n_pages - doc_freq + 0.5) / (doc_freq + 0.5))
+            norm = self.k1 * (
+                1.0 - self.b + self.b * self.page_lengths[page_ids] / average_length
+            )
+            # A term occurs at most once in the postings of a page
+            scores[page_ids] += idf * freqs * (self.k1 + 1.0) / (freqs + norm)
+
+        return scores
+
+    def search(self, query: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the top k pages for the query
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The indices of the matching pages and their scores, best match first
+        """
+        scores = self.scores(query)
+        best = top_k_indices(scores, k)
+        best = best[scores[best] > 0]
+        return best, scores[best]
+
+
+class BM25IndexStore:
+    """
+    Lazily built BM25 indexes keyed by document id, kept in memory for the
+    most recently used documents.
+    """
+
+    def __init__(self, database: Database, max_in_memory: int = 64):
+        self.database = database
+        self.max_in_memory = max_in_memory
+        self._indexes: OrderedDict[str, BM25Index] = OrderedDict()
+        # Guards the in-memory indexes only, building takes the lock of the document
+        self._lock = threading.Lock()
+        self._document_locks: dict[str, threading.Lock] = {}
+
+    def _document_lock(self, document_id: str) -> threading.Lock:
+        with self._lock:
+            return self._document_locks.setdefault(document_id, threading.Lock())
+
+    def _cached(self, document_id: str) -> Optional[BM25Index]:
+        with self._lock:
+            index = self._indexes.get(document_id)
+            if index is not None:
+                self._indexes.move_to_end(document_id)
+            return index
+
+    def _remember(self, document_id: str, index: BM25Index) -> None:
+        with self._lock:
+            self._indexes[document_id] = index
+            self._indexes.move_to_end(document_id)
+            while len(self._indexes) > self.max_in_memory:
+                self._indexes.popitem(last=False)
+
+    def get_index(self, document_id: uuid.UUID) -> BM25Index:
+        """
+        Get the index of a document, building it from the database if
+        needed. Only the searches of the same document wait for a build.
+        """
+        key = str(document_id)
+        index = self._cached(key)
+        if index is not None:
+            return index
+
+        with self._document_lock(key):
+            index = self._cached(key)
+            if index is None:
+                logger.info(f"Building BM25 index for document {key}")
+                index = BM25Index(self.database.get_pages(key))
+                self._remember(key, index)
+            return index
+
+    def update(self, document_id: uuid.UUID) -> Optional[BM25Index]:
+        """
+        Rebuild the index of a document after ingestion and swap it in, so
+        that searches see either the old or the new index. Documents without
+        an index in memory are left to be built on first use.
+        """
+        key = str(document_id)
+        with self._document_lock(key):
+            index = self._cached(key)
+            if index is None:
+                return None
+            pages = self.database.get_pages(key)
+            indexed = [(page.page_num, page.text) for page in index.pages]
+            if [(page.page_num, page.text) for page in pages] != indexed:
+                logger.info(f"Rebuilding BM25 index for document {key}")
+                index = BM25Index(pages)
+                self._remember(key, index)
+            return index
+
+    def invalidate(self, document_id: uuid.UUID) -> None:
+        """
+        Drop the index of a deleted document
+        """
+        key = str(document_id)
+        with self._document_lock(key):
+            with self._lock:
+                self._indexes.pop(key, None)
+
+    def search(
+        self, document_ids: list[uuid.UUID], query: str, top_k: int = 5
+    ) -> list[tuple[Citation, float]]:
+        """
+        Find the pages of the documents which best match the query terms
+
+        Returns:
+            list[tuple[Citation, float]]: The pages and their BM25 scores, best match first
+        """
+        matches: list[tuple[Citation, float]] = []
+        for document_id in dict.fromkeys(str(doc_id) for doc_id in document_ids):
+            index = self.get_index(document_id)
+            indices, scores = index.search(query, top_k)
+            matches.extend(
+                (index.pages[i], float(score)) for i, score in zip(indices, scores)
+            )
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:top_k]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Citation]], k: int = 60
+) -> list[Citation]:
+    """
+    Merge several rankings of pages by summing 1 / (k + rank) per page
+
+    Args:
+        rankings (list[list[Citation]]): The rankings, best match first
+        k (int): Dampens the weight of the top ranks
+
+    Returns:
+        list[Citation]: The pages of all rankings, best fused score first
+    """
+    scores: dict[tuple, float] = {}
+    pages: dict[tuple, Citation] = {}
+    for ranking in rankings:
+        for rank, page in enumerate(ranking, start=1):
+            key = (page.document_id, page.page_num, page.text)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            pages.setdefault(key, page)
+
+    ordered = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [pages[key] for key in ordered]
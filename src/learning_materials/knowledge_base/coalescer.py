@@ -0,0 +1,103 @@
+""" Micro-batching of concurrent requests into single upstream calls """
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class RequestCoalescer(Generic[T, R]):
+    """
+    Merges single-item requests made from different threads within a short
+    time window into one call of a batch function.
+
+    The batch function must return one result per input, in input order.
+    Up to max_in_flight batches are sent at once, while they are all in
+    flight new requests keep joining the next batch.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list[T]], list[R]],
+        window: float = 0.01,
+        max_batch_size: int = 256,
+        max_in_flight: int = 4,
+    ):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: list[tuple[T, Future]] = []
+        self._condition = threading.Condition()
+        self._worker: threading.Thread = None
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="coalescer"
+        )
+
+    def submit(self, item: T) -> "Future[R]":
+        """
+        Queue an item for the next batch
+
+        Args:
+            item (T): The input of the batch function
+
+        Returns:
+            Future[R]: The future result for the item
+        """
+        future: Future = Future()
+        with self._condition:
+            self._pending.append((item, future))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            self._slots.acquire()
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                # Collect requests until the window closes or the batch is full
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._pending[: self.max_batch_size]
+                self._pending = self._pending[self.max_batch_size :]
+
+            self._executor.submit(self._execute_in_slot, batch)
+
+    def _execute_in_slot(self, batch: list[tuple[T, Future]]) -> None:
+        try:
+            self._execute(batch)
+        finally:
+            self._slots.release()
+
+    def _execute(self, batch: list[tuple[T, Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise ValueError(
+                    f"Expected {len(items)} results from the batch, got {len(results)}"
+                )
+        except Exception as e:
+            logger.error(f"Coalesced request of {len(items)} items failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -1,15 +1,31 @@
 from abc import ABC, abstractmethod
 import uuid
 from config import Config
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure
+from pymongo.operations import SearchIndexModel
 import logging
+import numpy as np
 
 from learning_materials.learning_resources import Citation, FullCitation
 from learning_materials.knowledge_base.embeddings import (
     OpenAIEmbedding,
 )
-
-from sklearn.metrics.pairwise import cosine_similarity
+from learning_materials.knowledge_base.document_cache import (
+    DocumentMatrix,
+    document_cache,
+)
+from learning_materials.knowledge_base.embedding_storage import (
+    decode_embedding,
+    encode_embedding,
+)
+from learning_materials.knowledge_base.vector_math import (
+    cosine_one_to_many,
+    dot_one_to_many,
+    normalize,
+    to_matrix,
+    top_k_indices,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -129,14 +145,61 @@ class Database(ABC):
         """
         pass
 
+    def get_pages(self, document_id: uuid.UUID) -> list[Citation]:
+        """
+        Retrieves all pages of a document without their embeddings.
+
+        Args:
+            document_id (str): The ID of the document to retrieve the pages from.
+
+        Returns:
+            list[Citation]: The pages of the document
+        """
+        return [
+            Citation(**page.model_dump(exclude={"embedding"}))
+            for page in self.get_all_pages(document_id)
+        ]
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the indexes used by the queries of the database, if any
+        """
+        pass
+
 
 class MongoDB(Database):
+    # Fields fetched per query, so that embeddings are only read when needed
+    PAGE_PROJECTION = {
+        "_id": 0,
+        "text": 1,
+        "pageNum": 1,
+        "documentName": 1,
+        "documentId": 1,
+    }
+    EMBEDDING_PROJECTION = {**PAGE_PROJECTION, "embedding": 1, "embeddingFormat": 1}
+
     def __init__(self):
         self.client = MongoClient(Config().MONGODB_URI)
         self.db = self.client[Config().MONGODB_DATABASE]
         self.collection = self.db[Config().MONGODB_COLLECTION]
-        self.similarity_threshold = 0.2
+        self.similarity_threshold = Config().RAG_SIMILARITY_THRESHOLD
         self.embeddings = OpenAIEmbedding()
+        self.storage_format = Config().EMBEDDING_STORAGE_FORMAT
+        if Config().MONGODB_ENSURE_INDEXES:
+            try:
+                self.ensure_indexes()
+            except Exception as e:
+                logger.error(f"Failed to ensure MongoDB indexes: {e}")
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the compound (documentId, pageNum) index used to look up the
+        pages of documents and page ranges. Does nothing if it already exists.
+        """
+        self.collection.create_index(
+            [("documentId", ASCENDING), ("pageNum", ASCENDING)],
+            name="documentId_pageNum",
+        )
 
     def get_curriculum(
         self, document_ids: list[uuid.UUID], embedding: list[float], top_k: int = 5
@@ -144,39 +207,69 @@ class MongoDB(Database):
         # Step 1: Filter by documentId first
         if not document_ids:
             raise ValueError("Document IDs cannot be empty")
-        cursor = self.collection.find(
-            {"documentId": {"$in": [str(doc_id) for doc_id in document_ids]}}
-        )
-        if not cursor:
-            raise ValueError("No documents found")
+        # Step 2: Load the embeddings of documents that are not cached yet
+        entries = self._get_document_matrices([str(doc_id) for doc_id in document_ids])
+        if not entries:
+            return []
+
+        # Score every candidate with a single matrix-vector product
+        matrix = np.vstack([entry.matrix for entry in entries])
+        pages = [page for entry in entries for page in entry.pages]
+        similarities = dot_one_to_many(matrix, normalize(embedding))
+        indices = top_k_indices(similarities, top_k)
 
         results = []
 
-        # Compute cosine similarities
-        similarities = []
-        for doc in cursor:
-            similarity = cosine_similarity([doc["embedding"]], [embedding])[0][0]
-            similarities.append((doc, similarity))
+        # Return those of the top k matches that are above the similarity threshold
+        for index in indices:
+            if similarities[index] > self.similarity_threshold:
+                results.append(pages[index].model_copy())
 
-        # Sort documents by similarity in descending order
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        return results
 
-        # Retrieve top 5 matches
-        top_5_matches = similarities[:top_k]
+    def _get_document_matrices(self, document_ids: list[str]) -> list[DocumentMatrix]:
+        """
+        Get the normalized embedding matrices of the documents, reading only
+        the documents missing from the document cache from MongoDB.
 
-        # Return those of the top 5 matches that are above the similarity threshold
-        for match in top_5_matches:
-            if match[1] > self.similarity_threshold:
-                results.append(
+        Args:
+            document_ids (list[str]): The ids of the documents
+
+        Returns:
+            list[DocumentMatrix]: The matrices of the documents that have pages, in the order of document_ids
+        """
+        entries = {doc_id: document_cache.get(doc_id) for doc_id in document_ids}
+        missing = [doc_id for doc_id, entry in entries.items() if entry is None]
+
+        if missing:
+            cursor = self.collection.find(
+                {"documentId": {"$in": missing}}, self.EMBEDDING_PROJECTION
+            )
+
+            # Group the pages by document
+            embeddings: dict[str, list[np.ndarray]] = {}
+            pages: dict[str, list[Citation]] = {}
+            for document in cursor:
+                doc_id = document["documentId"]
+                embeddings.setdefault(doc_id, []).append(decode_embedding(document))
+                pages.setdefault(doc_id, []).append(
                     Citation(
-                        text=match[0]["text"],
-                        page_num=match[0]["pageNum"],
-                        document_name=match[0]["documentName"],
-                        document_id=match[0]["documentId"],
+                        text=document["text"],
+                        page_num=document["pageNum"],
+                        document_name=document["documentName"],
+                        document_id=doc_id,
                     )
                 )
 
-        return results
+            for doc_id in embeddings:
+                entry = DocumentMatrix(
+                    matrix=normalize(to_matrix(embeddings[doc_id])),
+                    pages=pages[doc_id],
+                )
+                document_cache.put(doc_id, entry)
+                entries[doc_id] = entry
+
+        return [entry for entry in entries.values() if entry is not None]
 
     def get_page_range(
         self, document_id: uuid.UUID, page_num_start: int, page_num_end: int
@@ -186,7 +279,8 @@ class MongoDB(Database):
             {
                 "documentId": str(document_id),
                 "pageNum": {"$gte": page_num_start, "$lte": page_num_end},
-            }
+            },
+            self.PAGE_PROJECTION,
         )
 
         if not cursor:
@@ -239,7 +333,7 @@ class MongoDB(Database):
                     "text": curriculum,
                     "pageNum": page_num,
                     "documentName": document_name,
-                    "embedding": embedding,
+                    **self._embedding_fields(embedding),
                     "documentId": str(document_id),
                 }
             )
@@ -279,7 +373,7 @@ class MongoDB(Database):
                     "videoUrl": video_url,
                     "timestamp": timestamp,
                     "videoName": video_name,
-                    "embedding": embedding,
+                    **self._embedding_fields(embedding),
                     "documentId": str(document_id),
                 }
             )
@@ -288,6 +382,12 @@ class MongoDB(Database):
             logger.error(f"Error posting video: {e}")
             return False
 
+    def _embedding_fields(self, embedding: list[float]) -> dict:
+        value, storage_format = encode_embedding(embedding, self.storage_format)
+        if storage_format is None:
+            return {"embedding": value}
+        return {"embedding": value, "embeddingFormat": storage_format}
+
     def is_reachable(self) -> bool:
         try:
             # Send a ping to confirm a successful connection
@@ -303,7 +403,8 @@ class MongoDB(Database):
         cursor = self.collection.find(
             {
                 "documentId": str(document_id),
-            }
+            },
+            self.EMBEDDING_PROJECTION,
         )
 
         if not cursor:
@@ -318,12 +419,124 @@ class MongoDB(Database):
                     page_num=document["pageNum"],
                     document_name=document["documentName"],
                     document_id=document["documentId"],
-                    embedding=document["embedding"],
+                    embedding=decode_embedding(document),
                 )
             )
 
         return results
 
+    def get_pages(self, document_id: uuid.UUID) -> list[Citation]:
+        cursor = self.collection.find(
+            {"documentId": str(document_id)}, self.PAGE_PROJECTION
+        )
+        return [
+            Citation(
+                text=document["text"],
+                page_num=document["pageNum"],
+                document_name=document["documentName"],
+                document_id=document["documentId"],
+            )
+            for document in cursor
+        ]
+
+
+class MongoDBAtlas(MongoDB):
+    """
+    MongoDB Atlas database which runs the similarity search inside the store
+    with $vectorSearch, so only the text and metadata of the top k pages are
+    sent over the network. Falls back to the client-side search of MongoDB
+    when the vector index is unavailable.
+    """
+
+    def __init__(self):
+        # $vectorSearch only indexes embeddings stored as arrays, packed ones would
+        # silently be left out of the search
+        storage_format = Config().EMBEDDING_STORAGE_FORMAT
+        if storage_format != "array":
+            raise ValueError(
+                f"The atlas database needs EMBEDDING_STORAGE_FORMAT=array, not {storage_format}"
+            )
+        super().__init__()
+        self.vector_index = Config().MONGODB_VECTOR_INDEX
+        self.num_candidates_per_result = 20
+
+    def get_curriculum(
+        self, document_ids: list[uuid.UUID], embedding: list[float], top_k: int = 5
+    ) -> list[Citation]:
+        if not document_ids:
+            raise ValueError("Document IDs cannot be empty")
+
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.vector_index,
+                    "path": "embedding",
+                    "queryVector": embedding,
+                    "numCandidates": min(10000, top_k * self.num_candidates_per_result),
+                    "limit": top_k,
+                    "filter": {
+                        "documentId": {"$in": [str(doc_id) for doc_id in document_ids]}
+                    },
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "text": 1,
+                    "pageNum": 1,
+                    "documentName": 1,
+                    "documentId": 1,
+                    "score": {"$meta": "vectorSearchScore"},
+                }
+            },
+        ]
+
+        try:
+            documents = list(self.collection.aggregate(pipeline))
+        except OperationFailure as e:
+            logger.warning(f"Vector search failed, using client-side search: {e}")
+            return super().get_curriculum(document_ids, embedding, top_k)
+
+        results = []
+        for document in documents:
+            # Atlas scales cosine similarity to [0, 1] as (1 + cosine) / 2
+            similarity = 2 * document["score"] - 1
+            if similarity > self.similarity_threshold:
+                results.append(
+                    Citation(
+                        text=document["text"],
+                        page_num=document["pageNum"],
+                        document_name=document["documentName"],
+                        document_id=document["documentId"],
+                    )
+                )
+
+        return results
+
+    def create_vector_index(self, dimensions: int = 1536) -> None:
+        """
+        Create the Atlas vector search index used by get_curriculum
+
+        Args:
+            dimensions (int): The number of dimensions of the stored embeddings
+        """
+        index = SearchIndexModel(
+            name=self.vector_index,
+            type="vectorSearch",
+            definition={
+                "fields": [
+                    {
+                        "type": "vector",
+                        "path": "embedding",
+                        "numDimensions": dimensions,
+                        "similarity": "cosine",
+                    },
+                    {"type": "filter", "path": "documentId"},
+                ]
+            },
+        )
+        self.collection.create_search_index(index)
+
 
 class MockDatabase(Database):
     """
@@ -347,26 +560,38 @@ class MockDatabase(Database):
             self.initialized = True
 
     def get_curriculum(
-        self, document_id: uuid.UUID, embedding: list[float], top_k: int = 5
+        self, document_ids: list[uuid.UUID], embedding: list[float], top_k: int = 5
     ) -> list[Citation]:
+        if not document_ids:
+            raise ValueError("Document IDs cannot be empty")
         if not embedding:
             raise ValueError("Embedding cannot be None")
 
-        results = []
-
-        # Filter documents based on similarity and document_name
-        for document in self.data:
-            if document["documentId"] == str(document_id):
-                similarity = cosine_similarity(embedding, document["embedding"])
-                if similarity > self.similarity_threshold:
-                    results.append(
-                        Citation(
-                            text=document["text"],
-                            page_num=document["pageNum"],
-                            document_name=document["documentName"],
-                        )
-                    )
-        return results
+        ids = {str(doc_id) for doc_id in document_ids}
+        pages = [
+            document
+            for document in self.data
+            if document["documentId"] in ids and "text" in document
+        ]
+        if not pages:
+            return []
+
+        # Score every page of the documents at once
+        similarities = cosine_one_to_many(
+            to_matrix([page["embedding"] for page in pages]), embedding
+        )
+        indices = top_k_indices(similarities, top_k)
+
+        return [
+            Citation(
+                text=pages[index]["text"],
+                page_num=pages[index]["pageNum"],
+                document_name=pages[index]["documentName"],
+                document_id=pages[index]["documentId"],
+            )
+            for index in indices
+            if similarities[index] > self.similarity_threshold
+        ]
 
     def get_video(
         self, document_id: uuid.UUID, embedding: list[float]
@@ -374,21 +599,27 @@ class MockDatabase(Database):
         if not embedding:
             raise ValueError("Embedding cannot be None")
 
-        results = []
+        videos = [
+            document
+            for document in self.data
+            if document["documentId"] == str(document_id) and "videoUrl" in document
+        ]
+        if not videos:
+            return []
 
-        # Filter documents based on similarity and document_name
-        for document in self.data:
-            if document["documentId"] == str(document_id):
-                similarity = cosine_similarity(embedding, document["embedding"])
-                if similarity > self.similarity_threshold:
-                    results.append(
-                        Citation(
-                            video_url=document["videoUrl"],
-                            timestamp=document["timestamp"],
-                            video_name=document["videoName"],
-                        )
-                    )
-        return results
+        similarities = cosine_one_to_many(
+            to_matrix([video["embedding"] for video in videos]), embedding
+        )
+
+        return [
+            Citation(
+                video_url=video["videoUrl"],
+                timestamp=video["timestamp"],
+                video_name=video["videoName"],
+            )
+            for video, similarity in zip(videos, similarities)
+            if similarity > self.similarity_threshold
+        ]
 
     def get_page_range(
         self, document_id: uuid.UUID, page_num_start: int, page_num_end: int
@@ -433,6 +664,28 @@ class MockDatabase(Database):
         )
         return True
 
+    def post_video(
+        self,
+        video_url: str,
+        timestamp: str,
+        video_name: str,
+        embedding: list[float],
+        document_id: uuid.UUID,
+    ) -> bool:
+        if not video_url or not timestamp or not video_name or not embedding:
+            raise ValueError("All parameters are required and must be valid")
+
+        self.data.append(
+            {
+                "videoUrl": video_url,
+                "timestamp": timestamp,
+                "videoName": video_name,
+                "embedding": embedding,
+                "documentId": str(document_id),
+            }
+        )
+        return True
+
     def is_reachable(self) -> bool:
         return True
 
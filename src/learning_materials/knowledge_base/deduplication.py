@@ -0,0 +1,103 @@
+""" Removal of near-duplicate generated learning materials """
+
+import logging
+from typing import Any, Optional, TypeVar
+
+import numpy as np
+from prometheus_client import Counter
+
+from config import Config
+from learning_materials.knowledge_base.rag_service import get_text_embeddings
+from learning_materials.knowledge_base.vector_math import (
+    dot_many_to_many,
+    normalize,
+    to_matrix,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEDUPLICATED_ITEMS = Counter(
+    "tutorai_deduplicated_items_total",
+    "Generated items removed as near duplicates of another item",
+    ["kind"],
+)
+
+
+def near_duplicate_groups(
+    embeddings: list[list[float]], threshold: float, scores: Optional[list[Any]] = None
+) -> list[list[int]]:
+    """
+    Group the embeddings greedily: the best item which is not grouped yet
+    starts a group, and takes every ungrouped item whose cosine similarity
+    to it is at least the threshold.
+
+    Args:
+        embeddings (list[list[float]]): The embeddings of the items
+        threshold (float): The cosine similarity of near duplicates
+        scores (Optional[list[Any]]): The comparable quality of each item, the first item is the best by default
+
+    Returns:
+        list[list[int]]: The indices of each group, best item first, ordered by the best item
+    """
+    if not embeddings:
+        return []
+
+    matrix = normalize(to_matrix(embeddings))
+    similarities = dot_many_to_many(matrix, matrix)
+    order = range(len(embeddings))
+    if scores is not None:
+        # Stable, so that equally good items keep their order
+        order = sorted(order, key=lambda i: scores[i], reverse=True)
+
+    grouped = np.zeros(len(embeddings), dtype=bool)
+    groups = []
+    for best in order:
+        if grouped[best]:
+            continue
+        members = np.flatnonzero(~grouped & (similarities[best] >= threshold))
+        grouped[members] = True
+        grouped[best] = True
+        groups.append([int(best)] + [int(i) for i in members if i != best])
+    return sorted(groups, key=lambda group: group[0])
+
+
+def deduplicate(
+    items: list[T],
+    texts: list[str],
+    scores: Optional[list[Any]] = None,
+    kind: str = "item",
+    threshold: Optional[float] = None,
+) -> list[T]:
+    """
+    Keep the best item of every group of near duplicates. The texts are
+    embedded in one batch. If they cannot be embedded, all items are kept.
+
+    Args:
+        items (list[T]): The items
+        texts (list[str]): The text of each item to compare
+        scores (Optional[list[Any]]): The comparable quality of each item
+        kind (str): The kind of the items, for the metrics
+        threshold (Optional[float]): The cosine similarity of near duplicates, DEDUP_SIMILARITY_THRESHOLD by default
+
+    Returns:
+        list[T]: The kept items, in their original order
+    """
+    if threshold is None:
+        threshold = Config().DEDUP_SIMILARITY_THRESHOLD
+    if threshold <= 0 or len(items) < 2:
+        return items
+
+    try:
+        embeddings = get_text_embeddings(texts)
+    except Exception as e:
+        logger.warning(f"Could not embed the {kind}s for deduplication: {e}")
+        return items
+
+    groups = near_duplicate_groups(embeddings, threshold, scores)
+    removed = len(items) - len(groups)
+    if removed:
+        DEDUPLICATED_ITEMS.labels(kind=kind).inc(removed)
+        logger.info(f"Removed {removed} near-duplicate {kind}s")
+    return [items[group[0]] for group in groups]
@@ -0,0 +1,110 @@
+""" In-process cache of normalized embedding matrices per document """
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from config import Config
+from learning_materials.learning_resources import Citation
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DocumentMatrix:
+    """
+    The pre-normalized embeddings of a document together with their pages.
+    Row i of the matrix is the embedding of pages[i].
+    """
+
+    matrix: np.ndarray
+    pages: list[Citation]
+
+    @property
+    def nbytes(self) -> int:
+        text_bytes = sum(len(page.text) for page in self.pages)
+        return self.matrix.nbytes + text_bytes
+
+
+class DocumentEmbeddingCache:
+    """
+    Thread-safe LRU cache of DocumentMatrix entries keyed by document id,
+    bounded by the total number of bytes held.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, DocumentMatrix] = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, document_id) -> bool:
+        return str(document_id) in self._entries
+
+    def get(self, document_id) -> Optional[DocumentMatrix]:
+        """
+        Get the cached entry of a document and mark it as recently used
+
+        Args:
+            document_id (UUID | str): The id of the document
+
+        Returns:
+            Optional[DocumentMatrix]: The cached entry, or None on a cache miss
+        """
+        key = str(document_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, document_id, entry: DocumentMatrix) -> None:
+        """
+        Cache the entry of a document, evicting the least recently used
+        entries until the cache fits within max_bytes.
+        Entries larger than the whole cache are not stored.
+        """
+        key = str(document_id)
+        if entry.nbytes > self.max_bytes:
+            logger.info(f"Document {key} is too large to be cached")
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._size_bytes += entry.nbytes
+
+            while self._size_bytes > self.max_bytes:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+
+    def invalidate(self, document_id) -> None:
+        """
+        Remove a document from the cache
+        """
+        with self._lock:
+            self._remove(str(document_id))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size_bytes -= entry.nbytes
+
+
+document_cache = DocumentEmbeddingCache(Config().DOCUMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,114 @@
+""" Two-tier cache of text embeddings keyed by model and normalized text """
+
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from django.core.cache import caches
+from prometheus_client import Counter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_REQUESTS = Counter(
+    "tutorai_embedding_cache_requests_total",
+    "Embedding cache lookups by tier and result",
+    ["tier", "result"],
+)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize the text so that strings which only differ in unicode form or
+    whitespace share a cache entry
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(model_name: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"embedding:{model_name}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Embedding cache with an in-process LRU tier in front of a persistent
+    Django cache tier shared between processes.
+    Persistent entries are stored as packed float32 bytes.
+    """
+
+    def __init__(self, max_entries: int, persistent_alias: str = "embeddings"):
+        self.max_entries = max_entries
+        self.persistent_alias = persistent_alias
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, text: str) -> Optional[list[float]]:
+        """
+        Look up the embedding of a text
+
+        Args:
+            model_name (str): The embedding model
+            text (str): The embedded text
+
+        Returns:
+            Optional[list[float]]: The embedding, or None on a cache miss
+        """
+        key = embedding_cache_key(model_name, text)
+
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+        if embedding is not None:
+            EMBEDDING_CACHE_REQUESTS.labels(tier="memory", result="hit").inc()
+            return embedding
+        EMBEDDING_CACHE_REQUESTS.labels(tier="memory", result="miss").inc()
+
+        try:
+            packed = caches[self.persistent_alias].get(key)
+        except Exception as e:
+            logger.warning(f"Could not read the persistent embedding cache: {e}")
+            packed = None
+        if packed is None:
+            EMBEDDING_CACHE_REQUESTS.labels(tier="persistent", result="miss").inc()
+            return None
+
+        EMBEDDING_CACHE_REQUESTS.labels(tier="persistent", result="hit").inc()
+        embedding = np.frombuffer(packed, dtype="<f4").tolist()
+        self._remember(key, embedding)
+        return embedding
+
+    def set(self, model_name: str, text: str, embedding: list[float]) -> None:
+        """
+        Store the embedding of a text in both tiers
+        """
+        key = embedding_cache_key(model_name, text)
+        self._remember(key, embedding)
+        try:
+            packed = np.asarray(embedding, dtype="<f4").tobytes()
+            caches[self.persistent_alias].set(key, packed, timeout=None)
+        except Exception as e:
+            logger.warning(f"Could not write the persistent embedding cache: {e}")
+
+    def clear(self) -> None:
+        """
+        Clear the in-process tier
+        """
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key: str, embedding: list[float]) -> None:
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+embedding_cache = EmbeddingCache(Config().EMBEDDING_CACHE_SIZE)
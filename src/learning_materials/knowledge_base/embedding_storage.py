@@ -0,0 +1,52 @@
+""" Storage formats of embeddings in the knowledge base """
+
+from typing import Optional
+
+import numpy as np
+from bson.binary import Binary
+
+# Packed little-endian formats. "array" stores a BSON array of doubles.
+STORAGE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+STORAGE_FORMATS = ["array", *STORAGE_DTYPES]
+
+
+def encode_embedding(
+    embedding: list[float], storage_format: str = "array"
+) -> tuple[list[float] | Binary, Optional[str]]:
+    """
+    Encode an embedding for storage
+
+    Args:
+        embedding (list[float]): The embedding
+        storage_format (str): One of STORAGE_FORMATS
+
+    Returns:
+        tuple[list[float] | Binary, Optional[str]]: The value of the embedding field and the value of the embeddingFormat field, None for arrays
+    """
+    if storage_format == "array":
+        return embedding, None
+    if storage_format not in STORAGE_DTYPES:
+        raise ValueError(f"Embedding storage format {storage_format} not supported")
+
+    packed = np.asarray(embedding, dtype=STORAGE_DTYPES[storage_format]).tobytes()
+    return Binary(packed), storage_format
+
+
+def decode_embedding(document: dict) -> np.ndarray:
+    """
+    Decode the embedding of a stored document. Packed float32 embeddings
+    are read without copying the buffer.
+
+    Args:
+        document (dict): The stored document with an embedding and optionally an embeddingFormat field
+
+    Returns:
+        np.ndarray: The embedding as a (d,) array
+    """
+    storage_format = document.get("embeddingFormat")
+    if storage_format is None:
+        return np.asarray(document["embedding"], dtype=np.float32)
+    return np.frombuffer(document["embedding"], dtype=STORAGE_DTYPES[storage_format])
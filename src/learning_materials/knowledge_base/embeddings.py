@@ -1,7 +1,15 @@
 from abc import ABC, abstractmethod
-import openai
+from functools import lru_cache
+import logging
+import tiktoken
 from config import Config
-import numpy as np
+
+from learning_materials.knowledge_base.coalescer import RequestCoalescer
+from learning_materials.knowledge_base.embedding_cache import embedding_cache
+from learning_materials.knowledge_base.llm import get_openai_client
+from learning_materials.knowledge_base.vector_math import cosine_one_to_many, to_matrix
+
+logger = logging.getLogger(__name__)
 
 
 class EmbeddingsModel(ABC):
@@ -19,19 +27,122 @@ class EmbeddingsModel(ABC):
         """
         pass
 
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Get the embeddings of several texts using the model
+
+        Args:
+            texts (list[str]): The texts to be embedded
+
+        Returns:
+            list[list[float]]: The embeddings of the texts, in the same order as the texts
+        """
+        return [self.get_embedding(text) for text in texts]
+
 
 class OpenAIEmbedding(EmbeddingsModel):
+    # Limits of the OpenAI embeddings endpoint per request
+    max_inputs_per_request = 2048
+    max_tokens_per_request = 300_000
+
     def __init__(
         self, model_name: str = "text-embedding-3-small"
     ):  # TODO: Make sure the model is the same as used in tango-scraper
-        api_key = Config().API_KEY
-        self.client = openai.Client(api_key=api_key)
+        self.client = get_openai_client()
         self.model_name = model_name
 
+        # Merge single embeddings requested concurrently into one request
+        window = Config().EMBEDDING_COALESCE_WINDOW_MS / 1000
+        self._coalescer = (
+            RequestCoalescer(
+                self._request_embeddings,
+                window,
+                max_in_flight=Config().EMBEDDING_COALESCE_MAX_IN_FLIGHT,
+            )
+            if window > 0
+            else None
+        )
+
     def get_embedding(self, text: str) -> list[float]:
         text = text.replace("\n", " ")
-        response = self.client.embeddings.create(input=text, model=self.model_name)
-        return response.data[0].embedding
+        embedding = embedding_cache.get(self.model_name, text)
+        if embedding is None:
+            if self._coalescer is not None:
+                embedding = self._coalescer.submit(text).result()
+            else:
+                embedding = self._request_embeddings([text])[0]
+            embedding_cache.set(self.model_name, text, embedding)
+        return embedding
+
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        embeddings = [embedding_cache.get(self.model_name, text) for text in texts]
+
+        missing = list(
+            dict.fromkeys(
+                text for text, embedding in zip(texts, embeddings) if embedding is None
+            )
+        )
+        if missing:
+            fetched = dict(zip(missing, self._request_embeddings(missing)))
+            for text, embedding in fetched.items():
+                embedding_cache.set(self.model_name, text, embedding)
+            embeddings = [
+                embedding if embedding is not None else fetched[text]
+                for text, embedding in zip(texts, embeddings)
+            ]
+
+        return embeddings
+
+    def _request_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed the texts with as few requests as the API limits allow
+        """
+        embeddings = []
+        for batch in self._split_into_batches(texts):
+            response = self.client.embeddings.create(input=batch, model=self.model_name)
+            data = sorted(response.data, key=lambda item: item.index)
+            embeddings.extend(item.embedding for item in data)
+        return embeddings
+
+    def _split_into_batches(self, texts: list[str]) -> list[list[str]]:
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = _count_tokens(text)
+            if batch and (
+                len(batch) >= self.max_inputs_per_request
+                or batch_tokens + tokens > self.max_tokens_per_request
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load the tiktoken encoding: {e}")
+        return None
+
+
+def _count_tokens(text: str) -> int:
+    """
+    Count the tokens of the text, falling back to the number of UTF-8 bytes,
+    which is an upper bound, when the tokenizer is unavailable
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text.encode("utf-8"))
+    return len(encoding.encode(text, disallowed_special=()))
 
 
 def cosine_similarity(embedding1: list[float], embedding2: list[float]) -> float:
@@ -45,12 +156,4 @@ def cosine_similarity(embedding1: list[float], embedding2: list[float]) -> float
     Returns:
         float: The cosine similarity between the two embeddings
     """
-    sum_times = 0
-    embedding1_sq = 0
-    embedding2_sq = 0
-    for i in range(len(embedding1)):
-        sum_times += embedding1[i] * embedding2[i]
-        embedding1_sq += embedding1[i] ** 2
-        embedding2_sq += embedding2[i] ** 2
-    root_times_emb1_emb2 = np.sqrt(embedding1_sq * embedding2_sq)
-    return sum_times / root_times_emb1_emb2
+    return float(cosine_one_to_many(to_matrix([embedding2]), embedding1)[0])
@@ -2,6 +2,7 @@ from learning_materials.knowledge_base.db_interface import (
     Database,
     MockDatabase,
     MongoDB,
+    MongoDBAtlas,
 )
 from learning_materials.knowledge_base.embeddings import (
     EmbeddingsModel,
@@ -13,6 +14,8 @@ def create_database(database_system: str = "mongodb") -> Database:
     match database_system.lower():
         case "mongodb":
             return MongoDB()
+        case "atlas":
+            return MongoDBAtlas()
         case "mock":
             return MockDatabase()
         case _:
@@ -1,9 +1,139 @@
+""" Registry of shared LLM clients with pooled keep-alive connections """
+
+import asyncio
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+import openai
 from langchain_openai import ChatOpenAI
 
 from config import Config
+from learning_materials.knowledge_base.rate_limit import (
+    AsyncThrottledTransport,
+    LLMThrottle,
+    ThrottledTransport,
+    create_throttle,
+)
+
+_lock = threading.Lock()
+_throttle: Optional[LLMThrottle] = None
+_http_client: Optional[httpx.Client] = None
+_openai_client: Optional[openai.OpenAI] = None
+# Async connections belong to the event loop they were opened on
+_async_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, openai.AsyncOpenAI]" = (
+    weakref.WeakKeyDictionary()
+)
+_chat_models: dict[tuple[Optional[str], float, Optional[int]], ChatOpenAI] = {}
+
+
+def _connection_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=Config().LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=Config().LLM_MAX_CONNECTIONS,
+        keepalive_expiry=Config().LLM_KEEPALIVE_SECONDS,
+    )
+
+
+def get_throttle() -> LLMThrottle:
+    """
+    The rate limiter and adaptive concurrency limiter every LLM and
+    embedding request of the process goes through
+    """
+    global _throttle
+    with _lock:
+        if _throttle is None:
+            _throttle = create_throttle()
+        return _throttle
+
+
+def get_http_client() -> httpx.Client:
+    """
+    The HTTP client shared by all synchronous LLM and embedding calls of the
+    process. Its connections are kept alive, so that calls do not pay for a
+    new TLS handshake.
+    """
+    global _http_client
+    throttle = get_throttle()
+    with _lock:
+        if _http_client is None:
+            transport = httpx.HTTPTransport(limits=_connection_limits())
+            _http_client = httpx.Client(transport=ThrottledTransport(throttle, transport))
+        return _http_client
+
+
+def get_openai_client() -> openai.OpenAI:
+    """
+    The shared OpenAI client. It is thread-safe, so it can be used by the
+    threads of a fan-out.
+    """
+    global _openai_client
+    http_client = get_http_client()
+    with _lock:
+        if _openai_client is None:
+            _openai_client = openai.OpenAI(
+                api_key=Config().API_KEY, http_client=http_client
+            )
+        return _openai_client
+
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """
+    The async OpenAI client of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    throttle = get_throttle()
+    with _lock:
+        client = _async_openai_clients.get(loop)
+        if client is None:
+            transport = httpx.AsyncHTTPTransport(limits=_connection_limits())
+            client = openai.AsyncOpenAI(
+                api_key=Config().API_KEY,
+                http_client=httpx.AsyncClient(
+                    transport=AsyncThrottledTransport(throttle, transport)
+                ),
+            )
+            _async_openai_clients[loop] = client
+        return client
+
+
+def get_chat_model(
+    model: Optional[str] = None,
+    temperature: float = 0.0,
+    max_retries: Optional[int] = None,
+) -> ChatOpenAI:
+    """
+    The shared chat model for a model, temperature and number of retries.
+    Calls made through fan_out are retried by fan_out, so their model should
+    not retry as well.
+
+    Args:
+        model (Optional[str]): The model name, or None for the default model of ChatOpenAI
+        temperature (float): The sampling temperature
+        max_retries (Optional[int]): The retries of the client, or None for the default of ChatOpenAI
+
+    Returns:
+        ChatOpenAI: A chat model on the shared HTTP client
+    """
+    key = (model, temperature, max_retries)
+    http_client = get_http_client()
+    with _lock:
+        chat_model = _chat_models.get(key)
+        if chat_model is None:
+            kwargs = {"model": model} if model else {}
+            if max_retries is not None:
+                kwargs["max_retries"] = max_retries
+            chat_model = ChatOpenAI(
+                api_key=Config().API_KEY,
+                temperature=temperature,
+                http_client=http_client,
+                **kwargs,
+            )
+            _chat_models[key] = chat_model
+        return chat_model
 
 
-def create_llm_model() -> ChatOpenAI:
+def create_llm_model(max_retries: Optional[int] = None) -> ChatOpenAI:
 
-    llm = ChatOpenAI(api_key=Config().API_KEY, temperature=0.0)
-    return llm
+    return get_chat_model(temperature=0.0, max_retries=max_retries)
@@ -1,7 +1,13 @@
 """ Retrieval Augmented Generation Service """
 
+import logging
 import uuid
 from learning_materials.learning_resources import Citation
+from learning_materials.knowledge_base.ann_index import AnnIndexStore
+from learning_materials.knowledge_base.bm25_index import (
+    BM25IndexStore,
+    reciprocal_rank_fusion,
+)
 from learning_materials.knowledge_base.db_interface import Database
 from learning_materials.knowledge_base.embeddings import EmbeddingsModel
 from learning_materials.knowledge_base.factory import create_database
@@ -12,6 +18,20 @@ db_system = Config().RAG_DATABASE_SYSTEM
 db: Database = create_database(db_system)
 embeddings: EmbeddingsModel = create_embeddings_model()
 
+# "exact" scans every page, "ann" uses the local ANN indexes and "verify" runs
+# both, logs the recall of the ANN search and returns the exact results
+search_mode = Config().RAG_SEARCH_MODE
+ann_indexes = AnnIndexStore(db, Config().ANN_INDEX_DIR, Config().ANN_TARGET_RECALL)
+
+# Fuse the vector search with a BM25 search over the page text
+hybrid_search = Config().RAG_HYBRID_SEARCH
+bm25_indexes = BM25IndexStore(db)
+top_k = Config().RAG_TOP_K
+# The number of candidates of each search which are fused into the top k
+hybrid_candidates = 4
+
+logger = logging.getLogger(__name__)
+
 
 def get_context(document_ids: list[uuid.UUID], query: str) -> list[Citation]:
     """
@@ -23,11 +43,68 @@ def get_context(document_ids: list[uuid.UUID], query: str) -> list[Citation]:
     Returns:
         list[str]: The context of the query
     """
-    embedding = embeddings.get_embedding(query)
-    context = db.get_curriculum(document_ids, embedding)
+    embedding = get_query_embedding(query)
+    if not hybrid_search:
+        return _get_vector_context(document_ids, embedding, top_k)
+
+    candidates = top_k * hybrid_candidates
+    vector_context = _get_vector_context(document_ids, embedding, candidates)
+    lexical_context = [
+        citation.model_copy()
+        for citation, _ in bm25_indexes.search(document_ids, query, candidates)
+    ]
+    return reciprocal_rank_fusion([vector_context, lexical_context])[:top_k]
+
+
+def get_query_embedding(query: str) -> list[float]:
+    """
+    Embed a query. Repeated queries are served from the embedding cache.
+    """
+    return embeddings.get_embedding(query)
+
+
+def get_text_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embed several texts in as few requests as possible, in the same order
+    as the texts
+    """
+    return embeddings.get_embeddings(texts)
+
+
+def _get_vector_context(
+    document_ids: list[uuid.UUID], embedding: list[float], top_k: int
+) -> list[Citation]:
+    """
+    Get the context of the query embedding with the configured search mode
+    """
+    if search_mode == "ann":
+        return _get_approximate_context(document_ids, embedding, top_k)
+
+    context = db.get_curriculum(document_ids, embedding, top_k)
+    if search_mode == "verify":
+        approximate = _get_approximate_context(document_ids, embedding, top_k)
+        found = {(c.document_id, c.page_num, c.text) for c in approximate}
+        hits = sum((c.document_id, c.page_num, c.text) in found for c in context)
+        logger.info(f"ANN search found {hits} of {len(context)} exact matches")
     return context
 
 
+def _get_approximate_context(
+    document_ids: list[uuid.UUID], embedding: list[float], top_k: int = 5
+) -> list[Citation]:
+    """
+    Get the context of the query from the ANN indexes of the documents
+    """
+    if not document_ids:
+        raise ValueError("Document IDs cannot be empty")
+    matches = ann_indexes.search(document_ids, embedding, top_k)
+    return [
+        citation.model_copy()
+        for citation, similarity in matches
+        if similarity > db.similarity_threshold
+    ]
+
+
 def get_page_range(
     document_id: uuid.UUID,
     page_num_start: int,
@@ -67,3 +144,4 @@ def post_context(
 
     embedding = embeddings.get_embedding(context)
     return db.post_curriculum(context, page_num, document_name, embedding, document_id)
+
@@ -0,0 +1,460 @@
+""" Rate limiting and adaptive concurrency control of outbound LLM calls """
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LLM_CONCURRENCY_LIMIT = Gauge(
+    "tutorai_llm_concurrency_limit",
+    "The current adaptive limit of concurrent LLM calls",
+)
+LLM_CALLS_IN_FLIGHT = Gauge(
+    "tutorai_llm_calls_in_flight",
+    "The number of LLM calls in flight",
+)
+LLM_THROTTLED_CALLS = Counter(
+    "tutorai_llm_throttled_calls_total",
+    "LLM calls rejected by the provider with a 429 response",
+)
+
+# Tokens reserved for the completion of a chat request without max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+
+class TokenBucket:
+    """
+    Token bucket holding at most capacity tokens, refilled continuously at
+    rate tokens per second. It is guarded by the lock of its rate limiter.
+    """
+
+    def __init__(
+        self, capacity: float, rate: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.capacity = capacity
+        self.rate = rate
+        self._clock = clock
+        self._level = capacity
+        self._updated_at = clock()
+
+    def refill(self) -> float:
+        now = self._clock()
+        self._level = min(
+            self.capacity, self._level + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+        return self._level
+
+    def wait_time(self, amount: float) -> float:
+        """
+        The seconds until amount tokens are available, 0 if they are available now
+        """
+        level = self.refill()
+        return max(0.0, (min(amount, self.capacity) - level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._level -= min(amount, self.capacity)
+
+
+class LocalRateLimiter:
+    """
+    Requests and tokens per minute limits of one process. A limit of 0
+    disables it.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._buckets: list[tuple[TokenBucket, bool]] = []
+        if requests_per_minute > 0:
+            self._buckets.append(
+                (TokenBucket(requests_per_minute, requests_per_minute / 60, clock), False)
+            )
+        if tokens_per_minute > 0:
+            self._buckets.append(
+                (TokenBucket(tokens_per_minute, tokens_per_minute / 60, clock), True)
+            )
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: int) -> float:
+        """
+        Take one request and the tokens if both are available
+
+        Returns:
+            float: 0 if they were taken, otherwise the seconds to wait before trying again
+        """
+        with self._lock:
+            wait = max(
+                (
+                    bucket.wait_time(tokens if counts_tokens else 1)
+                    for bucket, counts_tokens in self._buckets
+                ),
+                default=0.0,
+            )
+            if wait == 0:
+                for bucket, counts_tokens in self._buckets:
+                    bucket.take(tokens if counts_tokens else 1)
+            return wait
+
+
+# Both buckets are refilled and taken atomically on the clock of the Redis server
+_REDIS_ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = capacity / 60
+    local amount = math.min(tonumber(ARGV[2 * i]), capacity)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    level = math.min(capacity, level + (now - updated_at) * rate)
+    levels[i] = level
+    if level < amount then
+        wait = math.max(wait, (amount - level) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local level = levels[i]
+    if wait == 0 then
+        level = level - math.min(tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i - 1]))
+    end
+    redis.call('HSET', key, 'level', level, 'ts', now)
+    redis.call('EXPIRE', key, 120)
+end
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """
+    Requests and tokens per minute limits shared by every process using the
+    same Redis server. A limit of 0 disables it.
+    """
+
+    def __init__(
+        self, url: str, requests_per_minute: int, tokens_per_minute: int, prefix: str = "llm_rate"
+    ):
+        try:
+            import redis
+        except ImportError as e:
+            raise ValueError(
+                "The redis package is required for LLM_RATE_LIMIT_REDIS_URL"
+            ) from e
+
+        self._script = redis.Redis.from_url(url).register_script(_REDIS_ACQUIRE_SCRIPT)
+        self._limits: list[tuple[str, int, bool]] = []
+        if requests_per_minute > 0:
+            self._limits.append((f"{prefix}:requests", requests_per_minute, False))
+        if tokens_per_minute > 0:
+            self._limits.append((f"{prefix}:tokens", tokens_per_minute, True))
+
+    def try_acquire(self, tokens: int) -> float:
+        if not self._limits:
+            return 0.0
+
+        args = []
+        for _, capacity, counts_tokens in self._limits:
+            args.extend([capacity, tokens if counts_tokens else 1])
+        try:
+            return float(
+                self._script(keys=[key for key, _, _ in self._limits], args=args)
+            )
+        except Exception as e:
+            # An unreachable Redis must not stop the LLM calls
+            logger.warning(f"Could not reach the LLM rate limiter: {e}")
+            return 0.0
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit of concurrent calls: the limit is halved when a call is
+    throttled or takes much longer than usual, at most once per cooldown,
+    and grows by one after a limit's worth of successful calls.
+    A latency_spike_factor of 0 only reacts to throttling.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        latency_spike_factor: float = 3.0,
+        decrease_factor: float = 0.5,
+        cooldown_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_spike_factor = latency_spike_factor
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._baseline_latency: Optional[float] = None
+        self._decreased_at = float("-inf")
+        self._condition = threading.Condition()
+        LLM_CONCURRENCY_LIMIT.set(self._limit)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            LLM_CALLS_IN_FLIGHT.set(self._in_flight)
+            return True
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            LLM_CALLS_IN_FLIGHT.set(self._in_flight)
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        """
+        Release the slot of a finished call and adapt the limit to its outcome
+
+        Args:
+            latency (float): The seconds the call took
+            throttled (bool): Whether the provider rejected the call with a 429
+        """
+        with self._condition:
+            self._in_flight -= 1
+            LLM_CALLS_IN_FLIGHT.set(self._in_flight)
+
+            spike = (
+                self.latency_spike_factor > 0
+                and self._baseline_latency is not None
+                and latency > self.latency_spike_factor * self._baseline_latency
+            )
+            if throttled or spike:
+                now = self._clock()
+                if now - self._decreased_at >= self.cooldown_seconds:
+                    self._decreased_at = now
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+            if not throttled:
+                # Exponentially weighted moving average of the latency
+                self._baseline_latency = (
+                    latency
+                    if self._baseline_latency is None
+                    else 0.9 * self._baseline_latency + 0.1 * latency
+                )
+
+            LLM_CONCURRENCY_LIMIT.set(self._limit)
+            self._condition.notify_all()
+
+
+class LLMThrottle:
+    """
+    Admission of outbound LLM calls: a call waits for the rate limiter and
+    for a slot of the adaptive concurrency limiter
+    """
+
+    def __init__(self, rate_limiter, concurrency: AdaptiveConcurrencyLimiter):
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+
+    def acquire(self, tokens: int) -> None:
+        while (wait := self.rate_limiter.try_acquire(tokens)) > 0:
+            time.sleep(wait)
+        self.concurrency.acquire()
+
+    async def acquire_async(self, tokens: int) -> None:
+        # The Redis rate limiter blocks on the network, so it must not run on the event loop
+        while (wait := await asyncio.to_thread(self.rate_limiter.try_acquire, tokens)) > 0:
+            await asyncio.sleep(wait)
+        while not self.concurrency.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self, latency: float, status_code: Optional[int]) -> None:
+        throttled = status_code == 429
+        if throttled:
+            LLM_THROTTLED_CALLS.inc()
+        self.concurrency.release(latency, throttled)
+
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """
+    Rough number of tokens a request uses, about four bytes per prompt token
+    plus the completion tokens of a chat request
+    """
+    content = request.content
+    tokens = len(content) // 4
+    if request.url.path.endswith("/chat/completions"):
+        try:
+            body = json.loads(content)
+        except ValueError:
+            body = {}
+        tokens += (
+            body.get("max_completion_tokens")
+            or body.get("max_tokens")
+            or DEFAULT_COMPLETION_TOKENS
+        )
+    return max(tokens, 1)
+
+
+class _Slot:
+    """
+    The concurrency slot of one call, released once when the call ends
+    """
+
+    def __init__(self, throttle: LLMThrottle):
+        self.throttle = throttle
+        self.started = time.monotonic()
+        self.status_code: Optional[int] = None
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.throttle.release(time.monotonic() - self.started, self.status_code)
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """
+    Response body which releases the slot of the call when it is closed
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, slot: _Slot):
+        self.stream = stream
+        self.slot = slot
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self.slot.release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """
+    Async response body which releases the slot of the call when it is closed
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, slot: _Slot):
+        self.stream = stream
+        self.slot = slot
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self.slot.release()
+
+
+class ThrottledTransport(httpx.BaseTransport):
+    """
+    HTTP transport which admits every request through the LLM throttle. The
+    slot is held until the response is closed, so streamed completions count
+    as in flight and their latency covers the whole body.
+    """
+
+    def __init__(self, throttle: LLMThrottle, transport: httpx.BaseTransport):
+        self.throttle = throttle
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.throttle.acquire(estimate_tokens(request))
+        slot = _Slot(self.throttle)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            slot.release()
+            raise
+        slot.status_code = response.status_code
+        if response.is_closed:
+            # The body was read in full already
+            slot.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, slot)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncThrottledTransport(httpx.AsyncBaseTransport):
+    """
+    Async HTTP transport which admits every request through the LLM
+    throttle, holding the slot until the response is closed
+    """
+
+    def __init__(self, throttle: LLMThrottle, transport: httpx.AsyncBaseTransport):
+        self.throttle = throttle
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.throttle.acquire_async(estimate_tokens(request))
+        slot = _Slot(self.throttle)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            slot.release()
+            raise
+        slot.status_code = response.status_code
+        if response.is_closed:
+            # The body was read in full already
+            slot.release()
+        else:
+            response.stream = _AsyncReleasingStream(response.stream, slot)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def create_throttle() -> LLMThrottle:
+    """
+    The throttle configured by Config, shared through Redis if
+    LLM_RATE_LIMIT_REDIS_URL is set and local to the process otherwise
+    """
+    config = Config()
+    if config.LLM_RATE_LIMIT_REDIS_URL:
+        rate_limiter = RedisRateLimiter(
+            config.LLM_RATE_LIMIT_REDIS_URL,
+            config.LLM_REQUESTS_PER_MINUTE,
+            config.LLM_TOKENS_PER_MINUTE,
+        )
+    else:
+        rate_limiter = LocalRateLimiter(
+            config.LLM_REQUESTS_PER_MINUTE, config.LLM_TOKENS_PER_MINUTE
+        )
+    concurrency = AdaptiveConcurrencyLimiter(
+        config.LLM_MIN_CONCURRENCY,
+        config.LLM_MAX_CONCURRENCY,
+        config.LLM_LATENCY_SPIKE_FACTOR,
+    )
+    return LLMThrottle(rate_limiter, concurrency)
@@ -1,10 +1,13 @@
 import logging
-
-import openai
+from typing import AsyncIterator
 
 from config import Config
 from learning_materials.learning_resources import Flashcard, Quiz, RagAnswer
-from learning_materials.knowledge_base.llm import create_llm_model
+from learning_materials.knowledge_base.llm import (
+    create_llm_model,
+    get_async_openai_client,
+    get_openai_client,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -105,21 +108,18 @@ def generate_title_of_quiz(quiz: Quiz, language: str = "en") -> str:
     return title.content.strip('"')
 
 
+NO_CONTEXT_RESPONSE = "No context matching the user input was found. Please try again or upload additional documents."
+
+
 def response_formulation(
     user_input: str, context: list[str], chat_history: list[dict[str, str]], language: str = "en"
 ) -> str:
     logger.info("Generating response")
 
     if len(context) == 0 and len(chat_history) == 0 or user_input == "":
-        return "No context matching the user input was found. Please try again or upload additional documents."
-
-    # Create template
-    template = f"""
-    Query: '''{user_input}'''
-    Context: '''{context}'''
-    """
-    logger.info(f"template: {template}")
+        return NO_CONTEXT_RESPONSE
 
+    template = _template_query(user_input, context)
     response: str = _request_chat_completion(
         template,
         role="user",
@@ -149,23 +149,89 @@ def _request_chat_completion(
     if not message:
         result = "Error: No message provided"
     else:
-        # Construct history
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
-        for chat in history:
-            messages.append(chat)
-        messages.append({"role": role, "content": str(message)})
         # Send request to OpenAI
-        openai.api_key = Config().API_KEY
-        response = openai.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model=Config().GPT_MODEL,
-            messages=messages,
+            messages=_chat_messages(message, role, history, system_prompt),
         )
         result = response.choices[0].message.content
     return result
 
 
+async def stream_response_formulation(
+    user_input: str, context: list[str], chat_history: list[dict[str, str]], language: str = "en"
+) -> AsyncIterator[str]:
+    """
+    Stream the response to the user input as it is generated
+
+    Args:
+        user_input (str): The question of the user
+        context (list[str]): The context found in the curriculum
+        chat_history (list[dict[str, str]]): The previous messages of the chat
+        language (str): The language code of the course
+
+    Yields:
+        str: The next part of the response
+    """
+    logger.info("Streaming response")
+
+    if len(context) == 0 and len(chat_history) == 0 or user_input == "":
+        yield NO_CONTEXT_RESPONSE
+        return
+
+    template = _template_query(user_input, context)
+    async for delta in _stream_chat_completion(
+        template,
+        role="user",
+        history=chat_history,
+        system_prompt=_template_system_prompt(language),
+    ):
+        yield delta
+
+
+async def _stream_chat_completion(
+    message: str,
+    role: str = "system",
+    history: list[dict[str, str]] = [],
+    system_prompt: str = "",
+) -> AsyncIterator[str]:
+    """
+    Streams a response from the OpenAI API
+
+    Yields:
+        str: The content deltas of the response
+    """
+    stream = await get_async_openai_client().chat.completions.create(
+        model=Config().GPT_MODEL,
+        messages=_chat_messages(message, role, history, system_prompt),
+        stream=True,
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _chat_messages(
+    message: str, role: str, history: list[dict[str, str]], system_prompt: str
+) -> list[dict[str, str]]:
+    messages = [
+        {"role": "system", "content": system_prompt},
+    ]
+    for chat in history:
+        messages.append(chat)
+    messages.append({"role": role, "content": str(message)})
+    return messages
+
+
+def _template_query(user_input: str, context: list[str]) -> str:
+    template = f"""
+    Query: '''{user_input}'''
+    Context: '''{context}'''
+    """
+    logger.info(f"template: {template}")
+    return template
+
+
 def _template_system_prompt(language: str = "en", document_names: list[str] = []) -> str:
     template = f"""
         # Role and Goal:
@@ -0,0 +1,125 @@
+""" Vectorized similarity scoring for the knowledge base """
+
+import numpy as np
+
+
+def to_matrix(embeddings: list[list[float]]) -> np.ndarray:
+    """
+    Stack a list of embeddings into a single float32 matrix
+
+    Args:
+        embeddings (list[list[float]]): The embeddings to stack
+
+    Returns:
+        np.ndarray: A (n, d) float32 matrix with one embedding per row
+    """
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize the rows of a matrix (or a single vector)
+
+    Rows with a norm of zero are left as zeros, which gives them a cosine
+    similarity of 0 to everything, the same as sklearn's cosine_similarity.
+
+    Args:
+        matrix (np.ndarray): A (n, d) matrix or a (d,) vector
+
+    Returns:
+        np.ndarray: The normalized float32 matrix or vector
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Select the indices of the k highest scores, ordered by descending score
+
+    Uses a partial sort so only the k selected scores are fully sorted.
+
+    Args:
+        scores (np.ndarray): A (n,) array of scores
+        k (int): The number of indices to select
+
+    Returns:
+        np.ndarray: The indices of the top k scores
+    """
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def dot_one_to_many(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    Score every row of a matrix against one query. On normalized inputs
+    this is the cosine similarity.
+
+    Args:
+        matrix (np.ndarray): A (n, d) float32 matrix
+        query (np.ndarray): A (d,) float32 vector
+
+    Returns:
+        np.ndarray: The (n,) dot products
+    """
+    return matrix @ query
+
+
+def dot_many_to_many(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Score every row of a matrix against every row of a query matrix. On
+    normalized inputs this is the cosine similarity.
+
+    Args:
+        matrix (np.ndarray): A (n, d) float32 matrix
+        queries (np.ndarray): A (m, d) float32 matrix
+
+    Returns:
+        np.ndarray: The (n, m) dot products
+    """
+    return matrix @ queries.T
+
+
+def cosine_one_to_many(matrix: np.ndarray, query: list[float]) -> np.ndarray:
+    """
+    Cosine similarity of every row of a matrix to one query, for inputs
+    which are not normalized yet
+    """
+    return dot_one_to_many(normalize(matrix), normalize(query))
+
+
+def cosine_many_to_many(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of every row of a matrix to every row of a query
+    matrix, for inputs which are not normalized yet
+    """
+    return dot_many_to_many(normalize(matrix), normalize(queries))
+
+
+def top_k_cosine(
+    matrix: np.ndarray, query: list[float], k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k rows of the matrix most similar to the query
+
+    Args:
+        matrix (np.ndarray): A (n, d) matrix of candidate embeddings
+        query (list[float]): The (d,) query embedding
+        k (int): The number of matches to return
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The indices of the matches and their cosine similarities, best match first
+    """
+    scores = cosine_one_to_many(matrix, query)
+    indices = top_k_indices(scores, k)
+    return indices, scores[indices]
@@ -1,19 +1,31 @@
 """ The service module contains the business logic of the application. """
 
 import logging
+import time
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional
+from typing import AsyncIterator, Hashable, Optional
 import uuid
 
+from asgiref.sync import sync_to_async
+
 from learning_materials.knowledge_base.response_formulation import (
     response_formulation,
+    stream_response_formulation,
 )
+from learning_materials.knowledge_base.answer_cache import answer_cache
+from learning_materials.knowledge_base.deduplication import deduplicate
 from learning_materials.knowledge_base.rag_service import (
     get_context,
     get_page_range,
+    get_query_embedding,
 )
 from learning_materials.flashcards.flashcards_service import generate_flashcards
+from learning_materials.flashcards.generation_planner import (
+    generate_within_budget,
+    get_page_clusters,
+)
+from learning_materials.utils.generation_executor import generation_executor
+from learning_materials.utils.progress import report_progress
 from learning_materials.learning_resources import (
     Flashcard,
     Citation,
@@ -23,24 +35,60 @@ from learning_materials.learning_resources import (
 logger = logging.getLogger(__name__)
 
 
-def _process_flashcards_by_pages(pages: list[Citation], language: str = "en") -> list[Flashcard]:
+def _process_flashcards_by_pages(
+    pages: list[Citation],
+    language: str = "en",
+    owner: Optional[Hashable] = None,
+    max_amount_to_generate: Optional[int] = None,
+    page_clusters: Optional[dict[int, str]] = None,
+) -> list[Flashcard]:
     """
-    Generate flashcards for a specific page range and file
+    Generate flashcards for a specific page range and file. The pages are
+    generated on the shared generation executor, which takes turns between
+    the requests of different owners. Near-duplicate cards are removed. With
+    a maximum amount, only the pages needed for that many distinct cards are
+    generated, picked to cover the clusters of the document.
+
+    Raises:
+        ExecutorSaturated: If the generation executor cannot take the pages
     """
     logger.info("Trying to find relevant document")
     logger.info(f"Found {len(pages)} pages in the document")
     flashcards: list[Flashcard] = []
 
-    # Use ThreadPoolExecutor to parallelize the API calls
-    with ThreadPoolExecutor() as executor:
-        # Schedule the execution of each page processing and hold the future objects
-        futures = [executor.submit(generate_flashcards, page, language) for page in pages]
-
-        # As each future completes, gather the results
-        for future in as_completed(futures):
+    if max_amount_to_generate is not None:
+        return generate_within_budget(
+            pages,
+            lambda page: generate_flashcards(page, language),
+            max_amount_to_generate,
+            owner,
+            page_clusters,
+            deduplicate=_deduplicate_flashcards,
+        )
+
+    futures = generation_executor.map(
+        owner, lambda page: generate_flashcards(page, language), pages
+    )
+    try:
+        for done, future in enumerate(futures, start=1):
             flashcards.extend(future.result())
+            report_progress(done, len(futures))
+    finally:
+        # Do not spend the workers on a request which has failed
+        for future in futures:
+            future.cancel()
 
-    return flashcards
+    return _deduplicate_flashcards(flashcards)
+
+
+def _deduplicate_flashcards(flashcards: list[Flashcard]) -> list[Flashcard]:
+    # Overlapping pages give near-identical cards, keep the one with the fullest answer
+    return deduplicate(
+        flashcards,
+        [flashcard.front for flashcard in flashcards],
+        [len(flashcard.back) for flashcard in flashcards],
+        kind="flashcard",
+    )
 
 
 def _post_process_flashcards(
@@ -59,9 +107,16 @@ def process_flashcards_by_subject(
     subject: str,
     language: str = "en",
     max_amount_to_generate: Optional[int] = None,
+    owner: Optional[Hashable] = None,
 ) -> list[Flashcard]:
     pages = get_context([document_id], subject)
-    flashcards = _process_flashcards_by_pages(pages, language)
+    flashcards = _process_flashcards_by_pages(
+        pages,
+        language,
+        owner,
+        max_amount_to_generate,
+        get_page_clusters(document_id) if max_amount_to_generate is not None else None,
+    )
     flashcards = _post_process_flashcards(flashcards, max_amount_to_generate)
 
     return flashcards
@@ -73,13 +128,23 @@ def process_flashcards_by_page_range(
     page_num_end: int,
     language: str = "en",
     max_amount_to_generate: Optional[int] = None,
+    owner: Optional[Hashable] = None,
 ) -> list[Flashcard]:
     pages = get_page_range(document_id, page_num_start, page_num_end)
-    flashcards = _process_flashcards_by_pages(pages, language)
+    flashcards = _process_flashcards_by_pages(
+        pages,
+        language,
+        owner,
+        max_amount_to_generate,
+        get_page_clusters(document_id) if max_amount_to_generate is not None else None,
+    )
     flashcards = _post_process_flashcards(flashcards, max_amount_to_generate)
     return flashcards
 
 
+NO_DOCUMENTS_ANSWER = "I need a bit more information to help you. Please select some files, and I'll provide you with a detailed answer."
+
+
 def process_answer(
     document_ids: list[uuid.UUID],
     user_question: str,
@@ -88,16 +153,68 @@ def process_answer(
 ) -> RagAnswer:
     """
     Process the user's question and return a response based on the context of the documents and chat history.
+    The answers to the first question of a chat are shared between similar questions through the answer cache.
     """
+    started = time.perf_counter()
+    cacheable = answer_cache.enabled and not _has_prior_turns(chat_history, user_question)
+    if cacheable:
+        embedding = get_query_embedding(user_question)
+        cached_answer = answer_cache.get(document_ids, lanugage, embedding)
+        if cached_answer is not None:
+            return cached_answer
+
     # Retrieve relevant contexts for the provided documents
     curriculum: list[Citation] = get_context(document_ids, user_question)
 
     # Handle case when no context is available
     if len(curriculum) == 0:
-        answer_content = "I need a bit more information to help you. Please select some files, and I'll provide you with a detailed answer."
+        answer_content = NO_DOCUMENTS_ANSWER
     else:
         answer_content = response_formulation(user_question, curriculum, chat_history, lanugage)
 
     # Create a response object
     answer = RagAnswer(content=answer_content, citations=curriculum)
+    if cacheable and len(curriculum) > 0:
+        answer_cache.put(
+            document_ids, lanugage, embedding, answer, time.perf_counter() - started
+        )
     return answer
+
+
+def _has_prior_turns(chat_history: list[dict[str, str]], user_question: str) -> bool:
+    """
+    Whether the chat has messages before the question, which the answer may depend on
+    """
+    return any(
+        message["role"] != "user" or message["content"] != user_question
+        for message in chat_history
+    )
+
+
+async def _single_delta(content: str) -> AsyncIterator[str]:
+    yield content
+
+
+async def stream_answer(
+    document_ids: list[uuid.UUID],
+    user_question: str,
+    chat_history: list[dict[str, str]],
+    language: str,
+) -> tuple[list[Citation], AsyncIterator[str]]:
+    """
+    Streaming variant of process_answer. The context is retrieved up front so
+    that the citations can be sent before the answer is generated.
+
+    Returns:
+        tuple[list[Citation], AsyncIterator[str]]: The citations and the content deltas of the answer
+    """
+    # The retrieval does not use the ORM, so it may run outside the main thread
+    curriculum: list[Citation] = await sync_to_async(get_context, thread_sensitive=False)(
+        document_ids, user_question
+    )
+
+    if len(curriculum) == 0:
+        return curriculum, _single_delta(NO_DOCUMENTS_ANSWER)
+
+    deltas = stream_response_formulation(user_question, curriculum, chat_history, language)
+    return curriculum, deltas
@@ -1,7 +1,9 @@
 """ This module contains the Pydantic models for the learning resources. """
 
 from typing import Union, Optional
-from pydantic import BaseModel, Field, PrivateAttr
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 
 
 class QuestionAnswer(BaseModel):
@@ -62,7 +64,12 @@ class Citation(BaseModel):
 
 
 class FullCitation(Citation):
-    embedding: list[float] = Field(description="The embeddings of the page")
+    # Embeddings read from the database stay arrays over the stored buffer
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    embedding: Union[np.ndarray, list[float]] = Field(
+        description="The embeddings of the page"
+    )
 
 
 class RagAnswer(BaseModel):
@@ -0,0 +1,79 @@
+""" Rewrite the stored embeddings of the knowledge base in another storage format """
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+
+from config import Config
+from learning_materials.knowledge_base.db_interface import MongoDB
+from learning_materials.knowledge_base.embedding_storage import (
+    STORAGE_FORMATS,
+    decode_embedding,
+    encode_embedding,
+)
+
+
+class Command(BaseCommand):
+    help = "Rewrite the embeddings stored in MongoDB in the given storage format"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            default="float32",
+            choices=STORAGE_FORMATS,
+            help="The storage format to convert the embeddings to",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of documents rewritten per bulk write",
+        )
+        parser.add_argument(
+            "--document-id",
+            help="Only rewrite the pages of this document",
+        )
+
+    def handle(self, *args, **options):
+        storage_format = options["format"]
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("The batch size must be positive")
+        if storage_format != "array" and Config().RAG_DATABASE_SYSTEM == "atlas":
+            raise CommandError(
+                "The atlas database needs the array format, $vectorSearch only indexes arrays"
+            )
+
+        collection = MongoDB().collection
+
+        # Only documents which are not already in the target format
+        query = {"embedding": {"$exists": True}}
+        if storage_format == "array":
+            query["embeddingFormat"] = {"$exists": True}
+        else:
+            query["embeddingFormat"] = {"$ne": storage_format}
+        if options["document_id"]:
+            query["documentId"] = options["document_id"]
+
+        cursor = collection.find(query, {"embedding": 1, "embeddingFormat": 1})
+
+        rewritten = 0
+        operations = []
+        for document in cursor:
+            embedding = decode_embedding(document).tolist()
+            value, new_format = encode_embedding(embedding, storage_format)
+            if new_format is None:
+                update = {"$set": {"embedding": value}, "$unset": {"embeddingFormat": ""}}
+            else:
+                update = {"$set": {"embedding": value, "embeddingFormat": new_format}}
+            operations.append(UpdateOne({"_id": document["_id"]}, update))
+
+            if len(operations) >= batch_size:
+                rewritten += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            rewritten += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rewrote {rewritten} embeddings as {storage_format}")
+        )
@@ -0,0 +1,33 @@
+""" Create the indexes used by the knowledge base queries """
+
+from django.core.management.base import BaseCommand
+from pymongo.errors import OperationFailure
+
+from config import Config
+from learning_materials.knowledge_base.db_interface import MongoDBAtlas
+from learning_materials.knowledge_base.factory import create_database
+
+
+class Command(BaseCommand):
+    help = "Create the indexes of the knowledge base used by the retrieval queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dimensions",
+            type=int,
+            default=1536,
+            help="The number of dimensions of the embeddings, used for the Atlas vector index",
+        )
+
+    def handle(self, *args, **options):
+        database = create_database(Config().RAG_DATABASE_SYSTEM)
+        database.ensure_indexes()
+
+        if isinstance(database, MongoDBAtlas):
+            try:
+                database.create_vector_index(options["dimensions"])
+            except OperationFailure as e:
+                # Raised when the search index already exists
+                self.stdout.write(self.style.WARNING(f"Vector index not created: {e}"))
+
+        self.stdout.write(self.style.SUCCESS("Knowledge base indexes are in place"))
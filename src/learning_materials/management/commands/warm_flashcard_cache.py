@@ -0,0 +1,87 @@
+""" Generate the flashcards of every page of a document ahead of time """
+
+from typing import Optional
+
+from django.core.management.base import BaseCommand, CommandError
+
+from learning_materials.flashcards.flashcards_service import (
+    generate_flashcards,
+    get_cached_flashcards,
+)
+from learning_materials.knowledge_base import rag_service
+from learning_materials.models import Course
+from learning_materials.utils.fan_out import fan_out
+
+
+def request_languages(document_id: str) -> list[Optional[str]]:
+    """
+    The languages flashcard requests for the document are generated in: the
+    language of each course of the document, and none for requests without
+    a course
+    """
+    languages = Course.objects.filter(files__id=document_id).values_list(
+        "language", flat=True
+    )
+    return list(dict.fromkeys([None, *languages]))
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the flashcard generation cache for the pages of newly ingested "
+        "documents, so that cardsets over them are served without LLM calls"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "document_ids",
+            nargs="+",
+            help="The documents to generate flashcards for",
+        )
+        parser.add_argument(
+            "--language",
+            action="append",
+            help=(
+                "The language code of the flashcards, can be repeated (default: the "
+                "languages requests for the document use, those of its courses and none)"
+            ),
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            default=8,
+            help="The number of pages generated concurrently",
+        )
+
+    def handle(self, *args, **options):
+        max_workers = options["max_workers"]
+        if max_workers < 1:
+            raise CommandError("The number of workers must be positive")
+
+        generated = 0
+        failed = 0
+        for document_id in options["document_ids"]:
+            pages = rag_service.db.get_pages(document_id)
+            for language in options["language"] or request_languages(document_id):
+                missing = [
+                    page
+                    for page in pages
+                    if get_cached_flashcards(page.text, language) is None
+                ]
+                results = fan_out(
+                    lambda page: generate_flashcards(page, language),
+                    missing,
+                    max_workers=max_workers,
+                    # The flashcard model retries its own calls
+                    retries=0,
+                )
+                errors = [result for result in results if isinstance(result, Exception)]
+                for error in errors:
+                    self.stderr.write(f"Could not generate flashcards: {error}")
+                generated += len(results) - len(errors)
+                failed += len(errors)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated flashcards for {generated} pages, {failed} failed"
+            )
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-16 09:12
+
+import django.core.serializers.json
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_materials', '0013_quizmodel_scores'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('flashcards', 'Flashcards'), ('quiz', 'Quiz'), ('compendium', 'Compendium')], help_text='What the job generates', max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', help_text='The status of the job', max_length=20)),
+                ('progress', models.FloatField(default=0.0, help_text='The progress of the job from 0 to 1')),
+                ('parameters', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The validated request of the job')),
+                ('result', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The generated learning material', null=True)),
+                ('error', models.TextField(blank=True, help_text='Why the job failed, if it did', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(help_text='The user who submitted the job', on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-16 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_materials', '0014_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='How many times a worker has claimed the job'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, help_text='When a worker last claimed the job', null=True),
+        ),
+    ]
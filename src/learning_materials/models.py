@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from uuid import uuid4
 
@@ -343,3 +344,62 @@ class MultipleChoiceQuestionModel(models.Model):
 
     def __str__(self):
         return self.question
+
+
+class GenerationJob(models.Model):
+    """Model to track the asynchronous generation of learning materials"""
+
+    class Kind(models.TextChoices):
+        FLASHCARDS = "flashcards"
+        QUIZ = "quiz"
+        COMPENDIUM = "compendium"
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="generation_jobs",
+        on_delete=models.CASCADE,
+        help_text="The user who submitted the job",
+    )
+    kind = models.CharField(
+        max_length=20, choices=Kind.choices, help_text="What the job generates"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        help_text="The status of the job",
+    )
+    progress = models.FloatField(
+        default=0.0, help_text="The progress of the job from 0 to 1"
+    )
+    parameters = models.JSONField(
+        encoder=DjangoJSONEncoder, help_text="The validated request of the job"
+    )
+    result = models.JSONField(
+        encoder=DjangoJSONEncoder,
+        null=True,
+        blank=True,
+        help_text="The generated learning material",
+    )
+    error = models.TextField(
+        null=True, blank=True, help_text="Why the job failed, if it did"
+    )
+    started_at = models.DateTimeField(
+        null=True, blank=True, help_text="When a worker last claimed the job"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0, help_text="How many times a worker has claimed the job"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
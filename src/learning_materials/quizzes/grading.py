@@ -0,0 +1,121 @@
+""" Local, deterministic grading of quiz answers without the LLM """
+
+import re
+import string
+import unicodedata
+from typing import Optional, Union
+
+from pydantic import BaseModel
+
+from learning_materials.learning_resources import (
+    MultipleChoiceQuestion,
+    QuestionAnswer,
+)
+
+# An option picked by its letter, such as "b", "B)", "(b)" or "b."
+_OPTION_LETTER_RE = re.compile(r"^\(?([a-z])[\).:]?$")
+
+
+class LocalGrade(BaseModel):
+    """The grade of an answer which could be settled without the LLM"""
+
+    correct: bool
+    feedback: str
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Normalize an answer for comparison by folding case and unicode forms and
+    dropping punctuation and redundant whitespace
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(
+        " " if unicodedata.category(char).startswith("P") else char for char in text
+    )
+    return " ".join(text.split())
+
+
+def _resolve_option(
+    question: MultipleChoiceQuestion, student_answer: str
+) -> Optional[str]:
+    """
+    Find the option the student picked, by its text or by its letter
+    """
+    normalized = normalize_answer(student_answer)
+    for option in question.options:
+        if normalize_answer(option) == normalized:
+            return option
+
+    match = _OPTION_LETTER_RE.match(student_answer.strip().casefold())
+    if match:
+        index = string.ascii_lowercase.index(match.group(1))
+        if index < len(question.options):
+            return question.options[index]
+
+    return None
+
+
+def _feedback(correct: bool, answer: str) -> str:
+    if correct:
+        return "Correct!"
+    return f"Incorrect. The correct answer is: {answer}"
+
+
+def grade_multiple_choice(
+    question: MultipleChoiceQuestion, student_answer: str
+) -> Optional[LocalGrade]:
+    """
+    Grade a multiple choice answer by matching it to the options
+
+    Returns:
+        Optional[LocalGrade]: The grade, or None if the answer is not one of the options
+    """
+    if not student_answer or not student_answer.strip():
+        return LocalGrade(correct=False, feedback=_feedback(False, question.answer))
+
+    if normalize_answer(student_answer) == normalize_answer(question.answer):
+        return LocalGrade(correct=True, feedback=_feedback(True, question.answer))
+
+    option = _resolve_option(question, student_answer)
+    if option is None:
+        return None
+
+    correct = normalize_answer(option) == normalize_answer(question.answer)
+    return LocalGrade(correct=correct, feedback=_feedback(correct, question.answer))
+
+
+def grade_short_answer(
+    question: QuestionAnswer, student_answer: str
+) -> Optional[LocalGrade]:
+    """
+    Grade a short answer which is empty or exactly the correct answer. Near
+    matches are left to the LLM, since a single letter or word can flip the
+    meaning, as in "reversible" and "irreversible" or "mitosis" and "meiosis".
+
+    Returns:
+        Optional[LocalGrade]: The grade, or None if the answer has to be judged by the LLM
+    """
+    if not student_answer or not student_answer.strip():
+        return LocalGrade(correct=False, feedback=_feedback(False, question.answer))
+
+    if normalize_answer(student_answer) == normalize_answer(question.answer):
+        return LocalGrade(correct=True, feedback=_feedback(True, question.answer))
+
+    # Answers that differ may still be correct paraphrases
+    return None
+
+
+def grade_locally(
+    question: Union[QuestionAnswer, MultipleChoiceQuestion], student_answer: str
+) -> Optional[LocalGrade]:
+    """
+    Grade an answer without the LLM if it can be settled deterministically
+
+    Returns:
+        Optional[LocalGrade]: The grade, or None if the answer is ambiguous
+    """
+    if isinstance(question, MultipleChoiceQuestion):
+        return grade_multiple_choice(question, student_answer)
+    if isinstance(question, QuestionAnswer):
+        return grade_short_answer(question, student_answer)
+    return None
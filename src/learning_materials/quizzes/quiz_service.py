@@ -1,24 +1,37 @@
 import logging
 import re
-from typing import List, Union, Optional
+import threading
+from typing import Callable, List, Union, Optional
 from pydantic import BaseModel, Field
 
 from langchain.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 
+from config import Config
 from learning_materials.learning_resources import Quiz
 from learning_materials.learning_resources import GradedQuiz
+from learning_materials.knowledge_base.deduplication import deduplicate
+from learning_materials.knowledge_base.llm import get_chat_model
 from learning_materials.knowledge_base.rag_service import get_page_range, get_context
 from learning_materials.learning_resources import (
     Citation,
     QuestionAnswer,
     MultipleChoiceQuestion,
 )
+from learning_materials.quizzes.grading import grade_locally
+from learning_materials.utils.fan_out import fan_out
 
 logger = logging.getLogger(__name__)
 
-llm = ChatOpenAI(temperature=0.0)
+# Slow calls fail after the timeout so that they can be retried. The calls
+# are retried by fan_out, not by the client
+llm = get_chat_model(temperature=0.0, max_retries=0).bind(
+    timeout=Config().LLM_TIMEOUT_SECONDS
+)
+
+# Caps the grading calls in flight across all requests of the process, so
+# that one large quiz cannot starve the others
+grading_slots = threading.BoundedSemaphore(Config().QUIZ_GRADING_MAX_CONCURRENCY)
 
 
 # Add a new model for the LLM's grading output
@@ -116,11 +129,9 @@ def generate_quiz(
         max(1, num_questions // len(citations)) if num_questions else 5
     )
 
-    document_name = ""
-    for citation in citations:
-        document_name = citation.document_name
+    def generate_questions(citation: Citation) -> Quiz:
         # Chain to determine the quiz questions for each page
-        quiz_data = chain.invoke(
+        return chain.invoke(
             {
                 "language": language,
                 "page_content": citation.text,
@@ -128,8 +139,29 @@ def generate_quiz(
                 "num_questions": questions_per_citation,
             }
         )
+
+    # Generate the questions of all pages concurrently, keeping the page order
+    results = fan_out(
+        generate_questions,
+        citations,
+        max_workers=Config().QUIZ_MAX_CONCURRENCY,
+        retries=Config().LLM_MAX_RETRIES,
+    )
+
+    document_name = ""
+    for citation, quiz_data in zip(citations, results):
+        if isinstance(quiz_data, Exception):
+            logger.error(
+                f"Failed to generate questions for page {citation.page_num}: {quiz_data}"
+            )
+            continue
+        document_name = citation.document_name
         questions.extend(quiz_data.questions)
 
+    # Only fail the quiz if no page could be processed
+    if all(isinstance(result, Exception) for result in results):
+        raise results[0]
+
     # Post-process the quiz questions
     quiz: Quiz = Quiz(
         document_name=document_name,
@@ -149,9 +181,20 @@ def _post_process_quiz(
 ) -> Quiz:
     """
     Post-process the quiz questions to ensure a good variety of question types.
+    Near-duplicate questions are removed, preferring multiple choice questions.
     """
     logger.info("Post-processing quiz")
 
+    quiz.questions = deduplicate(
+        quiz.questions,
+        [question.question for question in quiz.questions],
+        [
+            (isinstance(question, MultipleChoiceQuestion), len(question.answer))
+            for question in quiz.questions
+        ],
+        kind="question",
+    )
+
     if num_questions is not None:
         # Ensure the number of questions does not exceed the maximum
         quiz.questions = quiz.questions[:num_questions]
@@ -159,9 +202,15 @@ def _post_process_quiz(
     return quiz
 
 
-def grade_quiz(quiz: Quiz, student_answers: list[str]) -> GradedQuiz:
+def grade_quiz(
+    quiz: Quiz, student_answers: list[str], detailed_feedback: bool = False
+) -> GradedQuiz:
     """
     Grades the quiz based on the student answers.
+
+    Answers that can be settled deterministically, such as picked options or
+    exact short answers, are graded locally. The LLM grades the remaining
+    answers, and writes the feedback of all answers if detailed_feedback is set.
     """
     if not (len(quiz.questions) == len(student_answers)):
         raise ValueError("All input lists must have the same length.")
@@ -226,48 +275,141 @@ def grade_quiz(quiz: Quiz, student_answers: list[str]) -> GradedQuiz:
         input_variables=["question", "correct_answer", "options", "student_answer"],
     )
 
+    batch_grading_prompt_template = """
+        You are a teacher AI tasked with grading student answers to quiz questions.
+
+        Below are {num_questions} numbered questions, each with the correct answer and the student's answer.
+        Multiple-choice questions also list their options.
+
+        {questions}
+
+        For each question, in order, evaluate whether the student's answer is correct and provide constructive feedback.
+        If the student didn't provide an answer, consider it incorrect and explain what the correct answer is.
+
+        Respond with a JSON object containing:
+        - answers_was_correct: A list of exactly {num_questions} booleans, one per question in order.
+        - feedback: A list of exactly {num_questions} feedback strings, one per question in order.
+    """
+
+    batch_grading_prompt = PromptTemplate(
+        template=batch_grading_prompt_template,
+        input_variables=["questions", "num_questions"],
+    )
+
     short_answer_chain = short_answer_prompt | llm | parse_and_sanitize
     multiple_choice_chain = multiple_choice_prompt | llm | parse_and_sanitize
+    batch_chain = batch_grading_prompt | llm | parse_and_sanitize
 
-    # Initialize an empty GradedQuiz with a default score of 0
-    graded_quiz = GradedQuiz(answers_was_correct=[], feedback=[], score=0)
-
-    for question, student_answer in zip(quiz.questions, student_answers):
+    def grade_question(
+        item: tuple[Union[QuestionAnswer, MultipleChoiceQuestion], str]
+    ) -> Optional[QuestionGrading]:
+        question, student_answer = item
         # Handle empty student answers by setting a default value
         if not student_answer or student_answer.strip() == "":
             student_answer = "[No answer provided]"
-            
-        if isinstance(question, QuestionAnswer):
-            data = {
-                "question": question.question,
-                "correct_answer": question.answer,
-                "student_answer": student_answer,
-            }
-            question_grade = short_answer_chain.invoke(data)
-
-        elif isinstance(question, MultipleChoiceQuestion):
-            data = {
-                "question": question.question,
-                "correct_answer": question.answer,
-                "options": question.options,
-                "student_answer": student_answer,
-            }
-            question_grade = multiple_choice_chain.invoke(data)
 
-        if not question_grade:
-            graded_quiz.answers_was_correct.append(False)
-            graded_quiz.feedback.append("Error grading question")
-            logger.error(f"Error grading question: {question}")
+        with grading_slots:
+            if isinstance(question, QuestionAnswer):
+                data = {
+                    "question": question.question,
+                    "correct_answer": question.answer,
+                    "student_answer": student_answer,
+                }
+                return short_answer_chain.invoke(data)
+
+            elif isinstance(question, MultipleChoiceQuestion):
+                data = {
+                    "question": question.question,
+                    "correct_answer": question.answer,
+                    "options": question.options,
+                    "student_answer": student_answer,
+                }
+                return multiple_choice_chain.invoke(data)
+
+        return None
+
+    def grade_batch(
+        batch: list[tuple[Union[QuestionAnswer, MultipleChoiceQuestion], str]]
+    ) -> QuestionGrading:
+        with grading_slots:
+            return batch_chain.invoke(
+                {
+                    "questions": _format_questions_for_grading(batch),
+                    "num_questions": len(batch),
+                }
+            )
+
+    local_grades = [
+        grade_locally(question, student_answer)
+        for question, student_answer in zip(quiz.questions, student_answers)
+    ]
+    llm_indices = [
+        i
+        for i, local_grade in enumerate(local_grades)
+        if local_grade is None or detailed_feedback
+    ]
+    logger.info(
+        f"Graded {len(local_grades) - len(llm_indices)} of {len(local_grades)} answers locally"
+    )
+
+    grading_mode = Config().QUIZ_GRADING_MODE
+    if grading_mode == "sequential":
+        max_workers = 1
+    else:
+        max_workers = Config().QUIZ_MAX_CONCURRENCY
+    items = [(quiz.questions[i], student_answers[i]) for i in llm_indices]
+
+    if grading_mode == "batch":
+        llm_grades = _grade_in_batches(
+            items,
+            grade_batch,
+            grade_question,
+            batch_size=Config().QUIZ_GRADING_BATCH_SIZE,
+            max_workers=max_workers,
+        )
+    else:
+        # Grade the remaining questions concurrently, keeping the question order
+        llm_grades = fan_out(
+            grade_question,
+            items,
+            max_workers=max_workers,
+            retries=Config().LLM_MAX_RETRIES,
+        )
+    question_grades = dict(zip(llm_indices, llm_grades))
+
+    # Initialize an empty GradedQuiz with a default score of 0
+    graded_quiz = GradedQuiz(answers_was_correct=[], feedback=[], score=0)
+
+    for i, question in enumerate(quiz.questions):
+        local_grade = local_grades[i]
+        question_grade = question_grades.get(i)
+
+        if question_grade is None:
+            graded_quiz.answers_was_correct.append(local_grade.correct)
+            graded_quiz.feedback.append(local_grade.feedback)
             continue
 
-        elif not question_grade.answers_was_correct or not question_grade.feedback:
-            graded_quiz.answers_was_correct.append(False)
-            graded_quiz.feedback.append("Error grading question")
+        if (
+            isinstance(question_grade, Exception)
+            or not question_grade.answers_was_correct
+            or not question_grade.feedback
+        ):
             logger.error(f"Error grading question: {question}")
+            if local_grade is not None:
+                # Only the feedback failed, the grade itself is known
+                graded_quiz.answers_was_correct.append(local_grade.correct)
+                graded_quiz.feedback.append(local_grade.feedback)
+            else:
+                graded_quiz.answers_was_correct.append(False)
+                graded_quiz.feedback.append("Error grading question")
             continue
+
+        # The LLM only writes the feedback of answers settled locally
+        if local_grade is not None:
+            graded_quiz.answers_was_correct.append(local_grade.correct)
         else:
             graded_quiz.answers_was_correct.append(question_grade.answers_was_correct[0])
-            graded_quiz.feedback.append(question_grade.feedback[0])
+        graded_quiz.feedback.append(question_grade.feedback[0])
 
     # Calculate the overall quiz score as the proportion of correct answers
     total_questions = len(graded_quiz.answers_was_correct)
@@ -278,3 +420,76 @@ def grade_quiz(quiz: Quiz, student_answers: list[str]) -> GradedQuiz:
         graded_quiz.score = 0
 
     return graded_quiz
+
+
+def _format_questions_for_grading(
+    items: list[tuple[Union[QuestionAnswer, MultipleChoiceQuestion], str]]
+) -> str:
+    """
+    Format numbered questions with their answers for the batch grading prompt
+    """
+    blocks = []
+    for number, (question, student_answer) in enumerate(items, start=1):
+        if not student_answer or student_answer.strip() == "":
+            student_answer = "[No answer provided]"
+        lines = [f"Question {number}: {question.question}"]
+        if isinstance(question, MultipleChoiceQuestion):
+            lines.append(f"Options: {question.options}")
+        lines.append(f"Correct Answer: {question.answer}")
+        lines.append(f"Student's Answer: {student_answer}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def _grade_in_batches(
+    items: list[tuple[Union[QuestionAnswer, MultipleChoiceQuestion], str]],
+    grade_batch: Callable[[list], QuestionGrading],
+    grade_question: Callable[[tuple], Optional[QuestionGrading]],
+    batch_size: int,
+    max_workers: int,
+) -> list[Union[QuestionGrading, Exception, None]]:
+    """
+    Grade the answers with one LLM call per batch of questions. The answers
+    of a batch whose output does not have one grade per question, and answers
+    without feedback, are graded again one question per call.
+
+    Returns:
+        list[Union[QuestionGrading, Exception, None]]: The grading of each answer, in the order of the items
+    """
+    batches = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+    batch_grades = fan_out(grade_batch, batches, max_workers=max_workers, retries=0)
+
+    grades: list[Union[QuestionGrading, Exception, None]] = []
+    for batch, batch_grade in zip(batches, batch_grades):
+        if isinstance(batch_grade, Exception) or not (
+            len(batch_grade.answers_was_correct)
+            == len(batch_grade.feedback)
+            == len(batch)
+        ):
+            logger.warning(f"Batch grading of {len(batch)} questions failed")
+            grades.extend([None] * len(batch))
+            continue
+
+        grades.extend(
+            QuestionGrading(answers_was_correct=[correct], feedback=[feedback])
+            if feedback
+            else None
+            for correct, feedback in zip(
+                batch_grade.answers_was_correct, batch_grade.feedback
+            )
+        )
+
+    # Fall back to one call per question for the answers that failed
+    failed = [i for i, grade in enumerate(grades) if grade is None]
+    if failed:
+        logger.info(f"Grading {len(failed)} questions one by one")
+        retried = fan_out(
+            grade_question,
+            [items[i] for i in failed],
+            max_workers=max_workers,
+            retries=Config().LLM_MAX_RETRIES,
+        )
+        for i, grade in zip(failed, retried):
+            grades[i] = grade
+
+    return grades
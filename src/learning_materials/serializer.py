@@ -9,6 +9,7 @@ from learning_materials.models import (
     Chat,
     Cardset,
     FlashcardModel,
+    GenerationJob,
     MultipleChoiceQuestionModel,
     QuestionAnswerModel,
     QuizModel,
@@ -281,6 +282,10 @@ class QuizStudentAnswer(serializers.Serializer):
         child=serializers.CharField(allow_blank=True),
         help_text="The list of answers",
     )
+    detailed_feedback = serializers.BooleanField(
+        default=False,
+        help_text="Let the AI write feedback for every answer, also those graded without it",
+    )
 
 
 class CurriculumSerializer(serializers.Serializer):
@@ -479,3 +484,29 @@ class ClusterElementSerializer(serializers.ModelSerializer):
             "z",
             "dimensions",
         ]
+
+
+class GenerationJobCreateSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(
+        choices=GenerationJob.Kind.choices,
+        help_text="What to generate",
+    )
+    parameters = serializers.DictField(
+        help_text="The request body of the matching creation endpoint",
+    )
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GenerationJob
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "progress",
+            "result",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
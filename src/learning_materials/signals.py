@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from learning_materials.knowledge_base.answer_cache import answer_cache
+from learning_materials.knowledge_base.document_cache import document_cache
+from learning_materials.models import UserFile
+
+
+@receiver(post_delete, sender=UserFile)
+def invalidate_document_cache(sender, instance: UserFile, **kwargs):
+    """
+    Drop the cached embeddings, answers and search indexes of a deleted file
+    """
+    # Imported here so that loading the app does not connect to the database of the knowledge base
+    from learning_materials.knowledge_base import rag_service
+
+    document_cache.invalidate(instance.id)
+    answer_cache.invalidate(instance.id)
+    rag_service.ann_indexes.invalidate(instance.id)
+    rag_service.bm25_indexes.invalidate(instance.id)
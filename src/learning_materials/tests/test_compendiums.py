@@ -0,0 +1,94 @@
+import itertools
+import json
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from learning_materials.compendiums import compendium_service
+from learning_materials.learning_resources import Citation
+
+
+def create_pages(start: int, end: int) -> list[Citation]:
+    return [
+        Citation(text=f"Text of page {num}", page_num=num, document_name="book.pdf")
+        for num in range(start, end + 1)
+    ]
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "compendiums": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+@patch("learning_materials.compendiums.compendium_service.get_page_range")
+@patch("learning_materials.compendiums.compendium_service.create_llm_model")
+class MapReduceCompendiumTests(TestCase):
+    def setUp(self):
+        caches["compendiums"].clear()
+        self.page_calls = []
+        self.reduce_calls = []
+        merge_names = itertools.count(1)
+
+        def fake_llm(prompt_value):
+            prompt = prompt_value.to_string()
+            if "Extract the key concepts" in prompt:
+                page = prompt.split("'''")[1]
+                self.page_calls.append(page)
+                return AIMessage(
+                    content=json.dumps(
+                        {
+                            "key_concepts": ["Shared: Repeated on every page", f"{page}: A page"],
+                            "summary": f"Summary of {page}",
+                        }
+                    )
+                )
+            self.reduce_calls.append(prompt)
+            return AIMessage(content=f"Merged {next(merge_names)}")
+
+        self.llm = RunnableLambda(fake_llm)
+        self.llm.model_name = "fake-model"
+
+    def test_summarizes_each_page_once_and_merges_hierarchically(
+        self, mock_create_llm_model, mock_get_page_range
+    ):
+        mock_create_llm_model.return_value = self.llm
+        mock_get_page_range.return_value = create_pages(1, 10)
+
+        compendium = compendium_service.generate_compendium("doc", 1, 10)
+
+        self.assertEqual(len(self.page_calls), 10)
+        # Pages 1-7 and 8-10 are merged first, then the two merged summaries
+        self.assertEqual(len(self.reduce_calls), 3)
+        self.assertEqual(compendium.summary, "Merged 3")
+        self.assertEqual(compendium.key_concepts[0], "Shared: Repeated on every page")
+        self.assertEqual(len(compendium.key_concepts), 11)
+        self.assertEqual(compendium.document_name, "book.pdf")
+
+    def test_extended_range_reuses_page_results(
+        self, mock_create_llm_model, mock_get_page_range
+    ):
+        mock_create_llm_model.return_value = self.llm
+        mock_get_page_range.return_value = create_pages(1, 10)
+        compendium_service.generate_compendium("doc", 1, 10)
+        self.page_calls.clear()
+        self.reduce_calls.clear()
+
+        mock_get_page_range.return_value = create_pages(1, 12)
+        compendium_service.generate_compendium("doc", 1, 12)
+
+        self.assertCountEqual(self.page_calls, ["Text of page 11", "Text of page 12"])
+        # The merge of pages 1-7 is reused
+        self.assertEqual(len(self.reduce_calls), 2)
+
+    def test_single_page_needs_no_reduce(self, mock_create_llm_model, mock_get_page_range):
+        mock_create_llm_model.return_value = self.llm
+        mock_get_page_range.return_value = create_pages(3, 3)
+
+        compendium = compendium_service.generate_compendium("doc", 3, 3)
+
+        self.assertEqual(self.reduce_calls, [])
+        self.assertEqual(compendium.summary, "Summary of Text of page 3")
@@ -1,19 +1,30 @@
-from django.test import TestCase
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from unittest.mock import patch, MagicMock
 from django.contrib.auth import get_user_model
-from learning_materials.models import FlashcardModel, Cardset
+from learning_materials.models import Cardset, Course, FlashcardModel, UserFile
 from learning_materials.learning_resources import Flashcard, Citation
 from learning_materials.flashcards.flashcards_service import (
     generate_flashcards,
     parse_for_anki,
     FlashcardWrapper,
 )
+from learning_materials.flashcards.generation_planner import (
+    generate_within_budget,
+    order_pages,
+)
+from learning_materials.learning_material_service import _process_flashcards_by_pages
+from learning_materials.utils.generation_executor import ExecutorSaturated, FairExecutor
 
 User = get_user_model()
 
 
 class FlashcardGenerationTests(TestCase):
-    @patch("learning_materials.flashcards.flashcards_service.ChatOpenAI")
+    @patch("learning_materials.flashcards.flashcards_service.model")
     @patch("learning_materials.flashcards.flashcards_service.PydanticOutputParser")
     def test_generate_flashcards(self, MockParser, MockModel):
         # Mocking page data
@@ -126,3 +137,212 @@ class AnkiParsingTests(TestCase):
 
         expected_text = "What is AI?:Artificial Intelligence\nWho invented Python?:Guido van Rossum\n"
         self.assertEqual(anki_text, expected_text)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "flashcards": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+@patch("learning_materials.flashcards.flashcards_service._generate_flashcards")
+class FlashcardCacheTests(TestCase):
+    def setUp(self):
+        caches["flashcards"].clear()
+        self.text = "Water boils at 100 degrees Celsius."
+
+    def test_pages_with_the_same_text_share_flashcards(self, mock_generate):
+        mock_generate.return_value = [Flashcard(front="Boiling point?", back="100")]
+
+        first = generate_flashcards(
+            Citation(text=self.text, page_num=1, document_name="a.pdf"), "en"
+        )
+        second = generate_flashcards(
+            Citation(text=f"  {self.text}", page_num=7, document_name="b.pdf"), "en"
+        )
+
+        mock_generate.assert_called_once()
+        self.assertEqual(second[0].front, "Boiling point?")
+        self.assertEqual((first[0].document_name, first[0].page_num), ("a.pdf", 1))
+        self.assertEqual((second[0].document_name, second[0].page_num), ("b.pdf", 7))
+
+    def test_language_is_part_of_the_key(self, mock_generate):
+        mock_generate.return_value = [Flashcard(front="Front", back="Back")]
+        page = Citation(text=self.text, page_num=1)
+
+        generate_flashcards(page, "en")
+        generate_flashcards(page, "no")
+
+        self.assertEqual(mock_generate.call_count, 2)
+
+    @patch("learning_materials.management.commands.warm_flashcard_cache.rag_service")
+    def test_warm_command_only_generates_missing_pages(self, mock_rag_service, mock_generate):
+        mock_generate.return_value = [Flashcard(front="Front", back="Back")]
+        generate_flashcards(Citation(text=self.text, page_num=1), "en")
+        mock_rag_service.db.get_pages.return_value = [
+            Citation(text=self.text, page_num=1),
+            Citation(text="Ice melts at 0 degrees.", page_num=2),
+        ]
+
+        call_command("warm_flashcard_cache", "doc-1", "--language", "en", stdout=MagicMock())
+
+        self.assertEqual(mock_generate.call_count, 2)
+        mock_generate.assert_called_with("Ice melts at 0 degrees.", "en")
+        mock_rag_service.db.get_all_pages.assert_not_called()
+
+    @patch("learning_materials.management.commands.warm_flashcard_cache.rag_service")
+    def test_warm_command_uses_the_languages_of_requests(self, mock_rag_service, mock_generate):
+        mock_generate.return_value = [Flashcard(front="Front", back="Back")]
+        user = User.objects.create_user(username="warmer", password="testpass")
+        course = Course.objects.create(name="Physics", user=user, language="nb")
+        document = UserFile.objects.create(
+            name="physics.pdf",
+            blob_name="physics.pdf",
+            file_url="https://example.com/physics.pdf",
+            num_pages=1,
+            content_type="application/pdf",
+            user=user,
+        )
+        document.courses.add(course)
+        mock_rag_service.db.get_pages.return_value = [Citation(text=self.text, page_num=1)]
+
+        call_command("warm_flashcard_cache", str(document.id), stdout=MagicMock())
+
+        # Requests without a course generate with no language, those of the course in its language
+        languages = [call.args[1] for call in mock_generate.call_args_list]
+        self.assertEqual(languages, [None, "nb"])
+
+
+class GenerationExecutorTests(TestCase):
+    def setUp(self):
+        self.executor = FairExecutor(max_workers=1, max_queued=4)
+        self.gate = threading.Event()
+        self.ran = []
+
+    def tearDown(self):
+        self.gate.set()
+
+    def block_worker(self):
+        """Occupy the only worker until the gate is opened"""
+        future = self.executor.map("blocker", lambda _: self.gate.wait(), [None])[0]
+        while self.executor.active == 0:
+            time.sleep(0.01)
+        return future
+
+    def test_takes_turns_between_owners(self):
+        blocker = self.block_worker()
+        futures = self.executor.map("alice", self.ran.append, ["a1", "a2", "a3"])
+        futures += self.executor.map("bob", self.ran.append, ["b1"])
+
+        self.gate.set()
+        for future in [blocker, *futures]:
+            future.result(timeout=5)
+
+        self.assertEqual(self.ran, ["a1", "b1", "a2", "a3"])
+
+    def test_rejects_tasks_beyond_the_queue_limit(self):
+        self.block_worker()
+        self.executor.map("alice", self.ran.append, ["a1", "a2", "a3"])
+
+        with self.assertRaises(ExecutorSaturated):
+            self.executor.map("bob", self.ran.append, ["b1", "b2"])
+
+        self.assertEqual(self.executor.queued, 3)
+        # A request which fits is still admitted
+        self.executor.map("bob", self.ran.append, ["b1"])
+        self.assertEqual(self.executor.queued, 4)
+
+    @patch("learning_materials.learning_material_service.generate_flashcards")
+    def test_flashcards_are_returned_in_page_order(self, mock_generate):
+        mock_generate.side_effect = lambda page, language: [
+            Flashcard(front=page.text, back=language)
+        ]
+        pages = [Citation(text=f"Page {num}", page_num=num) for num in range(5)]
+
+        flashcards = _process_flashcards_by_pages(pages, "en", owner="alice")
+
+        self.assertEqual([fc.front for fc in flashcards], [f"Page {num}" for num in range(5)])
+
+
+class GenerationPlannerTests(TestCase):
+    def setUp(self):
+        self.executor = FairExecutor(max_workers=2, max_queued=100)
+        self.pages = [Citation(text=f"Page {num}", page_num=num) for num in range(1, 21)]
+        self.generated = []
+
+    def generate(self, cards_per_page):
+        def generate(page):
+            self.generated.append(page.page_num)
+            flashcards = [
+                Flashcard(front=f"{page.text} card {i}", back="Back")
+                for i in range(cards_per_page)
+            ]
+            for flashcard in flashcards:
+                flashcard.page_num = page.page_num
+            return flashcards
+
+        return generate
+
+    def test_orders_pages_round_robin_over_clusters(self):
+        page_clusters = {1: "Cells", 2: "Cells", 3: "Genes", 4: "Cells", 5: "Genes"}
+
+        ordered = order_pages(self.pages[:5], page_clusters, spread=1)
+
+        self.assertEqual([page.page_num for page in ordered], [1, 3, 2, 5, 4])
+
+    def test_spreads_pages_without_clusters_over_the_range(self):
+        ordered = order_pages(self.pages, {}, spread=4)
+
+        self.assertEqual([page.page_num for page in ordered[:4]], [1, 6, 11, 16])
+        self.assertCountEqual(ordered, self.pages)
+
+    def test_generates_only_the_pages_needed_for_the_budget(self):
+        flashcards = generate_within_budget(
+            self.pages, self.generate(3), 5, "alice", executor=self.executor
+        )
+
+        self.assertEqual(len(flashcards), 5)
+        self.assertEqual(sorted(self.generated), [1, 11])
+        self.assertEqual(
+            [fc.page_num for fc in flashcards], sorted(fc.page_num for fc in flashcards)
+        )
+
+    @patch("learning_materials.learning_material_service.generate_flashcards")
+    @patch("learning_materials.knowledge_base.deduplication.get_text_embeddings")
+    def test_duplicates_do_not_count_toward_the_budget(
+        self, mock_get_text_embeddings, mock_generate
+    ):
+        # Every page repeats one card of the first page besides its own two cards
+        def generate(page, language):
+            fronts = ["What is a cell?", f"{page.text} one", f"{page.text} two"]
+            return [Flashcard(front=front, back="Back") for front in fronts]
+
+        # Equal fronts get equal embeddings, different fronts orthogonal ones
+        dimensions = {}
+
+        def embed(texts):
+            return [
+                [1.0 if i == dimensions.setdefault(text, len(dimensions)) else 0.0 for i in range(128)]
+                for text in texts
+            ]
+
+        mock_generate.side_effect = generate
+        mock_get_text_embeddings.side_effect = embed
+
+        flashcards = _process_flashcards_by_pages(
+            self.pages, "en", owner="alice", max_amount_to_generate=9
+        )
+
+        fronts = [flashcard.front for flashcard in flashcards]
+        self.assertEqual(len(fronts), 9)
+        self.assertEqual(len(set(fronts)), 9)
+        self.assertEqual(fronts.count("What is a cell?"), 1)
+
+    def test_adds_pages_when_pages_give_fewer_cards(self):
+        flashcards = generate_within_budget(
+            self.pages, self.generate(1), 6, "alice", executor=self.executor
+        )
+
+        self.assertEqual(len(flashcards), 6)
+        self.assertGreaterEqual(len(self.generated), 6)
+        self.assertLess(len(self.generated), len(self.pages))
@@ -1,9 +1,10 @@
 import io
+import json
 import time
 import uuid
 import re
 from uuid import uuid4
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch, Mock
 
 from django.urls import reverse
@@ -23,13 +24,18 @@ from learning_materials.models import (
     FlashcardModel,
     Cardset,
     Course,
+    GenerationJob,
     UserFile,
     MultipleChoiceQuestionModel,
     QuestionAnswerModel,
     QuizModel,
     UserURL,
 )
-from learning_materials.learning_resources import Flashcard
+from learning_materials.jobs.job_service import run_job
+from learning_materials.utils.generation_executor import ExecutorSaturated
+from learning_materials.utils.progress import report_progress
+from learning_materials.titles import title_service
+from learning_materials.learning_resources import Compendium, Flashcard
 from learning_materials.learning_resources import Citation
 from learning_materials.knowledge_base.rag_service import post_context
 from accounts.models import CustomUser
@@ -2398,3 +2404,341 @@ class CourseAPITest(TestCase):
         response = self.client.post(self.url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("language", response.data)
+
+
+@patch("learning_materials.jobs.job_service.producer")
+class GenerationJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f"{base}jobs/"
+        self.user = CustomUser.objects.create_user(
+            username="jobuser", email="jobuser@example.com", password="testpass"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.document_id = str(uuid4())
+        self.compendium = Compendium(
+            document_name="test.pdf",
+            start_page=1,
+            end_page=2,
+            key_concepts=["Concept"],
+            summary="Summary",
+        )
+
+    def submit_compendium_job(self) -> dict:
+        payload = {
+            "kind": "compendium",
+            "parameters": {"id": self.document_id, "start_page": 1, "end_page": 2},
+        }
+        response = self.client.post(self.url, payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return response.data
+
+    def test_submit_queues_a_pending_job(self, mock_producer):
+        data = self.submit_compendium_job()
+
+        self.assertEqual(data["status"], "pending")
+        job = GenerationJob.objects.get(id=data["job_id"])
+        self.assertEqual(job.kind, "compendium")
+        self.assertEqual(job.parameters["id"], self.document_id)
+        mock_producer.produce.assert_called_once()
+        self.assertIn(data["job_id"], mock_producer.produce.call_args[0][1])
+
+    def test_submit_validates_the_parameters(self, mock_producer):
+        payload = {"kind": "quiz", "parameters": {"subject": "AI"}}
+        response = self.client.post(self.url, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(GenerationJob.objects.exists())
+        mock_producer.produce.assert_not_called()
+
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_worker_runs_the_job_and_poll_returns_the_result(
+        self, mock_generate_compendium, mock_producer
+    ):
+        mock_generate_compendium.return_value = self.compendium
+        job_id = self.submit_compendium_job()["job_id"]
+
+        run_job(job_id)
+        # A redelivered message does not run the job again
+        self.assertIsNone(run_job(job_id))
+        mock_generate_compendium.assert_called_once_with(self.document_id, 1, 2)
+
+        response = self.client.get(f"{self.url}{job_id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], "succeeded")
+        self.assertEqual(response.data["progress"], 1.0)
+        self.assertEqual(response.data["result"]["summary"], "Summary")
+
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_failed_job_reports_the_error(self, mock_generate_compendium, mock_producer):
+        mock_generate_compendium.side_effect = ValueError("No pages found")
+        job_id = self.submit_compendium_job()["job_id"]
+
+        job = run_job(job_id)
+
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "No pages found")
+
+    @patch("learning_materials.jobs.job_service.time.sleep")
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_saturated_executor_delays_the_job(
+        self, mock_generate_compendium, mock_sleep, mock_producer
+    ):
+        mock_generate_compendium.side_effect = ExecutorSaturated("Too many requests")
+        job_id = self.submit_compendium_job()["job_id"]
+        mock_producer.reset_mock()
+
+        self.assertIsNone(run_job(job_id))
+
+        job = GenerationJob.objects.get(id=job_id)
+        self.assertEqual(job.status, "pending")
+        self.assertEqual(job.attempts, 0)
+        self.assertIsNone(job.started_at)
+        mock_sleep.assert_called_once()
+        mock_producer.produce.assert_called_once()
+        self.assertIn(job_id, mock_producer.produce.call_args[0][1])
+
+    def make_stale(self, job_id, attempts: int):
+        GenerationJob.objects.filter(id=job_id).update(
+            status=GenerationJob.Status.RUNNING,
+            started_at=timezone.now() - timedelta(hours=1),
+            attempts=attempts,
+        )
+
+    def test_stale_running_job_is_queued_again_when_polled(self, mock_producer):
+        job_id = self.submit_compendium_job()["job_id"]
+        self.make_stale(job_id, attempts=1)
+        mock_producer.reset_mock()
+
+        response = self.client.get(f"{self.url}{job_id}/")
+
+        self.assertEqual(response.data["status"], "pending")
+        mock_producer.produce.assert_called_once()
+        self.assertIn(job_id, mock_producer.produce.call_args[0][1])
+
+    def test_stale_job_without_attempts_left_fails(self, mock_producer):
+        job_id = self.submit_compendium_job()["job_id"]
+        self.make_stale(job_id, attempts=2)
+
+        response = self.client.get(f"{self.url}{job_id}/")
+
+        self.assertEqual(response.data["status"], "failed")
+        self.assertIn("did not finish in time", response.data["error"])
+
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_stale_job_is_claimed_by_a_redelivered_message(
+        self, mock_generate_compendium, mock_producer
+    ):
+        mock_generate_compendium.return_value = self.compendium
+        job_id = self.submit_compendium_job()["job_id"]
+        self.make_stale(job_id, attempts=1)
+
+        job = run_job(job_id)
+
+        self.assertEqual(job.status, "succeeded")
+        self.assertEqual(GenerationJob.objects.get(id=job_id).attempts, 2)
+
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_progress_is_reported_while_the_job_runs(
+        self, mock_generate_compendium, mock_producer
+    ):
+        job_id = self.submit_compendium_job()["job_id"]
+        progress = []
+
+        def generate(*args):
+            report_progress(1, 4)
+            progress.append(GenerationJob.objects.get(id=job_id).progress)
+            report_progress(4, 4)
+            progress.append(GenerationJob.objects.get(id=job_id).progress)
+            return self.compendium
+
+        mock_generate_compendium.side_effect = generate
+
+        run_job(job_id)
+
+        self.assertEqual(progress, [0.25, 0.95])
+        self.assertEqual(GenerationJob.objects.get(id=job_id).progress, 1.0)
+
+    @patch("learning_materials.jobs.job_service.generate_compendium")
+    def test_worker_cannot_finish_a_job_it_lost(self, mock_generate_compendium, mock_producer):
+        job_id = self.submit_compendium_job()["job_id"]
+
+        def generate(*args):
+            # The job timed out and another worker claimed it meanwhile
+            GenerationJob.objects.filter(id=job_id).update(started_at=timezone.now())
+            return self.compendium
+
+        mock_generate_compendium.side_effect = generate
+
+        self.assertIsNone(run_job(job_id))
+        self.assertEqual(GenerationJob.objects.get(id=job_id).status, "running")
+
+    def test_other_users_cannot_poll_the_job(self, mock_producer):
+        job_id = self.submit_compendium_job()["job_id"]
+        other_user = CustomUser.objects.create_user(
+            username="otheruser", email="otheruser@example.com", password="testpass"
+        )
+        self.client.force_authenticate(user=other_user)
+
+        response = self.client.get(f"{self.url}{job_id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def parse_sse(body: bytes) -> list[tuple[str, dict]]:
+    events = []
+    for frame in body.decode().strip().split("\n\n"):
+        event_line, data_line = frame.split("\n")
+        events.append(
+            (event_line.removeprefix("event: "), json.loads(data_line.removeprefix("data: ")))
+        )
+    return events
+
+
+@patch("learning_materials.views.producer")
+@patch("learning_materials.titles.title_service.producer")
+@patch("learning_materials.views.stream_answer")
+class ChatResponseStreamTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("chat-response-stream")
+        self.user = CustomUser.objects.create_user(
+            username="streamuser", email="streamuser@example.com", password="testpass"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name="Course", user=self.user)
+        self.citation = Citation(
+            text="Context", page_num=1, document_name="test.pdf", document_id=str(self.course.id)
+        )
+
+    def mock_answer(self, mock_stream_answer, deltas: list[str]):
+        async def stream():
+            for delta in deltas:
+                yield delta
+
+        async def answer(*args):
+            return [self.citation], stream()
+
+        mock_stream_answer.side_effect = answer
+
+    def test_streams_citations_deltas_and_title(
+        self, mock_stream_answer, mock_title_producer, mock_producer
+    ):
+        self.mock_answer(mock_stream_answer, ["Hello", " there", "!"])
+        payload = {"message": "What is photosynthesis?", "courseId": str(self.course.id)}
+
+        response = self.client.post(self.url, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = parse_sse(b"".join(response))
+        self.assertEqual(
+            [event for event, _ in events],
+            ["citations", "delta", "delta", "delta", "done"],
+        )
+        self.assertEqual(events[0][1]["citations"][0]["text"], "Context")
+        self.assertEqual("".join(data["content"] for _, data in events[1:4]), "Hello there!")
+        done = events[-1][1]
+        # A placeholder title is returned right away and generated later
+        self.assertEqual(done["title"], "Photosynthesis")
+        self.assertEqual(done["content"], "Hello there!")
+
+        chat = Chat.objects.get(id=done["chatId"])
+        self.assertEqual(chat.title, "Photosynthesis")
+        self.assertEqual(chat.course, self.course)
+        self.assertEqual(
+            [message["content"] for message in chat.messages],
+            ["What is photosynthesis?", "Hello there!"],
+        )
+        mock_producer.produce.assert_called_once()
+        mock_title_producer.produce.assert_called_once()
+        self.assertIn(str(chat.id), mock_title_producer.produce.call_args[0][1])
+
+    def test_existing_chat_keeps_its_title(
+        self, mock_stream_answer, mock_title_producer, mock_producer
+    ):
+        self.mock_answer(mock_stream_answer, ["Again"])
+        chat = Chat.objects.create(
+            user=self.user,
+            title="Existing",
+            messages=[{"role": "user", "content": "First"}],
+        )
+
+        response = self.client.post(
+            self.url, {"message": "Second", "chatId": str(chat.id)}, format="json"
+        )
+
+        events = parse_sse(b"".join(response))
+        self.assertEqual(events[-1][1]["title"], "Existing")
+        mock_title_producer.produce.assert_not_called()
+        chat.refresh_from_db()
+        self.assertEqual(len(chat.messages), 3)
+        history = mock_stream_answer.call_args[0][2]
+        self.assertEqual(history[-1], {"role": "user", "content": "Second"})
+
+    def test_failure_sends_an_error_event_and_does_not_save(
+        self, mock_stream_answer, mock_title_producer, mock_producer
+    ):
+        mock_stream_answer.side_effect = ValueError("LLM unavailable")
+        payload = {"message": "Hi", "courseId": str(self.course.id)}
+
+        response = self.client.post(self.url, payload, format="json")
+
+        events = parse_sse(b"".join(response))
+        self.assertEqual(events, [("error", {"error": "LLM unavailable"})])
+        self.assertFalse(Chat.objects.filter(user=self.user).exists())
+
+
+class TitleServiceTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="titleuser", email="titleuser@example.com", password="testpass"
+        )
+
+    def test_placeholder_is_made_of_key_terms(self):
+        title = title_service.placeholder_title(
+            "How does the Krebs cycle relate to cellular respiration and the cycle of ATP?",
+            title_service.CHAT,
+        )
+        self.assertEqual(title, "Krebs Cycle Relate Cellular")
+
+    def test_placeholder_falls_back_to_the_kind(self):
+        self.assertEqual(
+            title_service.placeholder_title("Hi, is it?", title_service.CHAT), "New Chat"
+        )
+        self.assertEqual(title_service.placeholder_title("", title_service.QUIZ), "Quiz")
+
+    @patch("learning_materials.titles.title_service.generate_title_of_chat")
+    def test_generated_title_replaces_the_placeholder(self, mock_generate):
+        mock_generate.return_value = "Cellular Respiration Basics"
+        chat = Chat.objects.create(
+            user=self.user,
+            title="Krebs Cycle",
+            messages=[
+                {"role": "user", "content": "What is the Krebs cycle?"},
+                {"role": "assistant", "content": "A series of reactions", "citations": []},
+            ],
+        )
+        message = title_service.TitleMessage(
+            kind=title_service.CHAT, object_id=chat.id, placeholder="Krebs Cycle"
+        )
+
+        title_service.generate_title(message)
+
+        chat.refresh_from_db()
+        self.assertEqual(chat.title, "Cellular Respiration Basics")
+        question, answer, _ = mock_generate.call_args[0]
+        self.assertEqual(question, "What is the Krebs cycle?")
+        self.assertEqual(answer.content, "A series of reactions")
+
+    @patch("learning_materials.titles.title_service.generate_title_of_flashcards")
+    def test_renamed_titles_are_kept(self, mock_generate):
+        mock_generate.return_value = "Generated"
+        cardset = Cardset.objects.create(name="Renamed by user", user=self.user)
+        message = title_service.TitleMessage(
+            kind=title_service.CARDSET, object_id=cardset.id, placeholder="Placeholder"
+        )
+
+        title_service.generate_title(message)
+
+        cardset.refresh_from_db()
+        self.assertEqual(cardset.name, "Renamed by user")
@@ -1,6 +1,13 @@
+import asyncio
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import httpx
 from uuid import uuid4
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 
 from learning_materials.knowledge_base import factory
@@ -10,7 +17,25 @@ from learning_materials.knowledge_base.clustering import (
     create_projection,
     cluster_document,
 )
-from learning_materials.knowledge_base.embeddings import EmbeddingsModel
+from learning_materials.knowledge_base.coalescer import RequestCoalescer
+from learning_materials.knowledge_base.embedding_cache import (
+    EMBEDDING_CACHE_REQUESTS,
+    embedding_cache,
+    embedding_cache_key,
+)
+from learning_materials.knowledge_base.embeddings import (
+    EmbeddingsModel,
+    OpenAIEmbedding,
+)
+from learning_materials.knowledge_base.llm import get_chat_model
+from learning_materials.knowledge_base.rate_limit import (
+    AdaptiveConcurrencyLimiter,
+    AsyncThrottledTransport,
+    LLMThrottle,
+    LocalRateLimiter,
+    ThrottledTransport,
+    estimate_tokens,
+)
 from learning_materials.knowledge_base.response_formulation import (
     generate_name_for_cluster,
 )
@@ -159,3 +184,307 @@ class ClusteringCreationTest(TestCase):
     def test_cluster_document_with_invalid_document_id(self):
         with self.assertRaises(ValueError):
             cluster_document(uuid4())
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "embeddings": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "embedding-cache-tests",
+        },
+    }
+)
+class EmbeddingCacheTest(TestCase):
+    def setUp(self):
+        embedding_cache.clear()
+        self.model = OpenAIEmbedding(model_name=f"test-model-{uuid4()}")
+        self.model.client = MagicMock()
+        response = MagicMock()
+        response.data = [MagicMock(embedding=[0.5, 0.25, 0.125])]
+        self.model.client.embeddings.create.return_value = response
+
+    def hits(self, tier: str) -> float:
+        return EMBEDDING_CACHE_REQUESTS.labels(tier=tier, result="hit")._value.get()
+
+    def test_repeated_text_is_embedded_once(self):
+        first = self.model.get_embedding("What is normalization?")
+        second = self.model.get_embedding("What is normalization?")
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.model.client.embeddings.create.call_count, 1)
+
+    def test_whitespace_differences_share_an_entry(self):
+        self.model.get_embedding("What is\nnormalization?")
+        self.model.get_embedding("  What is   normalization? ")
+        self.assertEqual(self.model.client.embeddings.create.call_count, 1)
+
+    def test_key_depends_on_model(self):
+        self.assertNotEqual(
+            embedding_cache_key("model-a", "text"), embedding_cache_key("model-b", "text")
+        )
+
+    def test_persistent_tier_is_used_after_memory_tier_is_cleared(self):
+        self.model.get_embedding("Database normalization")
+        embedding_cache.clear()
+        persistent_hits = self.hits("persistent")
+
+        embedding = self.model.get_embedding("Database normalization")
+
+        self.assertEqual(embedding, [0.5, 0.25, 0.125])
+        self.assertEqual(self.model.client.embeddings.create.call_count, 1)
+        self.assertEqual(self.hits("persistent"), persistent_hits + 1)
+
+
+def embedding_response(inputs: list[str]) -> MagicMock:
+    """Fake embeddings response with the items in reverse order"""
+    response = MagicMock()
+    response.data = [
+        MagicMock(index=i, embedding=[float(len(text)), float(i)])
+        for i, text in reversed(list(enumerate(inputs)))
+    ]
+    return response
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "embeddings": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "embedding-batch-tests",
+        },
+    }
+)
+class BatchEmbeddingTest(TestCase):
+    def setUp(self):
+        embedding_cache.clear()
+        self.model = OpenAIEmbedding(model_name=f"test-model-{uuid4()}")
+        self.model.client = MagicMock()
+        self.model.client.embeddings.create.side_effect = (
+            lambda input, model: embedding_response(input)
+        )
+
+    def test_get_embeddings_preserves_order(self):
+        texts = ["a", "bb", "ccc"]
+        embeddings = self.model.get_embeddings(texts)
+
+        self.assertEqual([embedding[0] for embedding in embeddings], [1.0, 2.0, 3.0])
+        self.assertEqual(self.model.client.embeddings.create.call_count, 1)
+
+    def test_get_embeddings_only_requests_missing_texts(self):
+        self.model.get_embeddings(["a", "bb"])
+        self.model.get_embeddings(["a", "bb", "ccc", "ccc"])
+
+        second_call = self.model.client.embeddings.create.call_args_list[1]
+        self.assertEqual(second_call.kwargs["input"], ["ccc"])
+
+    def test_get_embeddings_respects_token_limit(self):
+        self.model.max_tokens_per_request = 5
+        texts = ["one two three", "four five six", "seven eight nine"]
+
+        embeddings = self.model.get_embeddings(texts)
+
+        self.assertEqual(len(embeddings), 3)
+        self.assertEqual(self.model.client.embeddings.create.call_count, 3)
+
+    def test_concurrent_single_requests_are_coalesced(self):
+        self.model._coalescer = RequestCoalescer(
+            self.model._request_embeddings, window=0.2
+        )
+        texts = [f"question {i}" for i in range(8)]
+        results = {}
+
+        def embed(text):
+            results[text] = self.model.get_embedding(text)
+
+        threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.model.client.embeddings.create.call_count, 1)
+        self.assertTrue(all(results[text][0] == len(text) for text in texts))
+
+
+class RequestCoalescerTest(TestCase):
+    def test_errors_are_raised_for_every_request(self):
+        def fail(items):
+            raise RuntimeError("upstream error")
+
+        coalescer = RequestCoalescer(fail, window=0.01)
+        future = coalescer.submit("text")
+
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=1)
+
+    def test_batches_are_sent_concurrently(self):
+        release = threading.Event()
+        started = []
+
+        def wait_for_release(items):
+            started.append(items)
+            release.wait(timeout=5)
+            return items
+
+        coalescer = RequestCoalescer(wait_for_release, window=0.001, max_in_flight=2)
+        first = coalescer.submit("first")
+        while not started:
+            time.sleep(0.001)
+        second = coalescer.submit("second")
+        while len(started) < 2:
+            time.sleep(0.001)
+
+        # The second batch was sent while the first one was still in flight
+        self.assertFalse(first.done())
+        release.set()
+        self.assertEqual([first.result(timeout=1), second.result(timeout=1)], ["first", "second"])
+
+
+class LocalRateLimiterTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = LocalRateLimiter(
+            requests_per_minute=2, tokens_per_minute=600, clock=lambda: self.now
+        )
+
+    def test_limits_requests_per_minute(self):
+        self.assertEqual(self.limiter.try_acquire(10), 0)
+        self.assertEqual(self.limiter.try_acquire(10), 0)
+        # One request is refilled every 30 seconds
+        self.assertAlmostEqual(self.limiter.try_acquire(10), 30)
+
+        self.now = 30.0
+        self.assertEqual(self.limiter.try_acquire(10), 0)
+
+    def test_limits_tokens_per_minute(self):
+        self.assertEqual(self.limiter.try_acquire(500), 0)
+        # 10 tokens are refilled per second
+        self.assertAlmostEqual(self.limiter.try_acquire(200), 10)
+        # A rejected request takes nothing
+        self.assertEqual(self.limiter.try_acquire(100), 0)
+
+
+class AdaptiveConcurrencyLimiterTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = AdaptiveConcurrencyLimiter(
+            min_limit=1, max_limit=8, clock=lambda: self.now
+        )
+
+    def test_throttling_halves_the_limit_once_per_cooldown(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.limiter.release(1.0, throttled=True)
+        self.limiter.release(1.0, throttled=True)
+        self.assertEqual(self.limiter.limit, 4)
+
+        self.now = 2.0
+        self.limiter.acquire()
+        self.limiter.release(1.0, throttled=True)
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_latency_spikes_shrink_and_successes_grow_the_limit(self):
+        self.limiter.acquire()
+        self.limiter.release(1.0)
+        self.limiter.acquire()
+        self.limiter.release(5.0)
+        self.assertEqual(self.limiter.limit, 4)
+
+        # The limit grows by about one per limit's worth of successful calls
+        for _ in range(30):
+            self.limiter.acquire()
+            self.limiter.release(1.0)
+        self.assertEqual(self.limiter.limit, 8)
+
+    def test_calls_over_the_limit_wait(self):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1)
+        limiter.acquire()
+        self.assertFalse(limiter.try_acquire())
+        limiter.release(1.0)
+        self.assertTrue(limiter.try_acquire())
+
+
+class ChatModelTest(TestCase):
+    def test_models_are_shared_per_number_of_retries(self):
+        default = get_chat_model(temperature=0.0)
+        without_retries = get_chat_model(temperature=0.0, max_retries=0)
+
+        self.assertIs(get_chat_model(temperature=0.0), default)
+        self.assertIs(get_chat_model(temperature=0.0, max_retries=0), without_retries)
+        self.assertIsNot(without_retries, default)
+        self.assertEqual(without_retries.max_retries, 0)
+        self.assertIs(without_retries.http_client, default.http_client)
+
+
+class ThrottledTransportTest(TestCase):
+    def test_requests_are_admitted_and_throttling_is_reported(self):
+        throttle = LLMThrottle(
+            LocalRateLimiter(0, 0), AdaptiveConcurrencyLimiter(min_limit=1, max_limit=8)
+        )
+        transport = httpx.MockTransport(lambda request: httpx.Response(429))
+        client = httpx.Client(transport=ThrottledTransport(throttle, transport))
+
+        response = client.post("https://api.openai.com/v1/chat/completions", json={})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(throttle.concurrency.in_flight, 0)
+        self.assertEqual(throttle.concurrency.limit, 4)
+
+    def test_streamed_responses_hold_the_slot_until_closed(self):
+        throttle = LLMThrottle(
+            LocalRateLimiter(0, 0), AdaptiveConcurrencyLimiter(min_limit=1, max_limit=8)
+        )
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, content=iter([b"da", b"ta"]))
+        )
+        client = httpx.Client(transport=ThrottledTransport(throttle, transport))
+
+        with client.stream("POST", "https://api.openai.com/v1/chat/completions") as response:
+            self.assertEqual(throttle.concurrency.in_flight, 1)
+            self.assertEqual(response.read(), b"data")
+        self.assertEqual(throttle.concurrency.in_flight, 0)
+
+    def test_async_calls_check_the_rate_limiter_off_the_event_loop(self):
+        rate_limiter = MagicMock()
+        rate_limiter.try_acquire.side_effect = lambda tokens: (
+            threading.get_ident() == threading.main_thread().ident and 1.0 or 0.0
+        )
+        throttle = LLMThrottle(
+            rate_limiter, AdaptiveConcurrencyLimiter(min_limit=1, max_limit=8)
+        )
+        async def body():
+            yield b"data"
+
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, content=body())
+        )
+
+        async def call():
+            async with httpx.AsyncClient(
+                transport=AsyncThrottledTransport(throttle, transport)
+            ) as client:
+                async with client.stream(
+                    "POST", "https://api.openai.com/v1/chat/completions"
+                ) as response:
+                    self.assertEqual(throttle.concurrency.in_flight, 1)
+                    await response.aread()
+            return response
+
+        response = asyncio.run(asyncio.wait_for(call(), timeout=5))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(throttle.concurrency.in_flight, 0)
+        rate_limiter.try_acquire.assert_called_once()
+
+    def test_estimate_tokens(self):
+        body = json.dumps({"messages": [{"content": "x" * 400}], "max_tokens": 100})
+        request = httpx.Request(
+            "POST", "https://api.openai.com/v1/chat/completions", content=body
+        )
+        self.assertEqual(estimate_tokens(request), len(body) // 4 + 100)
+
+        request = httpx.Request(
+            "POST", "https://api.openai.com/v1/embeddings", content="x" * 400
+        )
+        self.assertEqual(estimate_tokens(request), 100)
@@ -1,5 +1,12 @@
+import json
+import os
+import re
+import threading
+import time
+
 from django.test import TestCase
 from unittest.mock import patch
+from langchain_core.runnables import RunnableLambda
 from learning_materials.learning_resources import (
     GradedQuiz,
     Quiz,
@@ -7,7 +14,13 @@ from learning_materials.learning_resources import (
     MultipleChoiceQuestion,
     Citation,
 )
+from learning_materials.quizzes import quiz_service
+from learning_materials.quizzes.grading import (
+    grade_multiple_choice,
+    grade_short_answer,
+)
 from learning_materials.quizzes.quiz_service import generate_quiz, grade_quiz
+from learning_materials.utils.fan_out import fan_out
 
 
 class QuizGenerationTests(TestCase):
@@ -81,6 +94,32 @@ class QuizGenerationTests(TestCase):
                 or isinstance(question, MultipleChoiceQuestion)
             )
 
+    @patch("learning_materials.knowledge_base.deduplication.get_text_embeddings")
+    def test_post_process_removes_near_duplicate_questions(self, mock_get_text_embeddings):
+        mock_get_text_embeddings.return_value = [[1.0, 0.0], [0.0, 1.0], [0.99, 0.05]]
+        quiz = Quiz(
+            document_name="book.pdf",
+            start_page=1,
+            end_page=2,
+            questions=[
+                QuestionAnswer(question="What is AI?", answer="Artificial intelligence"),
+                QuestionAnswer(question="What is ML?", answer="Machine learning"),
+                MultipleChoiceQuestion(
+                    question="What does AI stand for?",
+                    options=["Artificial intelligence", "Applied informatics"],
+                    answer="Artificial intelligence",
+                ),
+            ],
+        )
+
+        quiz = quiz_service._post_process_quiz(quiz)
+
+        self.assertEqual(
+            [question.question for question in quiz.questions],
+            ["What is ML?", "What does AI stand for?"],
+        )
+
+
 
 class QuizGradingTests(TestCase):
 
@@ -254,3 +293,261 @@ class QuizGradingTests(TestCase):
         self.assertEqual(amount_of_correct_answers, len(qa_answers))
         self.assertTrue(all(graded_quiz.answers_was_correct))  # All correct
         self.assertEqual(len(graded_quiz.feedback), len(qa_answers))
+
+
+class FanOutTests(TestCase):
+    def test_results_keep_the_order_of_the_items(self):
+        def slow_identity(item):
+            # Later items finish first
+            time.sleep(0.01 * (5 - item))
+            return item
+
+        self.assertEqual(fan_out(slow_identity, list(range(5))), list(range(5)))
+
+    def test_calls_run_concurrently_within_the_limit(self):
+        running = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def track(item):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return item
+
+        start = time.monotonic()
+        fan_out(track, list(range(8)), max_workers=4)
+
+        self.assertEqual(peak, 4)
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_failed_calls_are_retried(self):
+        attempts = []
+
+        def flaky(item):
+            attempts.append(item)
+            if len(attempts) < 3:
+                raise TimeoutError("Request timed out")
+            return item
+
+        self.assertEqual(fan_out(flaky, [1], retries=2, base_delay=0), [1])
+        self.assertEqual(len(attempts), 3)
+
+    def test_exhausted_retries_return_the_exception(self):
+        def failing(item):
+            raise ValueError(f"Bad item {item}")
+
+        results = fan_out(failing, [1, 2], retries=1, base_delay=0)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertIn("Bad item 2", str(results[1]))
+
+
+class ParallelGradingTests(TestCase):
+    def setUp(self):
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def fake_llm(self, prompt):
+        # Grades an answer as correct if the student answered "right"
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        correct = "right" in prompt.to_string().split("Answer:")[-1]
+        return (
+            f'{{"answers_was_correct": [{str(correct).lower()}], '
+            f'"feedback": ["{"Correct" if correct else "Incorrect"}"]}}'
+        )
+
+    def create_quiz(self, num_questions: int) -> Quiz:
+        return Quiz(
+            document_name="test.pdf",
+            start_page=1,
+            end_page=1,
+            questions=[
+                QuestionAnswer(question=f"Question {i}", answer="right")
+                for i in range(num_questions)
+            ],
+        )
+
+    def test_grades_questions_concurrently_in_order(self):
+        # Answers which cannot be graded locally
+        answers = ["it is right", "wrong", "it is right", "wrong", "so right", "right?!"]
+        with patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)):
+            graded_quiz = grade_quiz(self.create_quiz(len(answers)), answers)
+
+        self.assertEqual(
+            graded_quiz.answers_was_correct, [answer != "wrong" for answer in answers]
+        )
+        self.assertEqual(graded_quiz.feedback[1], "Incorrect")
+        self.assertAlmostEqual(graded_quiz.score, 4 / 6)
+        self.assertGreater(self.peak, 1)
+
+    def test_global_cap_is_shared_between_quizzes(self):
+        quiz = self.create_quiz(6)
+        with (
+            patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)),
+            patch.object(quiz_service, "grading_slots", threading.BoundedSemaphore(3)),
+        ):
+            threads = [
+                threading.Thread(target=grade_quiz, args=(quiz, ["it is right"] * 6))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.peak, 3)
+
+    def test_local_grades_skip_the_llm(self):
+        quiz = Quiz(
+            document_name="test.pdf",
+            start_page=1,
+            end_page=1,
+            questions=[
+                MultipleChoiceQuestion(
+                    question="What is the capital of France?",
+                    options=["Paris", "London"],
+                    answer="Paris",
+                ),
+                QuestionAnswer(
+                    question="What is the largest planet?", answer="Jupiter"
+                ),
+            ],
+        )
+        with patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)):
+            graded_quiz = grade_quiz(quiz, ["b", "jupiter"])
+
+        self.assertEqual(graded_quiz.answers_was_correct, [False, True])
+        self.assertEqual(self.peak, 0)
+
+    def test_detailed_feedback_keeps_the_local_grade(self):
+        quiz = self.create_quiz(1)
+        with patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)):
+            # The fake LLM would grade this answer as incorrect
+            graded_quiz = grade_quiz(quiz, ["Right."], detailed_feedback=True)
+
+        self.assertEqual(graded_quiz.answers_was_correct, [True])
+        self.assertEqual(graded_quiz.feedback, ["Incorrect"])
+        self.assertEqual(self.peak, 1)
+
+
+class LocalGradingTests(TestCase):
+    def setUp(self):
+        self.multiple_choice = MultipleChoiceQuestion(
+            question="What is the capital of Japan?",
+            options=["Paris", "London", "New York", "Tokyo"],
+            answer="Tokyo",
+        )
+
+    def test_multiple_choice_by_text(self):
+        self.assertTrue(grade_multiple_choice(self.multiple_choice, " tokyo ").correct)
+        self.assertFalse(grade_multiple_choice(self.multiple_choice, "London").correct)
+
+    def test_multiple_choice_by_letter(self):
+        self.assertTrue(grade_multiple_choice(self.multiple_choice, "D)").correct)
+        self.assertFalse(grade_multiple_choice(self.multiple_choice, "(a)").correct)
+
+    def test_multiple_choice_outside_the_options_is_ambiguous(self):
+        self.assertIsNone(grade_multiple_choice(self.multiple_choice, "Kyoto"))
+        self.assertIsNone(grade_multiple_choice(self.multiple_choice, "e"))
+
+    def test_empty_answers_are_incorrect(self):
+        question = QuestionAnswer(question="What is 2 + 2?", answer="4")
+        self.assertFalse(grade_short_answer(question, "  ").correct)
+        self.assertFalse(grade_multiple_choice(self.multiple_choice, "").correct)
+
+    def test_exact_short_answers_are_accepted(self):
+        question = QuestionAnswer(
+            question="Who proposed relativity?", answer="Albert Einstein"
+        )
+        self.assertTrue(grade_short_answer(question, "  albert  einstein. ").correct)
+
+    def test_different_short_answers_are_ambiguous(self):
+        question = QuestionAnswer(question="What is 2 + 2?", answer="4")
+        self.assertIsNone(grade_short_answer(question, "four"))
+        self.assertIsNone(grade_short_answer(question, "5"))
+        question = QuestionAnswer(question="How many meters in 10 km?", answer="10000")
+        self.assertIsNone(grade_short_answer(question, "100000"))
+
+    def test_near_matches_are_left_to_the_llm(self):
+        cases = [
+            # Negations
+            ("Python is dynamically typed", "Python is not dynamically typed"),
+            # Antonym prefixes
+            ("reversible", "irreversible"),
+            ("stable", "unstable"),
+            ("The veins carry oxygenated blood", "The veins carry deoxygenated blood"),
+            # One-letter term swaps
+            ("mitosis", "meiosis"),
+            ("Albert Einstein", "albert einstien"),
+        ]
+        for answer, student_answer in cases:
+            with self.subTest(student_answer=student_answer):
+                question = QuestionAnswer(question="Question?", answer=answer)
+                self.assertIsNone(grade_short_answer(question, student_answer))
+
+
+@patch.dict(os.environ, {"QUIZ_GRADING_MODE": "batch", "QUIZ_GRADING_BATCH_SIZE": "4"})
+class BatchGradingTests(TestCase):
+    def setUp(self):
+        self.prompts = []
+        # Questions the fake LLM leaves out of its batch output
+        self.dropped = set()
+
+    def fake_llm(self, prompt):
+        text = prompt.to_string()
+        self.prompts.append(text)
+        answers = re.findall(r"Student's Answer:\s*\"?([^\n\"]*)", text)
+        questions = re.findall(r"Question \d+: (.*)", text) or [None]
+        if len(answers) > 1 and any(q in self.dropped for q in questions):
+            answers = answers[:-1]
+        return json.dumps(
+            {
+                "answers_was_correct": ["right" in answer for answer in answers],
+                "feedback": [f"Feedback {answer}" for answer in answers],
+            }
+        )
+
+    def create_quiz(self, num_questions: int) -> Quiz:
+        return Quiz(
+            document_name="test.pdf",
+            start_page=1,
+            end_page=1,
+            questions=[
+                QuestionAnswer(question=f"Question {i}?", answer="right")
+                for i in range(num_questions)
+            ],
+        )
+
+    def test_grades_a_batch_of_questions_per_call(self):
+        answers = ["so right", "wrong", "it is right", "wrong", "so right", "nope"]
+        with patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)):
+            graded_quiz = grade_quiz(self.create_quiz(6), answers)
+
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(
+            graded_quiz.answers_was_correct, [True, False, True, False, True, False]
+        )
+        self.assertEqual(graded_quiz.feedback[1], "Feedback wrong")
+
+    def test_falls_back_per_question_on_wrong_cardinality(self):
+        self.dropped = {"Question 5?"}
+        answers = ["so right", "wrong", "it is right", "wrong", "so right", "nope"]
+        with patch.object(quiz_service, "llm", RunnableLambda(self.fake_llm)):
+            graded_quiz = grade_quiz(self.create_quiz(6), answers)
+
+        # One call per batch, then one call per question of the second batch
+        self.assertEqual(len(self.prompts), 4)
+        self.assertEqual(
+            graded_quiz.answers_was_correct, [True, False, True, False, True, False]
+        )
@@ -0,0 +1,714 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+from uuid import uuid4
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from pymongo.errors import OperationFailure
+from sklearn.metrics.pairwise import cosine_similarity
+
+from broker.handlers.cache_handler import handle_document_cache_invalidation
+from learning_materials.knowledge_base.ann_index import AnnIndexStore, IVFIndex
+from learning_materials.knowledge_base.answer_cache import AnswerCache
+from learning_materials.knowledge_base.bm25_index import (
+    BM25Index,
+    BM25IndexStore,
+    reciprocal_rank_fusion,
+)
+from learning_materials.knowledge_base.deduplication import (
+    deduplicate,
+    near_duplicate_groups,
+)
+from learning_materials.knowledge_base.db_interface import (
+    MockDatabase,
+    MongoDB,
+    MongoDBAtlas,
+)
+from learning_materials.knowledge_base.document_cache import (
+    DocumentEmbeddingCache,
+    DocumentMatrix,
+    document_cache,
+)
+from learning_materials.knowledge_base.embedding_storage import (
+    decode_embedding,
+    encode_embedding,
+)
+from learning_materials.learning_material_service import process_answer
+from learning_materials.learning_resources import Citation, RagAnswer
+from learning_materials.models import UserFile
+
+User = get_user_model()
+from learning_materials.knowledge_base.embeddings import (
+    cosine_similarity as embedding_cosine_similarity,
+)
+from learning_materials.knowledge_base.vector_math import (
+    cosine_many_to_many,
+    cosine_one_to_many,
+    normalize,
+    top_k_indices,
+    top_k_cosine,
+)
+
+
+def random_embeddings(n: int, dimensions: int = 32, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dimensions)).astype(np.float32)
+
+
+class VectorMathTests(TestCase):
+    def test_normalize_keeps_zero_rows(self):
+        matrix = np.array([[3.0, 4.0], [0.0, 0.0]])
+        normalized = normalize(matrix)
+        self.assertTrue(np.allclose(normalized[0], [0.6, 0.8]))
+        self.assertTrue(np.allclose(normalized[1], [0.0, 0.0]))
+
+    def test_top_k_is_sorted_descending(self):
+        scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5])
+        self.assertEqual(top_k_indices(scores, 3).tolist(), [1, 3, 4])
+
+    def test_top_k_larger_than_input(self):
+        scores = np.array([0.2, 0.8])
+        self.assertEqual(top_k_indices(scores, 10).tolist(), [1, 0])
+
+    def test_top_k_cosine_matches_sklearn(self):
+        matrix = random_embeddings(200)
+        query = random_embeddings(1, seed=1)[0]
+
+        indices, scores = top_k_cosine(matrix, query.tolist(), 5)
+
+        expected = cosine_similarity(matrix, [query])[:, 0]
+        expected_indices = np.argsort(-expected)[:5]
+        self.assertEqual(indices.tolist(), expected_indices.tolist())
+        self.assertTrue(np.allclose(scores, expected[expected_indices], atol=1e-5))
+
+    def test_cosine_kernels_match_sklearn(self):
+        matrix = random_embeddings(20)
+        queries = random_embeddings(3, seed=1)
+
+        expected = cosine_similarity(matrix, queries)
+        self.assertTrue(
+            np.allclose(cosine_many_to_many(matrix, queries), expected, atol=1e-5)
+        )
+        self.assertTrue(
+            np.allclose(cosine_one_to_many(matrix, queries[0]), expected[:, 0], atol=1e-5)
+        )
+        self.assertAlmostEqual(
+            embedding_cosine_similarity(queries[0].tolist(), matrix[0].tolist()),
+            expected[0, 0],
+            places=5,
+        )
+
+
+class MongoDBCurriculumTests(TestCase):
+    @patch("learning_materials.knowledge_base.db_interface.OpenAIEmbedding")
+    @patch("learning_materials.knowledge_base.db_interface.MongoClient")
+    def setUp(self, MockClient, MockEmbedding):
+        document_cache.clear()
+        self.db = MongoDB()
+        self.db.collection = MagicMock()
+        self.document_id = uuid4()
+        self.embeddings = random_embeddings(50)
+        self.documents = [
+            {
+                "text": f"Chunk {i}",
+                "pageNum": i,
+                "documentName": "test.pdf",
+                "documentId": str(self.document_id),
+                "embedding": embedding.tolist(),
+            }
+            for i, embedding in enumerate(self.embeddings)
+        ]
+        self.db.collection.find.side_effect = lambda *args, **kwargs: iter(
+            self.documents
+        )
+
+    def test_get_curriculum_returns_most_similar_pages(self):
+        # A query close to page 7 should rank page 7 first
+        query = (self.embeddings[7] + 0.01).tolist()
+        citations = self.db.get_curriculum([self.document_id], query, top_k=3)
+
+        self.assertGreater(len(citations), 0)
+        self.assertLessEqual(len(citations), 3)
+        self.assertEqual(citations[0].page_num, 7)
+        self.assertEqual(citations[0].document_id, str(self.document_id))
+
+    def test_get_curriculum_applies_similarity_threshold(self):
+        self.db.similarity_threshold = 0.99
+        query = self.embeddings[3].tolist()
+        citations = self.db.get_curriculum([self.document_id], query, top_k=5)
+
+        self.assertEqual([citation.page_num for citation in citations], [3])
+
+    def test_get_curriculum_without_documents(self):
+        self.db.collection.find.side_effect = lambda *args, **kwargs: iter([])
+        citations = self.db.get_curriculum([self.document_id], [0.1] * 32)
+        self.assertEqual(citations, [])
+
+    def test_get_curriculum_requires_document_ids(self):
+        with self.assertRaises(ValueError):
+            self.db.get_curriculum([], [0.1] * 32)
+
+    def test_get_curriculum_reuses_cached_embeddings(self):
+        query = self.embeddings[5].tolist()
+        first = self.db.get_curriculum([self.document_id], query)
+        second = self.db.get_curriculum([self.document_id], query)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.db.collection.find.call_count, 1)
+        self.assertIn(self.document_id, document_cache)
+
+    def test_upload_message_invalidates_cached_embeddings(self):
+        self.db.get_curriculum([self.document_id], self.embeddings[0].tolist())
+        handle_document_cache_invalidation({"document_id": str(self.document_id)})
+
+        self.assertNotIn(self.document_id, document_cache)
+        self.db.get_curriculum([self.document_id], self.embeddings[0].tolist())
+        self.assertEqual(self.db.collection.find.call_count, 2)
+
+
+class MongoDBAtlasCurriculumTests(TestCase):
+    @patch("learning_materials.knowledge_base.db_interface.OpenAIEmbedding")
+    @patch("learning_materials.knowledge_base.db_interface.MongoClient")
+    def setUp(self, MockClient, MockEmbedding):
+        document_cache.clear()
+        self.db = MongoDBAtlas()
+        self.db.collection = MagicMock()
+        self.document_id = uuid4()
+
+    def test_get_curriculum_uses_vector_search(self):
+        self.db.collection.aggregate.return_value = [
+            {
+                "text": "Relevant",
+                "pageNum": 1,
+                "documentName": "test.pdf",
+                "documentId": str(self.document_id),
+                "score": 0.9,
+            },
+            {
+                "text": "Unrelated",
+                "pageNum": 2,
+                "documentName": "test.pdf",
+                "documentId": str(self.document_id),
+                "score": 0.5,
+            },
+        ]
+
+        citations = self.db.get_curriculum([self.document_id], [0.1] * 32, top_k=2)
+
+        # A score of 0.5 is a cosine similarity of 0, below the threshold
+        self.assertEqual([citation.text for citation in citations], ["Relevant"])
+        pipeline = self.db.collection.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0]["$vectorSearch"]["limit"], 2)
+        self.assertNotIn("embedding", pipeline[1]["$project"])
+        self.db.collection.find.assert_not_called()
+
+    def test_get_curriculum_falls_back_to_client_side_search(self):
+        embedding = random_embeddings(1)[0].tolist()
+        self.db.collection.aggregate.side_effect = OperationFailure("no index")
+        self.db.collection.find.return_value = iter(
+            [
+                {
+                    "text": "Fallback",
+                    "pageNum": 1,
+                    "documentName": "test.pdf",
+                    "documentId": str(self.document_id),
+                    "embedding": embedding,
+                }
+            ]
+        )
+
+        citations = self.db.get_curriculum([self.document_id], embedding)
+
+        self.assertEqual([citation.text for citation in citations], ["Fallback"])
+
+
+    @patch("learning_materials.knowledge_base.db_interface.OpenAIEmbedding")
+    @patch("learning_materials.knowledge_base.db_interface.MongoClient")
+    def test_packed_embeddings_are_rejected(self, MockClient, MockEmbedding):
+        with patch.dict(os.environ, {"EMBEDDING_STORAGE_FORMAT": "float16"}):
+            with self.assertRaises(ValueError):
+                MongoDBAtlas()
+
+
+class DocumentEmbeddingCacheTests(TestCase):
+    def create_entry(self, rows: int) -> DocumentMatrix:
+        return DocumentMatrix(
+            matrix=normalize(random_embeddings(rows)),
+            pages=[Citation(text="", page_num=i) for i in range(rows)],
+        )
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        entry_bytes = self.create_entry(10).nbytes
+        cache = DocumentEmbeddingCache(max_bytes=2 * entry_bytes)
+
+        cache.put("a", self.create_entry(10))
+        cache.put("b", self.create_entry(10))
+        cache.get("a")
+        cache.put("c", self.create_entry(10))
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.size_bytes, 2 * entry_bytes)
+
+    def test_does_not_store_entries_larger_than_cache(self):
+        cache = DocumentEmbeddingCache(max_bytes=10)
+        cache.put("a", self.create_entry(10))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_invalidate(self):
+        cache = DocumentEmbeddingCache(max_bytes=10**6)
+        cache.put("a", self.create_entry(10))
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_deleting_user_file_invalidates_cached_embeddings(self):
+        user = User.objects.create_user(username="cacheuser", password="StrongP@ss1")
+        user_file = UserFile.objects.create(
+            name="Test File",
+            blob_name="test_blob",
+            file_url="http://example.com/file.pdf",
+            num_pages=10,
+            content_type="application/pdf",
+            user=user,
+        )
+        document_id = user_file.id
+        document_cache.put(document_id, self.create_entry(10))
+
+        with (
+            patch("learning_materials.knowledge_base.rag_service.ann_indexes") as ann_indexes,
+            patch("learning_materials.knowledge_base.rag_service.bm25_indexes") as bm25_indexes,
+        ):
+            user_file.delete()
+
+        self.assertNotIn(document_id, document_cache)
+        ann_indexes.invalidate.assert_called_once_with(document_id)
+        bm25_indexes.invalidate.assert_called_once_with(document_id)
+
+
+class AnnIndexTests(TestCase):
+    def setUp(self):
+        self.db = MockDatabase()
+        self.document_id = uuid4()
+        self.embeddings = random_embeddings(300, seed=2)
+        for i, embedding in enumerate(self.embeddings):
+            self.db.post_curriculum(
+                f"Chunk {i}", i, "test.pdf", embedding.tolist(), self.document_id
+            )
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = AnnIndexStore(self.db, self.directory.name, target_recall=0.9)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_invalidate_drops_the_index_from_memory_and_disk(self):
+        path = Path(self.directory.name) / f"{self.document_id}.npz"
+        self.store.get_index(self.document_id)
+
+        self.store.invalidate(self.document_id)
+
+        self.assertFalse(path.exists())
+        self.assertIsNone(self.store.update(self.document_id))
+
+    def test_index_is_built_lazily_and_persisted(self):
+        path = Path(self.directory.name) / f"{self.document_id}.npz"
+        self.assertFalse(path.exists())
+
+        index = self.store.get_index(self.document_id)
+
+        self.assertEqual(len(index), len(self.embeddings))
+        self.assertTrue(path.exists())
+
+        with patch.object(self.db, "get_all_pages") as get_all_pages:
+            loaded = AnnIndexStore(self.db, self.directory.name).get_index(
+                self.document_id
+            )
+            get_all_pages.assert_not_called()
+        self.assertEqual(len(loaded), len(index))
+        self.assertEqual(loaded.n_probe, index.n_probe)
+
+    def test_probing_every_list_is_exact(self):
+        index = self.store.get_index(self.document_id)
+        queries = normalize(random_embeddings(20, seed=3))
+
+        self.assertEqual(index.recall(queries, 5, index.n_lists), 1.0)
+        self.assertLessEqual(index.n_probe, index.n_lists)
+
+    def test_calibration_picks_smallest_n_probe_for_target(self):
+        index = self.store.get_index(self.document_id)
+        n_probe = index.calibrate(target_recall=1.0)
+
+        rng = np.random.default_rng(42)
+        pairs = rng.integers(0, len(index), size=(32, 2))
+        queries = normalize(index.vectors[pairs[:, 0]] + index.vectors[pairs[:, 1]])
+        self.assertEqual(index.recall(queries, 5, n_probe), 1.0)
+        if n_probe > 1:
+            self.assertLess(index.recall(queries, 5, n_probe - 1), 1.0)
+
+    def test_exact_search_matches_brute_force(self):
+        query = random_embeddings(1, seed=4)[0]
+        matches = self.store.search([self.document_id], query.tolist(), 5, exact=True)
+
+        expected, _ = top_k_cosine(self.embeddings, query.tolist(), 5)
+        self.assertEqual([citation.page_num for citation, _ in matches], expected.tolist())
+
+    def test_search_finds_the_page_itself(self):
+        matches = self.store.search([self.document_id], self.embeddings[42].tolist(), 1)
+        self.assertEqual(matches[0][0].page_num, 42)
+        self.assertAlmostEqual(matches[0][1], 1.0, places=5)
+
+    def test_update_adds_new_pages_incrementally(self):
+        self.store.get_index(self.document_id)
+        new_embedding = random_embeddings(1, seed=5)[0].tolist()
+        self.db.post_curriculum("New chunk", 300, "test.pdf", new_embedding, self.document_id)
+
+        with patch.object(IVFIndex, "build") as build:
+            index = self.store.update(self.document_id)
+            build.assert_not_called()
+
+        self.assertEqual(len(index), len(self.embeddings) + 1)
+        matches = self.store.search([self.document_id], new_embedding, 1)
+        self.assertEqual(matches[0][0].text, "New chunk")
+
+    def test_update_replaces_the_entries_of_an_edited_page(self):
+        self.store.get_index(self.document_id)
+        pages = self.db.get_all_pages(self.document_id)
+        edited_embedding = random_embeddings(1, seed=6)[0].tolist()
+        pages[7] = pages[7].model_copy(update={"text": "Edited chunk", "embedding": edited_embedding})
+
+        with patch.object(self.db, "get_all_pages", return_value=pages):
+            index = self.store.update(self.document_id)
+
+        self.assertEqual(len(index), len(self.embeddings))
+        self.assertEqual(
+            [page.text for page in index.pages if page.page_num == 7], ["Edited chunk"]
+        )
+        matches = self.store.search([self.document_id], edited_embedding, 1)
+        self.assertEqual(matches[0][0].text, "Edited chunk")
+
+    def test_update_leaves_documents_without_an_index_to_be_built_lazily(self):
+        with patch.object(IVFIndex, "build") as build:
+            self.assertIsNone(self.store.update(self.document_id))
+            build.assert_not_called()
+        self.assertFalse((Path(self.directory.name) / f"{self.document_id}.npz").exists())
+
+    def test_unknown_document_has_no_index(self):
+        self.assertIsNone(self.store.get_index(uuid4()))
+        self.assertEqual(self.store.search([uuid4()], [0.1] * 32), [])
+
+
+class EmbeddingStorageTests(TestCase):
+    def test_array_format_is_unchanged(self):
+        embedding = [0.1, 0.2, 0.3]
+        value, storage_format = encode_embedding(embedding)
+        self.assertEqual(value, embedding)
+        self.assertIsNone(storage_format)
+        self.assertTrue(np.allclose(decode_embedding({"embedding": value}), embedding))
+
+    def test_packed_formats_round_trip(self):
+        embedding = random_embeddings(1)[0].tolist()
+        for storage_format, itemsize in [("float32", 4), ("float16", 2)]:
+            value, stored_format = encode_embedding(embedding, storage_format)
+            self.assertEqual(len(value), itemsize * len(embedding))
+
+            decoded = decode_embedding(
+                {"embedding": value, "embeddingFormat": stored_format}
+            )
+            self.assertTrue(np.allclose(decoded, embedding, atol=1e-2))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            encode_embedding([0.1], "float8")
+
+    @patch("learning_materials.knowledge_base.db_interface.OpenAIEmbedding")
+    @patch("learning_materials.knowledge_base.db_interface.MongoClient")
+    def test_packed_pages_are_searchable(self, MockClient, MockEmbedding):
+        document_cache.clear()
+        db = MongoDB()
+        db.collection = MagicMock()
+        db.storage_format = "float16"
+        document_id = uuid4()
+        embeddings = random_embeddings(10)
+        for i, embedding in enumerate(embeddings):
+            db.post_curriculum(f"Chunk {i}", i, "test.pdf", embedding.tolist(), document_id)
+
+        documents = [call.args[0] for call in db.collection.insert_one.call_args_list]
+        self.assertEqual(documents[0]["embeddingFormat"], "float16")
+        db.collection.find.side_effect = lambda *args, **kwargs: iter(documents)
+
+        citations = db.get_curriculum([document_id], embeddings[4].tolist(), top_k=1)
+        self.assertEqual(citations[0].page_num, 4)
+        pages = db.get_all_pages(document_id)
+        self.assertTrue(np.allclose(pages[4].embedding, embeddings[4], atol=1e-2))
+
+
+class MongoDBQueryTests(TestCase):
+    @patch("learning_materials.knowledge_base.db_interface.OpenAIEmbedding")
+    @patch("learning_materials.knowledge_base.db_interface.MongoClient")
+    def setUp(self, MockClient, MockEmbedding):
+        document_cache.clear()
+        self.db = MongoDB()
+        self.db.collection = MagicMock()
+        self.db.collection.find.return_value = iter([])
+
+    def test_get_page_range_does_not_fetch_embeddings(self):
+        self.db.get_page_range(uuid4(), 1, 3)
+
+        projection = self.db.collection.find.call_args[0][1]
+        self.assertNotIn("embedding", projection)
+        self.assertEqual(projection["text"], 1)
+
+    def test_get_all_pages_fetches_embeddings(self):
+        self.db.get_all_pages(uuid4())
+
+        projection = self.db.collection.find.call_args[0][1]
+        self.assertEqual(projection["embedding"], 1)
+        self.assertEqual(projection["embeddingFormat"], 1)
+
+    def test_get_all_pages_keeps_the_stored_buffer(self):
+        value, storage_format = encode_embedding([0.5, -0.25, 1.0], "float32")
+        self.db.collection.find.return_value = iter(
+            [
+                {
+                    "text": "Page one",
+                    "pageNum": 1,
+                    "documentName": "doc",
+                    "documentId": "1",
+                    "embedding": value,
+                    "embeddingFormat": storage_format,
+                }
+            ]
+        )
+
+        [page] = self.db.get_all_pages(uuid4())
+
+        self.assertIsInstance(page.embedding, np.ndarray)
+        self.assertFalse(page.embedding.flags.owndata)
+        self.assertEqual(page.embedding.tolist(), [0.5, -0.25, 1.0])
+
+    def test_ensure_indexes_creates_compound_index(self):
+        self.db.ensure_indexes()
+
+        keys = self.db.collection.create_index.call_args[0][0]
+        self.assertEqual(keys, [("documentId", 1), ("pageNum", 1)])
+
+
+class BM25IndexTests(TestCase):
+    def setUp(self):
+        self.pages = [
+            Citation(text="The Pythagorean theorem relates triangle sides", page_num=1),
+            Citation(text="Course TDT4100 covers object oriented code", page_num=2),
+            Citation(text="A triangle has three sides and three angles", page_num=3),
+            Citation(text="Photosynthesis converts light into energy", page_num=4),
+        ]
+        self.index = BM25Index(self.pages)
+
+    def test_exact_terms_rank_first(self):
+        indices, scores = self.index.search("What is tdt4100 about?", 3)
+        self.assertEqual(indices.tolist(), [1])
+        self.assertGreater(scores[0], 0)
+
+    def test_rare_terms_weigh_more(self):
+        indices, _ = self.index.search("pythagorean triangle", 2)
+        self.assertEqual([self.pages[i].page_num for i in indices], [1, 3])
+
+    def test_unknown_terms_match_nothing(self):
+        indices, _ = self.index.search("mitochondria", 3)
+        self.assertEqual(len(indices), 0)
+
+    def test_store_updates_indexes_after_ingestion(self):
+        db = MockDatabase()
+        document_id = uuid4()
+        db.post_curriculum("Gradient descent", 1, "ml.pdf", [0.1, 0.2], document_id)
+        store = BM25IndexStore(db)
+        self.assertEqual(len(store.get_index(document_id)), 1)
+
+        db.post_curriculum("Stochastic gradient descent", 2, "ml.pdf", [0.2, 0.1], document_id)
+        store.update(document_id)
+
+        matches = store.search([document_id], "stochastic", 5)
+        self.assertEqual([citation.page_num for citation, _ in matches], [2])
+
+    def test_store_replaces_the_entries_of_an_edited_page(self):
+        db = MockDatabase()
+        document_id = uuid4()
+        db.post_curriculum("Gradient descent", 1, "ml.pdf", [0.1, 0.2], document_id)
+        db.post_curriculum("Backpropagation", 2, "ml.pdf", [0.2, 0.1], document_id)
+        store = BM25IndexStore(db)
+        index = store.get_index(document_id)
+
+        [edited] = [
+            document
+            for document in db.data
+            if document["documentId"] == str(document_id) and document["pageNum"] == 1
+        ]
+        edited["text"] = "Stochastic gradient descent"
+        updated = store.update(document_id)
+
+        self.assertIsNot(updated, index)
+        self.assertEqual(
+            [page.text for page in updated.pages],
+            ["Stochastic gradient descent", "Backpropagation"],
+        )
+        self.assertEqual(len(updated.page_lengths), 2)
+        # The index in use by earlier searches is left as it was
+        self.assertEqual(index.pages[0].text, "Gradient descent")
+        matches = store.search([document_id], "gradient", 5)
+        self.assertEqual([citation.page_num for citation, _ in matches], [1])
+
+    def test_reciprocal_rank_fusion(self):
+        a, b, c = self.pages[:3]
+        fused = reciprocal_rank_fusion([[a, b, c], [b, c]])
+        # Pages found by both searches beat a page ranked first by one of them
+        self.assertEqual(fused, [b, c, a])
+
+
+class MockDatabaseCurriculumTests(TestCase):
+    def setUp(self):
+        self.db = MockDatabase()
+        self.db.data = []
+        self.document_id = uuid4()
+        self.embeddings = random_embeddings(20, seed=6)
+        for i, embedding in enumerate(self.embeddings):
+            self.db.post_curriculum(
+                f"Chunk {i}", i, "test.pdf", embedding.tolist(), self.document_id
+            )
+
+    def test_get_curriculum_returns_most_similar_pages(self):
+        citations = self.db.get_curriculum(
+            [self.document_id], self.embeddings[11].tolist(), top_k=3
+        )
+
+        self.assertEqual(citations[0].page_num, 11)
+        self.assertEqual(citations[0].document_id, str(self.document_id))
+        self.assertLessEqual(len(citations), 3)
+
+    def test_get_curriculum_ignores_other_documents(self):
+        self.assertEqual(
+            self.db.get_curriculum([uuid4()], self.embeddings[0].tolist()), []
+        )
+
+
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = AnswerCache(
+            max_entries=2,
+            ttl_seconds=60,
+            similarity_threshold=0.95,
+            clock=lambda: self.now,
+        )
+        self.embedding = random_embeddings(1)[0]
+        self.answer = RagAnswer(content="Normalization is...", citations=[])
+
+    def test_serves_similar_questions_about_the_same_documents(self):
+        self.cache.put(["a", "b"], "en", self.embedding, self.answer, latency=3.0)
+
+        similar = self.embedding + 0.01
+        self.assertEqual(
+            self.cache.get(["b", "a"], "en", similar).content, "Normalization is..."
+        )
+        self.assertIsNone(self.cache.get(["a"], "en", similar))
+        self.assertIsNone(self.cache.get(["a", "b"], "no", similar))
+        self.assertIsNone(self.cache.get(["a", "b"], "en", random_embeddings(1, seed=1)[0]))
+
+    def test_entries_expire(self):
+        self.cache.put(["a"], "en", self.embedding, self.answer, latency=3.0)
+        self.now = 61.0
+        self.assertIsNone(self.cache.get(["a"], "en", self.embedding))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        embeddings = random_embeddings(3, seed=2)
+        for embedding in embeddings:
+            self.cache.put(["a"], "en", embedding, self.answer, latency=1.0)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(["a"], "en", embeddings[0]))
+        self.assertIsNotNone(self.cache.get(["a"], "en", embeddings[2]))
+
+    def test_invalidate_drops_answers_of_the_document(self):
+        self.cache.put(["a", "b"], "en", self.embedding, self.answer, latency=1.0)
+        self.cache.put(["c"], "en", self.embedding, self.answer, latency=1.0)
+
+        self.cache.invalidate("b")
+
+        self.assertIsNone(self.cache.get(["a", "b"], "en", self.embedding))
+        self.assertIsNotNone(self.cache.get(["c"], "en", self.embedding))
+
+    @patch("learning_materials.learning_material_service.response_formulation")
+    @patch("learning_materials.learning_material_service.get_context")
+    @patch("learning_materials.learning_material_service.get_query_embedding")
+    def test_process_answer_only_caches_first_questions(
+        self, mock_embedding, mock_get_context, mock_response
+    ):
+        mock_embedding.return_value = self.embedding.tolist()
+        mock_get_context.return_value = [Citation(text="Context", page_num=1)]
+        mock_response.return_value = "Normalization is..."
+        question = "What is normalization?"
+
+        with patch("learning_materials.learning_material_service.answer_cache", self.cache):
+            process_answer(["a"], question, [{"role": "user", "content": question}], "en")
+            cached = process_answer(["a"], question, [], "en")
+            process_answer(
+                ["a"],
+                question,
+                [
+                    {"role": "user", "content": "Hi"},
+                    {"role": "assistant", "content": "Hello"},
+                    {"role": "user", "content": question},
+                ],
+                "en",
+            )
+
+        self.assertEqual(cached.content, "Normalization is...")
+        self.assertEqual(mock_response.call_count, 2)
+        self.assertEqual(mock_get_context.call_count, 2)
+
+
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        base = random_embeddings(3, seed=1)
+        noise = random_embeddings(3, seed=2) * 0.01
+        # Items 0, 2 and 4 are near duplicates, as are items 1 and 3
+        self.embeddings = np.stack(
+            [base[0], base[1], base[0] + noise[0], base[1] + noise[1], base[0] + noise[2], base[2]]
+        ).tolist()
+
+    def test_groups_near_duplicates_around_the_first_item(self):
+        groups = near_duplicate_groups(self.embeddings, 0.95)
+
+        self.assertEqual(groups, [[0, 2, 4], [1, 3], [5]])
+
+    def test_the_best_item_represents_its_group(self):
+        scores = [1, 1, 5, 0, 1, 1]
+
+        groups = near_duplicate_groups(self.embeddings, 0.95, scores)
+
+        self.assertEqual(groups, [[1, 3], [2, 0, 4], [5]])
+
+    @patch("learning_materials.knowledge_base.deduplication.get_text_embeddings")
+    def test_embeds_all_texts_in_one_batch(self, mock_get_text_embeddings):
+        mock_get_text_embeddings.return_value = self.embeddings
+        items = ["a", "b", "c", "d", "e", "f"]
+
+        kept = deduplicate(items, items, threshold=0.95)
+
+        mock_get_text_embeddings.assert_called_once_with(items)
+        self.assertEqual(kept, ["a", "b", "f"])
+
+    @patch("learning_materials.knowledge_base.deduplication.get_text_embeddings")
+    def test_keeps_all_items_if_embedding_fails(self, mock_get_text_embeddings):
+        mock_get_text_embeddings.side_effect = ConnectionError("Embeddings unavailable")
+
+        self.assertEqual(deduplicate(["a", "b"], ["a", "b"], threshold=0.95), ["a", "b"])
+
+    @patch("learning_materials.knowledge_base.deduplication.get_text_embeddings")
+    def test_threshold_of_zero_disables_deduplication(self, mock_get_text_embeddings):
+        self.assertEqual(deduplicate(["a", "a"], ["a", "a"], threshold=0), ["a", "a"])
+        mock_get_text_embeddings.assert_not_called()
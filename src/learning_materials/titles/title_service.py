@@ -0,0 +1,177 @@
+""" Placeholder titles and their deferred replacement by generated titles """
+
+import logging
+import re
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+
+from django.db import models
+from pydantic import BaseModel
+
+from broker.producer import producer
+from broker.topics import Topic
+from learning_materials.knowledge_base.response_formulation import (
+    generate_title_of_chat,
+    generate_title_of_flashcards,
+    generate_title_of_quiz,
+)
+from learning_materials.learning_resources import RagAnswer
+from learning_materials.models import Cardset, Chat, QuizModel
+from learning_materials.translator import (
+    translate_flashcards_to_pydantic_model,
+    translate_quiz_to_pydantic_model,
+)
+
+logger = logging.getLogger(__name__)
+
+CHAT = "chat"
+CARDSET = "cardset"
+QUIZ = "quiz"
+
+DEFAULT_TITLES = {
+    CHAT: "New Chat",
+    CARDSET: "Flashcards",
+    QUIZ: "Quiz",
+}
+
+# Cardset and quiz names are limited to 100 characters
+MAX_TITLE_LENGTH = 100
+
+_WORD_RE = re.compile(r"[^\W\d_][\w'-]*")
+
+# Function words of the course languages which never make a good title
+_STOP_WORDS = frozenset(
+    """
+    a about above after again all also am an and any are as at be because been
+    before being below between both but by can could did do does doing down
+    during each explain few for from further had has have having he her here hers
+    him his how i if in into is it its just me more most my no nor not now of off
+    on once only or other our out over own please same she should so some such
+    tell than that the their them then there these they this those through to too
+    under until up very was we were what when where which while who whom why will
+    with would you your
+    alle at av da de den denne dere det dette du eller en er et for fra har hva
+    hvem hvilke hvilken hvor hvordan hvorfor i ikke jeg kan med meg men mer og om
+    oss på seg som til ut var vi vil være å
+    """.split()
+)
+
+
+class TitleMessage(BaseModel):
+    """
+    Message asking a worker to replace the placeholder title of a chat,
+    cardset or quiz with a generated one
+    """
+
+    kind: str
+    object_id: uuid.UUID
+    placeholder: str
+    language: Optional[str] = None
+
+
+def key_terms(text: str, max_terms: int = 4) -> list[str]:
+    """
+    The most frequent content words of a text, in the order they first appear
+
+    Args:
+        text (str): The text to extract the key terms from
+        max_terms (int): The maximum number of key terms
+
+    Returns:
+        list[str]: The key terms
+    """
+    words = [
+        word
+        for word in _WORD_RE.findall(text)
+        if len(word) > 2 and word.casefold() not in _STOP_WORDS
+    ]
+    counts = Counter(word.casefold() for word in words)
+    first_seen: dict[str, str] = {}
+    for word in words:
+        first_seen.setdefault(word.casefold(), word)
+
+    order = list(first_seen)
+    # Most frequent first, ties are broken by the first occurrence
+    chosen = sorted(order, key=lambda term: (-counts[term], order.index(term)))[:max_terms]
+    return [first_seen[term] for term in order if term in chosen]
+
+
+def placeholder_title(text: str, kind: str) -> str:
+    """
+    A cheap, deterministic title made of the key terms of the text, shown
+    until the generated title is ready
+
+    Args:
+        text (str): The text the title is derived from, such as the first question of a chat
+        kind (str): One of CHAT, CARDSET or QUIZ, used for the fallback title
+
+    Returns:
+        str: The placeholder title
+    """
+    terms = key_terms(text)
+    if not terms:
+        return DEFAULT_TITLES[kind]
+
+    title = " ".join(term[0].upper() + term[1:] for term in terms)
+    return title[:MAX_TITLE_LENGTH]
+
+
+def request_title(
+    kind: str, object_id: uuid.UUID, placeholder: str, language: Optional[str] = None
+) -> None:
+    """
+    Queue the generation of the title of a saved chat, cardset or quiz
+    """
+    message = TitleMessage(
+        kind=kind, object_id=object_id, placeholder=placeholder, language=language
+    )
+    producer.produce(Topic.TITLE_GENERATION, message.model_dump_json())
+
+
+def _chat_title(chat: Chat, language: Optional[str]) -> str:
+    question = next(m["content"] for m in chat.messages if m["role"] == "user")
+    answer = next(
+        (m["content"] for m in chat.messages if m["role"] == "assistant"), ""
+    )
+    return generate_title_of_chat(
+        question, RagAnswer(content=answer, citations=[]), language
+    )
+
+
+def _cardset_title(cardset: Cardset, language: Optional[str]) -> str:
+    flashcards = translate_flashcards_to_pydantic_model(cardset.flashcards.all())
+    return generate_title_of_flashcards(flashcards, language)
+
+
+def _quiz_title(quiz: QuizModel, language: Optional[str]) -> str:
+    return generate_title_of_quiz(translate_quiz_to_pydantic_model(quiz), language)
+
+
+# The model, title field and title generator of every kind
+TITLE_GENERATORS: dict[str, tuple[type[models.Model], str, Callable]] = {
+    CHAT: (Chat, "title", _chat_title),
+    CARDSET: (Cardset, "name", _cardset_title),
+    QUIZ: (QuizModel, "name", _quiz_title),
+}
+
+
+def generate_title(message: TitleMessage) -> Optional[str]:
+    """
+    Generate the title and replace the placeholder with it. A title which has
+    been changed in the meantime, e.g. renamed by the user, is kept.
+
+    Returns:
+        Optional[str]: The generated title, or None if the object is gone
+    """
+    model, field, generate = TITLE_GENERATORS[message.kind]
+    instance = model.objects.filter(id=message.object_id).first()
+    if instance is None:
+        logger.info(f"Skipping title of {message.kind} {message.object_id}, it was deleted")
+        return None
+
+    title = generate(instance, message.language)[:MAX_TITLE_LENGTH]
+    model.objects.filter(
+        id=message.object_id, **{field: message.placeholder}
+    ).update(**{field: title})
+    return title
@@ -0,0 +1,86 @@
+""" Concurrent fan-out of independent calls, such as one LLM call per page """
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, Union
+
+from learning_materials.utils.progress import report_progress
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def call_with_retry(
+    fn: Callable[[T], R],
+    item: T,
+    retries: int = 2,
+    base_delay: float = 0.5,
+) -> R:
+    """
+    Call fn(item), retrying failed calls with exponential backoff and full jitter
+
+    Args:
+        fn (Callable[[T], R]): The function to call
+        item (T): The argument of the call
+        retries (int): The number of retries after the first attempt
+        base_delay (float): The maximum delay in seconds before the first retry
+
+    Returns:
+        R: The result of the first successful call
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn(item)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = random.uniform(0, base_delay * 2**attempt)
+            logger.warning(
+                f"Attempt {attempt + 1} failed: {e}, retrying in {delay:.2f}s"
+            )
+            time.sleep(delay)
+
+
+def fan_out(
+    fn: Callable[[T], R],
+    items: list[T],
+    max_workers: int = 8,
+    retries: int = 2,
+    base_delay: float = 0.5,
+) -> list[Union[R, Exception]]:
+    """
+    Call fn for every item on a bounded thread pool. Per-call timeouts are
+    enforced by fn itself, e.g. through the timeout of the LLM client, and
+    surface as exceptions which are retried.
+
+    Args:
+        fn (Callable[[T], R]): The function to call for each item
+        items (list[T]): The items
+        max_workers (int): The maximum number of concurrent calls
+        retries (int): The number of retries of each failed call
+        base_delay (float): The maximum delay in seconds before the first retry
+
+    Returns:
+        list[Union[R, Exception]]: The result of each item in the order of the items, or the exception of its last attempt
+    """
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [
+            executor.submit(call_with_retry, fn, item, retries, base_delay)
+            for item in items
+        ]
+
+        results: list[Union[R, Exception]] = []
+        for done, future in enumerate(futures, start=1):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+            report_progress(done, len(futures))
+        return results
@@ -0,0 +1,138 @@
+""" Application-wide executor for generation calls, shared fairly between users """
+
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+
+from prometheus_client import Counter, Gauge
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+GENERATION_QUEUE_DEPTH = Gauge(
+    "tutorai_generation_queue_depth",
+    "Generation tasks waiting for a worker",
+)
+GENERATION_ACTIVE_WORKERS = Gauge(
+    "tutorai_generation_active_workers",
+    "Generation workers running a task",
+)
+GENERATION_REJECTED_TASKS = Counter(
+    "tutorai_generation_rejected_tasks_total",
+    "Generation tasks rejected because the queue was full",
+)
+
+
+class ExecutorSaturated(Exception):
+    """The generation queue cannot take the submitted tasks"""
+
+
+class FairExecutor:
+    """
+    Fixed pool of worker threads with a bounded queue per user. The workers
+    take tasks from the users' queues in turn, so a user with a long request
+    cannot hold back the requests of other users.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        # Users with queued tasks, in the order they are served
+        self._queues: OrderedDict[Hashable, deque] = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self._workers: list[threading.Thread] = []
+        self._condition = threading.Condition()
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def map(self, owner: Hashable, fn: Callable[[T], R], items: list[T]) -> list[Future]:
+        """
+        Queue fn(item) for every item. The items are admitted all at once or
+        not at all.
+
+        Args:
+            owner (Hashable): The user the tasks are run for
+            fn (Callable[[T], R]): The function to call for each item
+            items (list[T]): The items
+
+        Returns:
+            list[Future]: The future of each item in the order of the items
+
+        Raises:
+            ExecutorSaturated: If the queue cannot take the items
+        """
+        futures = [Future() for _ in items]
+        with self._condition:
+            if self._queued + len(items) > self.max_queued:
+                GENERATION_REJECTED_TASKS.inc(len(items))
+                raise ExecutorSaturated(
+                    "Too many generation requests are in progress, please try again later"
+                )
+
+            queue = self._queues.setdefault(owner, deque())
+            queue.extend((future, fn, item) for future, item in zip(futures, items))
+            self._queued += len(items)
+            GENERATION_QUEUE_DEPTH.set(self._queued)
+
+            self._start_workers()
+            self._condition.notify_all()
+        return futures
+
+    def _start_workers(self) -> None:
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work, name=f"generation-{len(self._workers)}", daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_task(self) -> tuple[Future, Callable, object]:
+        with self._condition:
+            while not self._queues:
+                self._condition.wait()
+
+            # Take the task of the next user in turn and move the user to the back
+            owner, queue = next(iter(self._queues.items()))
+            task = queue.popleft()
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+
+            self._queued -= 1
+            self._active += 1
+            GENERATION_QUEUE_DEPTH.set(self._queued)
+            GENERATION_ACTIVE_WORKERS.set(self._active)
+            return task
+
+    def _work(self) -> None:
+        while True:
+            future, fn, item = self._next_task()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(item))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    GENERATION_ACTIVE_WORKERS.set(self._active)
+
+
+generation_executor = FairExecutor(
+    Config().GENERATION_MAX_WORKERS, Config().GENERATION_MAX_QUEUED
+)
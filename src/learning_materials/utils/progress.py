@@ -0,0 +1,34 @@
+""" Progress reporting of long-running generation, such as a generation job """
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+_reporter: ContextVar[Optional[Callable[[float], None]]] = ContextVar(
+    "progress_reporter", default=None
+)
+
+
+@contextmanager
+def reporting_progress(reporter: Callable[[float], None]) -> Iterator[None]:
+    """
+    Send the progress reported by the generation run in this context to the reporter
+
+    Args:
+        reporter (Callable[[float], None]): Called with the fraction done, between 0 and 1
+    """
+    token = _reporter.set(reporter)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+
+def report_progress(done: int, total: int) -> None:
+    """
+    Report that done of total steps are finished. Does nothing outside of
+    reporting_progress.
+    """
+    reporter = _reporter.get()
+    if reporter is not None and total > 0:
+        reporter(min(done / total, 1.0))
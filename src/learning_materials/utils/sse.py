@@ -0,0 +1,39 @@
+""" Server-sent events (SSE) for streaming responses """
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+EVENT_STREAM_CONTENT_TYPE = "text/event-stream"
+
+
+def format_sse(event: str, data) -> str:
+    """
+    Format one server-sent event with a JSON payload
+
+    Args:
+        event (str): The name of the event
+        data: The JSON serializable payload of the event
+
+    Returns:
+        str: The event, terminated by an empty line
+    """
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders the non-streaming responses of an SSE endpoint, such as
+    validation errors, as a single error event for event stream clients
+    """
+
+    media_type = EVENT_STREAM_CONTENT_TYPE
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return format_sse("error", data).encode(self.charset)
@@ -1,11 +1,13 @@
 from datetime import datetime
 
 import logging
-from typing import IO, Optional
+from typing import IO
 import uuid
 import io
 import PyPDF2
 from django.db import transaction
+from django.http import StreamingHttpResponse
+from asgiref.sync import sync_to_async
 import re
 
 
@@ -18,6 +20,7 @@ from rest_framework.generics import (
     RetrieveUpdateDestroyAPIView,
 )
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets
 from rest_framework import status
@@ -29,6 +32,12 @@ from broker.producer import producer
 from broker.handlers.activity_handler import ActivityMessage
 from broker.topics import Topic
 from learning_materials.utils.get_number_of_pages import get_num_pages
+from learning_materials.utils.generation_executor import ExecutorSaturated
+from learning_materials.utils.sse import (
+    EVENT_STREAM_CONTENT_TYPE,
+    EventStreamRenderer,
+    format_sse,
+)
 from learning_materials.files.file_embeddings import (
     create_file_embeddings,
     create_url_embeddings,
@@ -37,20 +46,15 @@ from learning_materials.files.file_service import (
     generate_sas_url,
     upload_file_to_blob,
 )
-from learning_materials.learning_material_service import (
-    process_flashcards_by_page_range,
-    process_flashcards_by_subject,
-    process_answer,
-)
-from learning_materials.knowledge_base.response_formulation import (
-    generate_title_of_chat,
-    generate_title_of_flashcards,
-    generate_title_of_quiz,
-)
-from learning_materials.quizzes.quiz_service import (
-    generate_quiz,
-    grade_quiz,
+from learning_materials.learning_material_service import process_answer, stream_answer
+from learning_materials.jobs.job_service import (
+    create_cardset,
+    create_quiz,
+    expire_stale_job,
+    submit_job,
 )
+from learning_materials.quizzes.quiz_service import grade_quiz
+from learning_materials.titles import title_service
 from learning_materials.flashcards.flashcards_service import parse_for_anki
 from learning_materials.models import (
     Cardset,
@@ -58,13 +62,12 @@ from learning_materials.models import (
     Course,
     FlashcardModel,
     Chat,
+    GenerationJob,
     QuizModel,
     UserFile,
     UserURL,
 )
 from learning_materials.translator import (
-    translate_flashcard_to_orm_model,
-    translate_quiz_to_orm_model,
     translate_flashcards_to_pydantic_model,
     translate_quiz_to_pydantic_model,
 )
@@ -80,6 +83,8 @@ from learning_materials.serializer import (
     ChatRequestSerializer,
     FlashcardSerializer,
     CardsetCreateSerializer,
+    GenerationJobCreateSerializer,
+    GenerationJobSerializer,
     ReviewFlashcardSerializer,
     QuizModelSerializer,
     ContextSerializer,
@@ -394,6 +399,9 @@ class CreateCardsetView(CreateAPIView):
             401: openapi.Response(
                 description="Authentication credentials were not provided or invalid"
             ),
+            429: openapi.Response(
+                description="Too many flashcards are being generated, try again later"
+            ),
         },
         tags=["Flashcards"],
     )
@@ -402,50 +410,19 @@ class CreateCardsetView(CreateAPIView):
             data=request.data, context={"request": request}
         )
         if serializer.is_valid():
-            course_id = serializer.validated_data.get("course_id")
-            document_id = serializer.validated_data.get("document_id")
-            subject = serializer.validated_data.get("subject")
-            start = serializer.validated_data.get("start_page")
-            end = serializer.validated_data.get("end_page")
-            num_flashcards = serializer.validated_data.get("num_flashcards")
-            user = request.user
-            logger.info(f"Generating flashcards for document {document_id}")
-
-            flashcards = []
-
-            course: Optional[Course] = None
-            if course_id:
-                course = Course.objects.get(id=course_id)
-            language = course.language if course else None
-
-            if start is not None and end is not None:
-                flashcards = process_flashcards_by_page_range(
-                    document_id, start, end, language, num_flashcards
-                )
-            elif subject:
-                flashcards = process_flashcards_by_subject(
-                    document_id, subject, language, num_flashcards
+            try:
+                cardset = create_cardset(request.user, **serializer.validated_data)
+            except ValueError as e:
+                return Response(
+                    {"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST
                 )
-            else:
+            except ExecutorSaturated as e:
                 return Response(
-                    {"detail": "Either start and end page or subject is required"},
-                    status=status.HTTP_400_BAD_REQUEST,
+                    {"detail": str(e)},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={"Retry-After": "30"},
                 )
 
-            title = generate_title_of_flashcards(flashcards, language)
-            # Create a cardset for the flashcards and save them to the database
-            cardset = Cardset.objects.create(
-                name=title,
-                subject=subject,
-                course=course,
-                user=user,
-                start_page=start,
-                end_page=end,
-            )
-
-            for fc in flashcards:
-                translate_flashcard_to_orm_model(fc, cardset)
-
             response = CardsetSerializer(cardset).data
             return Response(data=response, status=status.HTTP_200_OK)
         else:
@@ -699,11 +676,13 @@ class ChatResponseView(APIView):
                 assistant_response.content = assistant_response.content.replace(
                     "\u0000", ""
                 )
-                
-                # Create a title for the chat (we already have the language)
-                if not chat.title:
-                    title = generate_title_of_chat(message, language, assistant_response)
-                    chat.title = title
+
+                # The generated title replaces the placeholder once it is ready
+                requires_title = not chat.title
+                if requires_title:
+                    chat.title = title_service.placeholder_title(
+                        message, title_service.CHAT
+                    )
 
                 chat.messages.append(
                     {
@@ -716,6 +695,10 @@ class ChatResponseView(APIView):
                     }
                 )
                 chat.save()
+                if requires_title:
+                    title_service.request_title(
+                        title_service.CHAT, chat.id, chat.title, language
+                    )
 
                 message = ActivityMessage(
                     user_id=request.user.id,
@@ -759,6 +742,114 @@ class ChatResponseView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ChatResponseStreamView(APIView):
+    """
+    Streams the answer to a chat message as server-sent events: first a
+    "citations" event, then "delta" events with the content as it is generated
+    and finally a "done" event with the title of the chat. The events only reach
+    the client as they are generated when served by the ASGI application.
+    """
+
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    def post(self, request, *args, **kwargs):
+        serializer = ChatRequestSerializer(
+            data=request.data, context={"request": request}
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        user = request.user
+        chat_id = data.get("chatId")
+        course_id = data.get("courseId")
+        user_file_ids = data.get("userFileIds", [])
+
+        # The serializer has checked that the chat or course belongs to the user
+        if chat_id:
+            chat = Chat.objects.select_related("course").get(id=chat_id, user=user)
+        else:
+            course = Course.objects.get(id=course_id, user=user) if course_id else None
+            # The chat is only saved once the answer is complete
+            chat = Chat(id=uuid.uuid4(), user=user, course=course, messages=[])
+
+        document_ids = user_file_ids or ([course_id] if course_id else [])
+        response = StreamingHttpResponse(
+            self._stream_events(chat, data["message"], document_ids, user.id),
+            content_type=EVENT_STREAM_CONTENT_TYPE,
+        )
+        response["Cache-Control"] = "no-cache"
+        # Disable response buffering in reverse proxies such as nginx
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def _stream_events(self, chat: Chat, message: str, document_ids, user_id):
+        language = chat.course.language if chat.course else None
+        messages = chat.messages + [{"role": "user", "content": message}]
+
+        try:
+            citations, deltas = await stream_answer(
+                document_ids, message, messages, language
+            )
+            serialized_citations = [citation.model_dump() for citation in citations]
+            yield format_sse(
+                "citations", {"chatId": str(chat.id), "citations": serialized_citations}
+            )
+
+            parts: list[str] = []
+            async for delta in deltas:
+                # Sanitize the response
+                delta = delta.replace("\u0000", "")
+                parts.append(delta)
+                yield format_sse("delta", {"content": delta})
+            content = "".join(parts)
+
+            # The generated title replaces the placeholder once it is ready
+            requires_title = not chat.title
+            if requires_title:
+                chat.title = title_service.placeholder_title(message, title_service.CHAT)
+
+            chat.messages = messages + [
+                {
+                    "role": "assistant",
+                    "content": content,
+                    "citations": serialized_citations,
+                }
+            ]
+            await sync_to_async(chat.save)()
+            if requires_title:
+                title_service.request_title(
+                    title_service.CHAT, chat.id, chat.title, language
+                )
+
+            activity = ActivityMessage(
+                user_id=user_id,
+                activity_type="Chat",
+                timestamp=datetime.now().isoformat(),
+                metadata={
+                    "chat_id": chat.id,
+                    "message": message,
+                    "response": content,
+                },
+            )
+            producer.produce(Topic.USER_ACTIVITY, activity.model_dump_json())
+
+            yield format_sse(
+                "done",
+                {
+                    "chatId": str(chat.id),
+                    "title": chat.title,
+                    "role": "assistant",
+                    "content": content,
+                    "citations": serialized_citations,
+                },
+            )
+        except Exception as e:
+            logging.error(f"Error streaming answer: {e}")
+            yield format_sse("error", {"error": str(e)})
+
+
 class QuizGenerationView(CreateAPIView):
     serializer_class = QuizCreateSerializer
     permission_classes = [IsAuthenticated]
@@ -798,35 +889,7 @@ class QuizGenerationView(CreateAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            document_id = serializer.validated_data.get("document_id")
-            start = serializer.validated_data.get("start_page")
-            end = serializer.validated_data.get("end_page")
-            subject = serializer.validated_data.get("subject")
-            learning_goals = serializer.validated_data.get("learning_goals", [])
-            course_id = serializer.validated_data.get("course_id")
-            num_questions = serializer.validated_data.get("num_questions")
-
-            course: Optional[Course] = None
-            if course_id:
-                course = Course.objects.get(id=course_id)
-            language = course.language if course else None
-
-            # Generate the quiz data
-            quiz_data = generate_quiz(
-                document_id, start, end, subject, learning_goals, language, num_questions
-            )
-            # Get the course
-            course = None
-            if course_id:
-                course = Course.objects.get(id=course_id)
-
-            # Get the language of the course
-            language = course.language if course else None
-            title = generate_title_of_quiz(quiz_data, language)
-            user = request.user
-
-            # Translate the quiz data into ORM models
-            quiz_model = translate_quiz_to_orm_model(quiz_data, title, user, course)
+            quiz_model = create_quiz(request.user, **serializer.validated_data)
 
             # Serialize the created quiz
             response_serializer = QuizModelSerializer(quiz_model)
@@ -863,7 +926,8 @@ class QuizGradingView(GenericAPIView):
             quiz_id = serializer.validated_data.get("quiz_id")
             quiz_model = QuizModel.objects.get(id=quiz_id)
             quiz = translate_quiz_to_pydantic_model(quiz_model)
-            graded_answer = grade_quiz(quiz, student_answers)
+            detailed_feedback = serializer.validated_data.get("detailed_feedback")
+            graded_answer = grade_quiz(quiz, student_answers, detailed_feedback)
             response = graded_answer.model_dump()
             
             if quiz_model.scores is None:
@@ -949,3 +1013,74 @@ class CompendiumCreationView(GenericAPIView):
             return Response(response, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class GenerationJobCreateView(GenericAPIView):
+    serializer_class = GenerationJobCreateSerializer
+    permission_classes = [IsAuthenticated]
+
+    # The serializer which validates the parameters of each kind of job
+    parameter_serializers = {
+        GenerationJob.Kind.FLASHCARDS: CardsetCreateSerializer,
+        GenerationJob.Kind.QUIZ: QuizCreateSerializer,
+        GenerationJob.Kind.COMPENDIUM: ContextSerializer,
+    }
+
+    @swagger_auto_schema(
+        operation_description="Submit the generation of flashcards, a quiz or a compendium",
+        request_body=GenerationJobCreateSerializer,
+        responses={
+            202: openapi.Response(
+                description="Generation job submitted",
+                examples={
+                    "application/json": {
+                        "job_id": "94d07cab-569b-40af-baf9-f2d3880a18e3",
+                        "status": "pending",
+                    }
+                },
+            ),
+            400: openapi.Response(description="Invalid request data"),
+        },
+        tags=["Jobs"],
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        kind = serializer.validated_data["kind"]
+        parameters = self.parameter_serializers[kind](
+            data=serializer.validated_data["parameters"], context={"request": request}
+        )
+        if not parameters.is_valid():
+            return Response(parameters.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        job = submit_job(request.user, kind, parameters.validated_data)
+        return Response(
+            {"job_id": str(job.id), "status": job.status},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class GenerationJobDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Get the status, progress and result of a generation job",
+        responses={
+            200: GenerationJobSerializer,
+            404: openapi.Response(description="Job not found"),
+        },
+        tags=["Jobs"],
+    )
+    def get(self, request, job_id):
+        try:
+            job = GenerationJob.objects.get(id=job_id, user=request.user)
+        except GenerationJob.DoesNotExist:
+            return Response(
+                {"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        # A job whose worker died is retried or failed instead of running forever
+        job = expire_stale_job(job)
+        return Response(GenerationJobSerializer(job).data, status=status.HTTP_200_OK)
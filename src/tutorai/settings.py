@@ -145,6 +145,42 @@ DATABASES = {
 
 AUTH_USER_MODEL = "accounts.CustomUser"
 
+# Caches
+# The persistent caches hold results that are expensive to recompute, like embeddings,
+# and are shared by all processes. With PERSISTENT_CACHE_REDIS_URL they live in Redis
+# (requires the redis package), which should evict with an LRU maxmemory-policy.
+# Otherwise every kind of result gets its own small file-based cache, since culling a
+# file-based cache walks its directory.
+
+PERSISTENT_CACHE_REDIS_URL = os.getenv("PERSISTENT_CACHE_REDIS_URL")
+PERSISTENT_CACHE_DIR = os.getenv("PERSISTENT_CACHE_DIR", "/tmp/tutorai/cache")
+
+
+def persistent_cache(name: str, max_entries: int) -> dict:
+    if PERSISTENT_CACHE_REDIS_URL:
+        return {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": PERSISTENT_CACHE_REDIS_URL,
+            "TIMEOUT": None,
+            "KEY_PREFIX": name,
+        }
+    return {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(PERSISTENT_CACHE_DIR, name),
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": max_entries},
+    }
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "embeddings": persistent_cache("embeddings", 20000),
+    "flashcards": persistent_cache("flashcards", 5000),
+    "compendiums": persistent_cache("compendiums", 5000),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 